@@ -0,0 +1,396 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Optional
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.policies import MultiInputActorCriticPolicy
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from environment.carrier_robot_gym.features import policy_kwargs as extractor_policy_kwargs
+from environment.carrier_robot_gym.profiling import PROFILER
+from environment.carrier_robot_gym.shared_vec_env import _SharedArrays
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+
+
+def _slot_specs(observation_space, num_slots: int, unroll: int, num_envs: int, num_params: int) -> dict:
+    """
+    Общая память: num_slots слотов под отрезки траекторий (unroll шагов num_envs сред; наблюдений на одно
+    больше - последнее для бутстрепа) и снимок весов политики с номером версии.
+    """
+    specs = {'actions': ('int64', (num_slots, unroll, num_envs)),
+             'log_probs': ('float32', (num_slots, unroll, num_envs)),
+             'rewards': ('float32', (num_slots, unroll, num_envs)),
+             'dones': ('bool', (num_slots, unroll, num_envs)),
+             # Версия весов, которой собран слот, завершенные эпизоды и победы в нем
+             'slot_version': ('int64', (num_slots,)), 'episodes': ('int64', (num_slots,)),
+             'wins': ('int64', (num_slots,)),
+             'weights': ('float32', (num_params,)), 'weights_version': ('int64', (1,))}
+    for key, space in observation_space.spaces.items():
+        specs[f'obs_{key}'] = (space.dtype.str, (num_slots, unroll + 1, num_envs, *space.shape))
+    return specs
+
+
+def _actor(raw, specs: dict, env_kwargs: dict, policy_kwargs: dict, num_envs: int, unroll: int, gamma: float,
+           seed: int, free, full, weights_lock, stop) -> None:
+    """
+    Актор: своя векторная среда и копия политики. Берет свободный слот, при новой версии весов
+    обновляет копию, пишет в слот unroll шагов (действия выбираются выборкой, как в PPO) и отдает
+    его ученику. Завершение - событие stop или None в очереди свободных слотов.
+    """
+    torch.set_num_threads(1)
+    shared = _SharedArrays(specs, raw)
+    env = CarrierRobotVecEnv(num_envs, seed=seed, reuse_obs=True, **env_kwargs)
+    policy = MultiInputActorCriticPolicy(env.observation_space, env.action_space, lambda _: 0.0, **policy_kwargs)
+    policy.set_training_mode(False)
+    keys = list(env.observation_space.spaces)
+    version = -1
+    obs = env.reset()
+    try:
+        while not stop.is_set() and (slot := free.get()) is not None:
+            if shared['weights_version'][0] != version:
+                with weights_lock:
+                    version = int(shared['weights_version'][0])
+                    weights = torch.from_numpy(shared['weights'].copy())
+                vector_to_parameters(weights, policy.parameters())
+            shared['slot_version'][slot] = version
+            episodes = wins = 0
+
+            for t in range(unroll):
+                for key in keys:
+                    shared[f'obs_{key}'][slot, t] = obs[key]
+                with torch.no_grad():
+                    distribution = policy.get_distribution(policy.obs_to_tensor(obs)[0])
+                    actions = distribution.get_actions()
+                    log_probs = distribution.log_prob(actions)
+                shared['actions'][slot, t] = actions.numpy()
+                shared['log_probs'][slot, t] = log_probs.numpy()
+
+                obs, rewards, dones, infos = env.step(actions.numpy())
+                for i in np.flatnonzero(dones):
+                    episodes += 1
+                    wins += bool(infos[i].get('win'))
+                    if infos[i].get('TimeLimit.truncated'):
+                        # Эпизод прерван лимитом шагов: ценность последнего состояния в награду, как в PPO SB3
+                        with torch.no_grad():
+                            terminal = policy.obs_to_tensor(infos[i]['terminal_observation'])[0]
+                            rewards[i] += gamma * policy.predict_values(terminal)[0, 0].item()
+                shared['rewards'][slot, t] = rewards
+                shared['dones'][slot, t] = dones
+
+            for key in keys:
+                shared[f'obs_{key}'][slot, unroll] = obs[key]
+            shared['episodes'][slot] = episodes
+            shared['wins'][slot] = wins
+            full.put(slot)
+    finally:
+        env.close()
+
+
+def vtrace(log_rhos: torch.Tensor, discounts: torch.Tensor, rewards: torch.Tensor, values: torch.Tensor,
+           bootstrap: torch.Tensor, rho_bar: float = 1.0, c_bar: float = 1.0) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    V-trace (IMPALA): цели ценности vs и преимущества для градиента политики по отрезкам (T, B),
+    собранным устаревшими весами. log_rhos - log pi(a|s) - log mu(a|s), discounts - gamma * (1 - done).
+    """
+    with torch.no_grad():
+        rhos = log_rhos.exp()
+        clipped_rhos = rhos.clamp(max=rho_bar)
+        cs = rhos.clamp(max=c_bar)
+        next_values = torch.cat([values[1:], bootstrap[None]])
+        deltas = clipped_rhos * (rewards + discounts * next_values - values)
+
+        corrections = torch.zeros_like(values)
+        acc = torch.zeros_like(bootstrap)
+        for t in reversed(range(len(values))):
+            acc = deltas[t] + discounts[t] * cs[t] * acc
+            corrections[t] = acc
+        vs = values + corrections
+        next_vs = torch.cat([vs[1:], bootstrap[None]])
+        advantages = clipped_rhos * (rewards + discounts * next_vs - values)
+    return vs, advantages
+
+
+class _SuccessRate:
+    """Доля побед среди последних window завершенных эпизодов (по счетчикам отрезков или шагов)."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.parts: collections.deque = collections.deque()
+        self.episodes = 0
+        self.wins = 0
+
+    def add(self, episodes: int, wins: int) -> None:
+        if not episodes:
+            return
+        self.parts.append((episodes, wins))
+        self.episodes += episodes
+        self.wins += wins
+        while self.episodes - self.parts[0][0] >= self.window:
+            episodes, wins = self.parts.popleft()
+            self.episodes -= episodes
+            self.wins -= wins
+
+    @property
+    def value(self) -> Optional[float]:
+        return self.wins / self.episodes if self.episodes >= self.window else None
+
+
+def learn_async(total_timesteps: int = 1_000_000, width: int = 5, height: int = 5, num_actors: Optional[int] = None,
+                envs_per_actor: int = 16, unroll: int = 32, batch_unrolls: int = 2, queue_slots: Optional[int] = None,
+                learning_rate: float = 3e-4, gamma: float = 0.99, ent_coef: float = 0.01, vf_coef: float = 0.5,
+                max_grad_norm: float = 0.5, rho_bar: float = 1.0, c_bar: float = 1.0, extractor: str = 'flatten',
+                max_episode_steps: Optional[int] = None, target_success: Optional[float] = None,
+                success_window: int = 500, time_limit: Optional[float] = None, seed: int = 0,
+                verbose: int = 1) -> tuple[PPO, dict]:
+    """
+    Асинхронное обучение в духе IMPALA на CPU: num_actors процессов шагают свои CarrierRobotVecEnv
+    и пишут отрезки траекторий в слоты общей памяти, ученик обновляет сеть по batch_unrolls отрезкам,
+    как только они готовы, и публикует веса. Акторы не ждут обновления, ученик не ждет шагов сред
+    (пока в очереди есть отрезки), поправка на устаревшие веса - V-trace. Очередь ограничена queue_slots
+    слотами: если ученик отстает, акторы ждут свободный слот вместо накопления старых траекторий.
+    Остановка по total_timesteps, time_limit секунд или доле побед target_success среди последних
+    success_window эпизодов. Возвращает модель PPO (сохраняется и загружается как обычно) и отчет.
+    """
+    start = time.perf_counter()
+    num_actors = num_actors or max(1, (os.cpu_count() or 2) - 1)
+    queue_slots = queue_slots or 2 * num_actors
+    if queue_slots < batch_unrolls:
+        raise ValueError('queue_slots must be at least batch_unrolls')
+    torch.manual_seed(seed)
+    env_kwargs = {'width': width, 'height': height, 'max_episode_steps': max_episode_steps}
+    policy_kwargs = extractor_policy_kwargs(extractor)
+    # Модель PPO только ради политики, оптимизатора и сохранения: свой сбор роллаутов у нее не вызывается
+    model = PPO('MultiInputPolicy', CarrierRobotVecEnv(1, **env_kwargs), n_steps=unroll, batch_size=unroll,
+                learning_rate=learning_rate, gamma=gamma, policy_kwargs=policy_kwargs, device='cpu', seed=seed)
+    policy = model.policy
+    optimizer = policy.optimizer
+
+    # spawn: форк процесса с уже запущенными потоками torch может зависнуть
+    context = multiprocessing.get_context('spawn')
+    params = parameters_to_vector(policy.parameters()).detach()
+    specs = _slot_specs(policy.observation_space, queue_slots, unroll, envs_per_actor, len(params))
+    shared = _SharedArrays(specs, context=context)
+    shared['weights'][:] = params.numpy()
+    weights_lock = context.Lock()
+    stop = context.Event()
+    free, full = context.Queue(), context.Queue()
+    for slot in range(queue_slots):
+        free.put(slot)
+    actors = [context.Process(target=_actor, daemon=True,
+                              args=(shared.raw, specs, env_kwargs, policy_kwargs, envs_per_actor, unroll, gamma,
+                                    seed + 1 + a, free, full, weights_lock, stop))
+              for a in range(num_actors)]
+    for actor in actors:
+        actor.start()
+
+    keys = list(policy.observation_space.spaces)
+    success = _SuccessRate(success_window)
+    timesteps = updates = lag_sum = 0
+    time_to_target = steps_to_target = None
+    last_log = time.perf_counter()
+    try:
+        while timesteps < total_timesteps:
+            if time_limit is not None and time.perf_counter() - start >= time_limit:
+                break
+            wait_start = time.perf_counter()
+            slots = []
+            while len(slots) < batch_unrolls:
+                try:
+                    slots.append(full.get(timeout=1.0))
+                except queue.Empty:
+                    if not any(actor.is_alive() for actor in actors):
+                        raise RuntimeError('All actors exited')
+            if PROFILER.enabled:
+                PROFILER.add_time('learner.wait', time.perf_counter() - wait_start)
+            update_start = time.perf_counter()
+
+            # Копия слотов и сразу возврат акторам: следующие отрезки пишутся, пока идет обновление
+            batch = {name: np.concatenate([shared[name][slot] for slot in slots], axis=1)
+                     for name in ('actions', 'log_probs', 'rewards', 'dones')}
+            obs = {key: np.concatenate([shared[f'obs_{key}'][slot] for slot in slots], axis=1) for key in keys}
+            for slot in slots:
+                success.add(int(shared['episodes'][slot]), int(shared['wins'][slot]))
+                lag_sum += updates - int(shared['slot_version'][slot])
+                free.put(slot)
+
+            steps, count = batch['actions'].shape
+            obs_tensor = {key: torch.as_tensor(value.reshape(-1, *value.shape[2:])) for key, value in obs.items()}
+            actions = torch.as_tensor(batch['actions'].reshape(-1))
+            rewards = torch.as_tensor(batch['rewards'])
+            discounts = gamma * (1 - torch.as_tensor(batch['dones']).float())
+
+            # Один проход сети по всем unroll + 1 наблюдениям: ценности всех, распределение действий первых unroll
+            latent_pi, latent_vf = policy.mlp_extractor(policy.extract_features(obs_tensor))
+            all_values = policy.value_net(latent_vf).reshape(steps + 1, count)
+            distribution = policy._get_action_dist_from_latent(latent_pi[:steps * count])
+            log_probs = distribution.log_prob(actions).reshape(steps, count)
+            entropy = distribution.entropy()
+            values = all_values[:-1]
+            vs, advantages = vtrace(log_probs.detach() - torch.as_tensor(batch['log_probs']), discounts, rewards,
+                                    values.detach(), all_values[-1].detach(), rho_bar, c_bar)
+
+            policy_loss = -(advantages * log_probs).mean()
+            value_loss = 0.5 * ((vs - values) ** 2).mean()
+            loss = policy_loss + vf_coef * value_loss - ent_coef * entropy.mean()
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(policy.parameters(), max_grad_norm)
+            optimizer.step()
+
+            updates += 1
+            with weights_lock:
+                shared['weights'][:] = parameters_to_vector(policy.parameters()).detach().numpy()
+                shared['weights_version'][0] = updates
+            timesteps += steps * count
+            if PROFILER.enabled:
+                PROFILER.add_time('learner.update', time.perf_counter() - update_start)
+
+            rate = success.value
+            if time_to_target is None and target_success is not None and rate is not None and rate >= target_success:
+                time_to_target, steps_to_target = time.perf_counter() - start, timesteps
+                break
+            if verbose and time.perf_counter() - last_log >= 10:
+                last_log = time.perf_counter()
+                print(f'async: {timesteps} steps, {timesteps / (last_log - start):.0f} steps/s, '
+                      f'success {rate if rate is not None else float("nan"):.3f}, '
+                      f'policy lag {lag_sum / max(updates * batch_unrolls, 1):.2f} updates', flush=True)
+    finally:
+        stop.set()
+        for _ in actors:
+            free.put(None)
+        for actor in actors:
+            actor.join(timeout=10)
+            if actor.is_alive():
+                actor.terminate()
+
+    seconds = time.perf_counter() - start
+    model.num_timesteps = timesteps
+    report = {'mode': f'async {num_actors}x{envs_per_actor}', 'timesteps': timesteps, 'seconds': seconds,
+              'samples_per_sec': timesteps / seconds, 'time_to_target': time_to_target,
+              'steps_to_target': steps_to_target, 'success_rate': success.value, 'updates': updates,
+              'policy_lag': lag_sum / max(updates * batch_unrolls, 1)}
+    return model, report
+
+
+class SuccessTargetCallback(BaseCallback):
+    """
+    Доля побед среди последних window эпизодов синхронного PPO.learn: время и шаги до target_success,
+    остановка при достижении цели или через time_limit секунд - для сравнения с learn_async.
+    """
+
+    def __init__(self, target_success: Optional[float] = None, window: int = 500, time_limit: Optional[float] = None,
+                 start: Optional[float] = None, verbose: int = 0):
+        super().__init__(verbose)
+        self.target_success = target_success
+        self.time_limit = time_limit
+        self.success = _SuccessRate(window)
+        self.start = start
+        self.time_to_target: Optional[float] = None
+        self.steps_to_target: Optional[int] = None
+
+    def _on_training_start(self) -> None:
+        self.start = self.start or time.perf_counter()
+
+    def _on_step(self) -> bool:
+        done = np.flatnonzero(self.locals['dones'])
+        if len(done):
+            infos = self.locals['infos']
+            self.success.add(len(done), sum(bool(infos[i].get('win')) for i in done))
+        elapsed = time.perf_counter() - self.start
+        rate = self.success.value
+        if self.target_success is not None and rate is not None and rate >= self.target_success:
+            self.time_to_target, self.steps_to_target = elapsed, self.num_timesteps
+            return False
+        return self.time_limit is None or elapsed < self.time_limit
+
+
+def learn_sync(total_timesteps: int = 1_000_000, width: int = 5, height: int = 5, n_envs: int = 16,
+               extractor: str = 'flatten', max_episode_steps: Optional[int] = None,
+               target_success: Optional[float] = None, success_window: int = 500, time_limit: Optional[float] = None,
+               seed: int = 0, **ppo_kwargs) -> tuple[PPO, dict]:
+    """Синхронный PPO.learn на CarrierRobotVecEnv с тем же отчетом, что у learn_async."""
+    start = time.perf_counter()
+    env = CarrierRobotVecEnv(n_envs, width=width, height=height, max_episode_steps=max_episode_steps, seed=seed)
+    model = PPO('MultiInputPolicy', env, policy_kwargs=extractor_policy_kwargs(extractor), device='cpu', seed=seed,
+                **ppo_kwargs)
+    callback = SuccessTargetCallback(target_success, success_window, time_limit, start)
+    model.learn(total_timesteps, callback=callback)
+    seconds = time.perf_counter() - start
+    report = {'mode': f'sync {n_envs}', 'timesteps': model.num_timesteps, 'seconds': seconds,
+              'samples_per_sec': model.num_timesteps / seconds, 'time_to_target': callback.time_to_target,
+              'steps_to_target': callback.steps_to_target, 'success_rate': callback.success.value}
+    return model, report
+
+
+def compare(total_timesteps: int = 5_000_000, width: int = 5, height: int = 5, target_success: float = 0.8,
+            time_limit: Optional[float] = 600, num_actors: Optional[int] = None, envs_per_actor: int = 16,
+            n_envs: int = 16, max_episode_steps: Optional[int] = 100, extractor: str = 'flatten',
+            seed: int = 0) -> list[dict[str, Any]]:
+    """Синхронный PPO.learn и learn_async на одной задаче до одной доли побед, отчеты обоих."""
+    common = {'total_timesteps': total_timesteps, 'width': width, 'height': height, 'extractor': extractor,
+              'max_episode_steps': max_episode_steps, 'target_success': target_success, 'time_limit': time_limit,
+              'seed': seed}
+    reports = [learn_sync(n_envs=n_envs, **common)[1],
+               learn_async(num_actors=num_actors, envs_per_actor=envs_per_actor, **common)[1]]
+    return reports
+
+
+def format_reports(reports: list[dict]) -> str:
+    lines = [f'{"mode":16s} {"steps":>10s} {"seconds":>9s} {"steps/s":>9s} {"to target s":>12s} '
+             f'{"to target steps":>16s} {"success":>8s}']
+    for report in reports:
+        def show(value, spec):
+            return format(value, spec) if value is not None else '-'
+
+        lines.append(f'{report["mode"]:16s} {report["timesteps"]:10d} {report["seconds"]:9.1f} '
+                     f'{report["samples_per_sec"]:9.0f} {show(report["time_to_target"], "12.1f"):>12s} '
+                     f'{show(report["steps_to_target"], "16d"):>16s} {show(report["success_rate"], "8.3f"):>8s}')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Асинхронное обучение актор-ученик (V-trace) и сравнение с PPO.learn')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('train', 'Обучить асинхронно и сохранить модель'),
+                            ('compare', 'Синхронный PPO.learn и асинхронный режим до одной доли побед')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--size', type=int, default=5)
+        command.add_argument('--timesteps', type=int, default=5_000_000)
+        command.add_argument('--actors', type=int, help='По умолчанию число ядер минус одно')
+        command.add_argument('--envs-per-actor', type=int, default=16)
+        command.add_argument('--max-episode-steps', type=int, default=100)
+        command.add_argument('--extractor', default='flatten')
+        command.add_argument('--target', type=float, default=0.8, help='Доля побед для остановки')
+        command.add_argument('--time-limit', type=float, default=600)
+        command.add_argument('--seed', type=int, default=0)
+    commands.choices['train'].add_argument('--out', default='CarrierRobot async')
+    commands.choices['compare'].add_argument('--n-envs', type=int, default=16, help='Среды синхронного PPO')
+    commands.choices['compare'].add_argument('--json', help='Сохранить отчеты в JSON')
+    args = parser.parse_args(argv)
+
+    common = {'total_timesteps': args.timesteps, 'width': args.size, 'height': args.size,
+              'max_episode_steps': args.max_episode_steps, 'extractor': args.extractor,
+              'target_success': args.target, 'time_limit': args.time_limit, 'seed': args.seed}
+    if args.command == 'train':
+        model, report = learn_async(num_actors=args.actors, envs_per_actor=args.envs_per_actor, **common)
+        model.save(args.out)
+        print(format_reports([report]))
+        return
+
+    reports = compare(num_actors=args.actors, envs_per_actor=args.envs_per_actor, n_envs=args.n_envs, **common)
+    print(format_reports(reports))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
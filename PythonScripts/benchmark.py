@@ -0,0 +1,431 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.carrier_robot_gym import CarrierRobotEnv
+from environment.carrier_robot_gym.field import (free_cells_connected, generate_field, has_wall_access, is_connected,
+                                                 walls_accessible)
+from environment.carrier_robot_gym.large_map import LargeCarrierRobotEnv, generate_racks
+from environment.carrier_robot_gym.layout_bank import build_layout_bank
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+
+SIZES = (5, 10, 32, 64)
+VEC_WIDTHS = (1, 16, 256, 4096)
+BATCH_WIDTHS = (1, 16, 256)
+# Большие склады: кейсы large_* берут из --sizes размеры от 256, а если таких нет - эти
+LARGE_SIZES = (256, 1024, 4096)
+# Склады кейса policy_forward, если --sizes не задан
+POLICY_SIZES = (10, 64, 256)
+# Закоммиченная базовая линия для --compare. Пересобирается на опорной машине командой
+#   python benchmark.py --sizes 5 10 32 --widths 1 16 256 --save benchmarks/baseline.json
+# (ppo_predict берет модели из models/); на другой машине сравнивайте со своей базовой линией
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+# Кейс - функция (sizes, widths, wanted) -> итератор (имя, вызов, число операций за вызов[, доп. поля результата]).
+# wanted(имя) - нужен ли замер (фильтр -k): кейс проверяет его до того, как строить среду, банк или процессы
+Case = Callable[[tuple, tuple, Callable[[str], bool]], Iterator[tuple[str, Callable[[], None], int]]]
+CASES: dict[str, Case] = {}
+
+
+def case(func: Case) -> Case:
+    CASES[func.__name__] = func
+    return func
+
+
+def _reset_env(size: int, seed: int = 0) -> CarrierRobotEnv:
+    env = CarrierRobotEnv(width=size, height=size)
+    env.reset(seed=seed)
+    return env
+
+
+@case
+def env_step(sizes, widths, wanted):
+    for size in sizes:
+        if not wanted(f'{size}x{size}'):
+            continue
+        env = _reset_env(size)
+        start = (env.field.copy(), env.pos.copy(), env.target.copy())
+        actions = np.random.default_rng(0).integers(0, 5, 1024)
+        counter = iter(range(sys.maxsize))
+
+        def step(env=env, start=start, actions=actions, counter=counter):
+            _, _, terminated, _, _ = env.step(actions[next(counter) % len(actions)])
+            if terminated:
+                # Возврат к началу эпизода вместо reset, чтобы замер не включал генерацию склада
+                env.field[:], env.pos, env.target, env.time = start[0], start[1].copy(), start[2], 0
+
+        yield f'{size}x{size}', step, 1
+
+
+@case
+def env_reset(sizes, widths, wanted):
+    for size in sizes:
+        if wanted(f'{size}x{size}'):
+            yield f'{size}x{size}', _reset_env(size).reset, 1
+
+
+@case
+def env_get_obs(sizes, widths, wanted):
+    for size in sizes:
+        if wanted(f'{size}x{size}'):
+            yield f'{size}x{size}', _reset_env(size).get_obs, 1
+
+
+@case
+def generate_field_single(sizes, widths, wanted):
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        if wanted(f'{size}x{size}'):
+            yield f'{size}x{size}', lambda size=size: generate_field(size, size, 0.25, rng=rng), 1
+
+
+@case
+def field_checks(sizes, widths, wanted):
+    for size in sizes:
+        checks = [f'{check}[{size}x{size}]' for check in
+                  ('is_connected', 'has_wall_access', 'free_cells_connected', 'walls_accessible')]
+        if not any(wanted(label) for label in checks):
+            continue
+        grid = generate_field(size, size, 0.25, rng=np.random.default_rng(0))
+        rows = grid.tolist()
+        batch = grid[None]
+        calls = (lambda rows=rows: is_connected(rows, 0), lambda rows=rows: has_wall_access(rows),
+                 lambda batch=batch: free_cells_connected(batch), lambda batch=batch: walls_accessible(batch))
+        for label, call in zip(checks, calls):
+            if wanted(label):
+                yield label, call, 1
+
+
+def _bank(directory: str, size: int):
+    return build_layout_bank(os.path.join(directory, f'{size}.npy'), 256, size, size)
+
+
+@case
+def vec_env_step(sizes, widths, wanted):
+    # Сбросы берут склады из небольшого банка, иначе на больших полях замер меряет генерацию, а не шаг
+    with tempfile.TemporaryDirectory(prefix='layouts_') as directory:
+        for size in sizes:
+            bank = None
+            for width in widths:
+                label = f'{size}x{size}/n{width}'
+                if not wanted(label):
+                    continue
+                if bank is None:
+                    bank = _bank(directory, size)
+                env = CarrierRobotVecEnv(width, width=size, height=size, seed=0, layout_bank=bank)
+                env.reset()
+                actions = np.random.default_rng(0).integers(0, 5, (64, width))
+                counter = iter(range(sys.maxsize))
+
+                def step(env=env, actions=actions, counter=counter):
+                    env.step(actions[next(counter) % len(actions)])
+
+                yield label, step, width
+
+
+@case
+def shared_vec_env_step(sizes, widths, wanted):
+    # Шаг SharedMemoryVecEnv на 1, 2, 4... воркерах до числа ядер, ширина - наибольшая из заданных
+    from environment.carrier_robot_gym.shared_vec_env import SharedMemoryVecEnv
+
+    width = max(widths)
+    cores = os.cpu_count() or 1
+    workers = [count for count in (1, 2, 4, 8, 16, 32, 64) if count <= cores] + ([cores] if cores & (cores - 1) else [])
+    with tempfile.TemporaryDirectory(prefix='layouts_') as directory:
+        for size in sizes:
+            bank = None
+            actions = np.random.default_rng(0).integers(0, 5, (64, width))
+            for count in workers:
+                label = f'{size}x{size}/n{width}/w{count}'
+                if not wanted(label):
+                    continue
+                if bank is None:
+                    bank = _bank(directory, size)
+                # Банк передается путем: воркеры открывают один и тот же memmap
+                env = SharedMemoryVecEnv(width, count, width=size, height=size, seed=0, reuse_obs=True,
+                                         layout_bank=bank.path)
+                env.reset()
+                counter = iter(range(sys.maxsize))
+
+                def step(env=env, actions=actions, counter=counter):
+                    env.step(actions[next(counter) % len(actions)])
+
+                yield label, step, width
+                env.close()
+
+
+@case
+def vec_action_masks(sizes, widths, wanted):
+    for size in sizes:
+        for width in widths:
+            if not wanted(f'{size}x{size}/n{width}'):
+                continue
+            env = CarrierRobotVecEnv(width, width=size, height=size, seed=0)
+            env.reset()
+            yield f'{size}x{size}/n{width}', env.action_masks, width
+
+
+def _large_sizes(sizes: tuple) -> tuple:
+    return tuple(size for size in sizes if size >= 256) or LARGE_SIZES
+
+
+@case
+def large_env_step(sizes, widths, wanted):
+    for size in _large_sizes(sizes):
+        if not wanted(f'{size}x{size}'):
+            continue
+        env = LargeCarrierRobotEnv(size, size)
+        env.reset(seed=0)
+        actions = np.random.default_rng(0).integers(0, 5, 1024)
+        counter = iter(range(sys.maxsize))
+
+        def step(env=env, actions=actions, counter=counter):
+            _, _, terminated, _, _ = env.step(actions[next(counter) % len(actions)])
+            if terminated:
+                # Сброс большого склада не генерирует его заново, поэтому входит в замер
+                env.reset()
+
+        yield f'{size}x{size}', step, 1
+
+
+@case
+def large_env_reset(sizes, widths, wanted):
+    for size in _large_sizes(sizes):
+        labels = (f'{size}x{size}', f'{size}x{size}/new_layout')
+        if not any(wanted(label) for label in labels):
+            continue
+        env = LargeCarrierRobotEnv(size, size)
+        env.reset(seed=0)
+        if wanted(labels[0]):
+            yield labels[0], env.reset, 1
+        if wanted(labels[1]):
+            yield labels[1], lambda env=env: env.reset(options={'new_layout': True}), 1
+
+
+@case
+def generate_racks_single(sizes, widths, wanted):
+    rng = np.random.default_rng(0)
+    for size in _large_sizes(sizes):
+        if wanted(f'{size}x{size}'):
+            yield f'{size}x{size}', lambda size=size: generate_racks(size, size, rng=rng), 1
+
+
+@case
+def planner_tick(sizes, widths, wanted):
+    # Такт совместного планировщика после прогрева: поиски к стеллажам уже начаты, их состояние переиспользуется
+    from environment.carrier_robot_gym.multi_robot import MultiCarrierRobotEnv
+    from environment.carrier_robot_gym.planning import PlannerPolicy
+
+    for size in _large_sizes(sizes)[:2]:
+        layout = None
+        for count in (16, 64):
+            label = f'{size}x{size}/robots{count}'
+            if not wanted(label):
+                continue
+            if layout is None:
+                layout = generate_racks(size, size, rng=np.random.default_rng(0))
+            env = MultiCarrierRobotEnv(size, size, count_agents=count)
+            obs, _ = env.reset(seed=0, options={'layout': layout})
+            policy = PlannerPolicy(env)
+            for _ in range(20):
+                obs = env.step(policy(obs))[0]
+
+            def tick(env=env, policy=policy, obs=obs):
+                policy(obs)
+
+            yield label, tick, 1
+
+
+OBS_MODES = {
+    'copy': {},
+    'reuse': {'reuse_obs': True},
+    'compact_reuse': {'compact_obs': True, 'reuse_obs': True},
+    'window5': {'view_radius': 2, 'reuse_obs': True},
+}
+
+
+@case
+def vec_env_obs_modes(sizes, widths, wanted):
+    # Шаг векторной среды при разных режимах наблюдений, ширина - наибольшая из заданных
+    width = max(widths)
+    with tempfile.TemporaryDirectory(prefix='layouts_') as directory:
+        for size in sizes:
+            bank = None
+            actions = np.random.default_rng(0).integers(0, 5, (64, width))
+            for mode, kwargs in OBS_MODES.items():
+                if not wanted(f'{size}x{size}/n{width}/{mode}'):
+                    continue
+                if bank is None:
+                    bank = _bank(directory, size)
+                env = CarrierRobotVecEnv(width, width=size, height=size, seed=0, layout_bank=bank, **kwargs)
+                env.reset()
+                counter = iter(range(sys.maxsize))
+
+                def step(env=env, actions=actions, counter=counter):
+                    env.step(actions[next(counter) % len(actions)])
+
+                yield f'{size}x{size}/n{width}/{mode}', step, width
+
+
+@case
+def ppo_predict(sizes, widths, wanted):
+    from stable_baselines3 import PPO
+
+    for path in sorted(glob.glob('models/*.zip')):
+        name = path.rsplit('/', 1)[-1].split(' ')[1]
+        if not any(wanted(f'{name}/n{width}') for width in BATCH_WIDTHS):
+            continue
+        model = PPO.load(path, device='cpu')
+        size = model.observation_space['field'].shape
+        for width in BATCH_WIDTHS:
+            if not wanted(f'{name}/n{width}'):
+                continue
+            env = CarrierRobotVecEnv(width, width=size[1], height=size[0], seed=0)
+            obs = env.reset()
+            yield f'{name}/n{width}', lambda model=model, obs=obs: model.predict(obs, deterministic=True), width
+
+
+# Варианты политики для policy_forward: аргументы среды, extractor и его аргументы
+POLICY_VARIANTS = {
+    'flatten': ({}, 'flatten', {}),
+    'egocentric': ({}, 'egocentric', {}),
+    # Среда сама отдает окно: и вход сети не зависит от площади склада
+    'egocentric_window': ({'view_radius': 5}, 'egocentric', {'window_obs': True}),
+}
+
+
+@case
+def policy_forward(sizes, widths, wanted):
+    # Прямой проход политики: MLP по всему складу (как у чекпоинтов) против окна вокруг робота со свертками.
+    # Память - параметры и входной тензор пачки, у MLP по всему складу оба растут с его площадью
+    import torch
+    from stable_baselines3.common.policies import MultiInputActorCriticPolicy
+
+    from environment.carrier_robot_gym.features import policy_kwargs
+
+    for size in POLICY_SIZES if sizes == SIZES else sizes:
+        for width in BATCH_WIDTHS:
+            for variant, (env_kwargs, extractor, extractor_kwargs) in POLICY_VARIANTS.items():
+                if not wanted(f'{variant}/{size}x{size}/n{width}'):
+                    continue
+                env = CarrierRobotVecEnv(width, width=size, height=size, seed=0, **env_kwargs)
+                obs = env.reset()
+                policy = MultiInputActorCriticPolicy(env.observation_space, env.action_space, lambda _: 0.0,
+                                                     **policy_kwargs(extractor, **extractor_kwargs))
+                policy.set_training_mode(False)
+                obs_tensor = policy.obs_to_tensor(obs)[0]
+                memory = {'params': sum(p.numel() for p in policy.parameters()),
+                          'param_bytes': sum(p.numel() * p.element_size() for p in policy.parameters()),
+                          'input_bytes': sum(t.numel() * 4 for t in obs_tensor.values())}
+
+                def forward(policy=policy, obs=obs):
+                    with torch.no_grad():
+                        policy.predict(obs, deterministic=True)
+
+                yield f'{variant}/{size}x{size}/n{width}', forward, width, memory
+
+
+def measure(func: Callable[[], None], ops: int, min_time: float = 0.2, repeat: int = 5) -> dict:
+    """Медиана времени одной операции по нескольким замерам, каждый не короче min_time."""
+    func()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        calls *= 4
+    calls = max(1, int(calls * min_time / max(elapsed, 1e-9) / 10))
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        samples.append((time.perf_counter() - start) / (calls * ops))
+    median = statistics.median(samples)
+    return {'seconds_per_op': median, 'ops_per_sec': 1 / median, 'min': min(samples), 'calls': calls * repeat}
+
+
+def run(names: Optional[list[str]] = None, sizes: tuple = SIZES, widths: tuple = VEC_WIDTHS,
+        min_time: float = 0.2, match: Optional[str] = None) -> dict:
+    results = {}
+    for name in names or CASES:
+        def wanted(label: str, name: str = name) -> bool:
+            return not match or match in f'{name}[{label}]'
+
+        for label, func, ops, *extra in CASES[name](sizes, widths, wanted):
+            key = f'{name}[{label}]'
+            results[key] = measure(func, ops, min_time)
+            print(f'{key:55s} {results[key]["seconds_per_op"] * 1e6:12.2f} us/op {results[key]["ops_per_sec"]:14.0f} op/s'
+                  + ''.join(f' {field}={value}' for field, value in (extra[0] if extra else {}).items()))
+            if extra:
+                results[key].update(extra[0])
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.15) -> list[str]:
+    """Кейсы, ставшие медленнее базовой линии больше чем на threshold."""
+    regressions = []
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        ratio = result['seconds_per_op'] / base['seconds_per_op']
+        if ratio > 1 + threshold:
+            regressions.append(f'{key}: {ratio:.2f}x slower')
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Замеры производительности среды, генерации и инференса')
+    parser.add_argument('cases', nargs='*', help=f'Какие кейсы запускать (по умолчанию все): {", ".join(CASES)}')
+    parser.add_argument('-k', dest='match', help='Запускать только замеры, в имени которых есть подстрока')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--widths', type=int, nargs='+', default=VEC_WIDTHS)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--save', help='Сохранить результаты в JSON')
+    parser.add_argument('--compare', nargs='?', const=BASELINE,
+                        help=f'Базовая линия JSON для поиска регрессий (без пути - {os.path.relpath(BASELINE)})')
+    parser.add_argument('--threshold', type=float, default=0.15)
+    args = parser.parse_args(argv)
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f'unknown cases: {", ".join(sorted(unknown))}')
+
+    results = run(args.cases, tuple(args.sizes), tuple(args.widths), args.min_time, args.match)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print('REGRESSION', line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
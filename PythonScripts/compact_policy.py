@@ -0,0 +1,313 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Optional
+
+import gymnasium
+import numpy as np
+
+FORMAT = 'carrier-robot-policy'
+FORMAT_VERSION = 1
+# Смещения тензоров в файле весов выровнены, чтобы представления memmap были выровнены по кэш-линии
+ALIGNMENT = 64
+ACTIVATIONS = {'Tanh': 'tanh', 'ReLU': 'relu'}
+# CarrierRobot v61 5x5 240m.zip -> версия, размер склада, шаги обучения
+CHECKPOINT_NAME = re.compile(r'(v\d+)\s+(\d+)x(\d+)\s+(\S+?)(?:\.zip)?$')
+
+
+def _policy_layers(policy) -> tuple[list[dict], dict[str, np.ndarray]]:
+    """Ветка действий политики SB3 как список операций и тензоры float32 для них."""
+    import torch
+
+    from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY, CELL_OUTSIDE
+    from environment.carrier_robot_gym.features import EgocentricExtractor
+
+    extractor = policy.pi_features_extractor
+    extractors = getattr(extractor, 'extractors', {})
+    if isinstance(extractor, EgocentricExtractor):
+        # Окно вокруг робота -> свертки -> признаки окна вместе с направлением к цели. Коды клеток
+        # пишутся в манифест, чтобы загрузке не был нужен пакет среды (он импортирует torch)
+        layers = [{'op': 'egocentric', 'view_radius': extractor.view_radius, 'window_obs': extractor.window_obs,
+                   'cells': [CELL_EMPTY, CELL_BUSY, CELL_OUTSIDE]}]
+        modules = [*extractor.cnn, *extractor.linear]
+    elif extractors and all(isinstance(module, torch.nn.Flatten) for module in extractors.values()):
+        layers = [{'op': 'flatten', 'keys': list(extractors)}]
+        modules = []
+    else:
+        raise ValueError(f'Unsupported features extractor: {type(extractor).__name__}')
+
+    tensors = {}
+    modules += [*policy.mlp_extractor.policy_net, policy.action_net]
+    for index, module in enumerate(modules):
+        name = type(module).__name__
+        if isinstance(module, torch.nn.Linear):
+            tensors[f'linear{index}.weight'] = module.weight.detach().cpu().numpy().astype(np.float32)
+            tensors[f'linear{index}.bias'] = module.bias.detach().cpu().numpy().astype(np.float32)
+            layers.append({'op': 'linear', 'weight': f'linear{index}.weight', 'bias': f'linear{index}.bias'})
+        elif isinstance(module, torch.nn.Conv2d):
+            tensors[f'conv{index}.weight'] = module.weight.detach().cpu().numpy().astype(np.float32)
+            tensors[f'conv{index}.bias'] = module.bias.detach().cpu().numpy().astype(np.float32)
+            layers.append({'op': 'conv2d', 'weight': f'conv{index}.weight', 'bias': f'conv{index}.bias',
+                           'stride': module.stride[0], 'padding': module.padding[0]})
+        elif isinstance(module, torch.nn.Flatten):
+            # Только в сверточной ветке: к признакам окна добавляется направление к цели
+            layers.append({'op': 'flatten', 'append': 'compass'})
+        elif name in ACTIVATIONS:
+            layers.append({'op': ACTIVATIONS[name]})
+        else:
+            raise ValueError(f'Unsupported layer: {name}')
+    return layers, tensors
+
+
+def _space_manifest(space) -> dict:
+    return {key: {'shape': list(box.shape), 'dtype': box.dtype.str, 'low': box.low.min().item(),
+                  'high': box.high.max().item()}
+            for key, box in space.spaces.items()}
+
+
+def export_compact(checkpoint: str, out: str) -> dict:
+    """
+    Чекпоинт SB3 .zip -> out.json (манифест) + out.bin (тензоры float32 подряд, смещения в манифесте).
+    Возвращает манифест.
+    """
+    from stable_baselines3 import PPO
+
+    model = PPO.load(checkpoint, device='cpu')
+    layers, tensors = _policy_layers(model.policy)
+    base = out[:-5] if out.endswith('.json') else out
+    weights_path = base + '.bin'
+
+    entries = []
+    offset = 0
+    digest = hashlib.sha256()
+    with open(weights_path, 'wb') as f:
+        for name, tensor in tensors.items():
+            padding = -offset % ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+            data = np.ascontiguousarray(tensor).tobytes()
+            f.write(data)
+            digest.update(data)
+            entries.append({'name': name, 'shape': list(tensor.shape), 'dtype': tensor.dtype.str, 'offset': offset})
+            offset += len(data)
+
+    match = CHECKPOINT_NAME.search(os.path.basename(checkpoint))
+    field_shape = model.observation_space['field'].shape
+    manifest = {
+        'format': FORMAT,
+        'format_version': FORMAT_VERSION,
+        'version': match.group(1) if match else None,
+        'trained_steps': match.group(4) if match else None,
+        'source': os.path.basename(checkpoint),
+        'grid': list(field_shape),
+        'observation_space': _space_manifest(model.observation_space),
+        'actions': int(model.action_space.n),
+        'layers': layers,
+        'weights': os.path.basename(weights_path),
+        'weights_bytes': offset,
+        'weights_sha256': digest.hexdigest(),
+        'tensors': entries,
+    }
+    with open(base + '.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _egocentric(obs: dict[str, np.ndarray], radius: int, window_obs: bool,
+                cells: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Каналы окна (B, 4, 2r+1, 2r+1) и направление к цели (B, 2), как EgocentricExtractor.encode.
+    cells - коды свободной клетки, стеллажа и клетки за границей склада.
+    """
+    field = np.asarray(obs['field'])
+    pos = np.asarray(obs['pos'], dtype=np.int64)
+    delta = np.asarray(obs['target'], dtype=np.int64) - pos
+    batch = len(field)
+    if window_obs:
+        window = field
+    else:
+        height, width = field.shape[1:]
+        offsets = np.arange(-radius, radius + 1)
+        rows = pos[:, 0, None] + offsets
+        cols = pos[:, 1, None] + offsets
+        inside = ((rows >= 0) & (rows < height))[:, :, None] & ((cols >= 0) & (cols < width))[:, None, :]
+        values = field[np.arange(batch)[:, None, None], rows.clip(0, height - 1)[:, :, None],
+                       cols.clip(0, width - 1)[:, None, :]]
+        window = np.where(inside, values, cells[2])
+
+    grid = np.zeros((batch, 4, *window.shape[1:]), dtype=np.float32)
+    for channel, cell_type in enumerate(cells):
+        grid[:, channel] = window == cell_type
+    side = np.arange(-radius, radius + 1)
+    grid[:, 3] = (side[None, :, None] == delta[:, 0, None, None]) & (side[None, None, :] == delta[:, 1, None, None])
+    return grid, (delta / (np.abs(delta) + radius)).astype(np.float32)
+
+
+def _conv2d(x: np.ndarray, weight: np.ndarray, bias: np.ndarray, stride: int, padding: int) -> np.ndarray:
+    """Свертка (B, C, H, W) ядром (O, C, k, k) через скользящие окна и einsum."""
+    kernel = weight.shape[2]
+    x = np.pad(x, ((0, 0), (0, 0), (padding, padding), (padding, padding)))
+    patches = np.lib.stride_tricks.sliding_window_view(x, (kernel, kernel), axis=(2, 3))[:, :, ::stride, ::stride]
+    return np.einsum('bchwij,ocij->bohw', patches, weight, optimize=True) + bias[:, None, None]
+
+
+class CompactPolicy:
+    """
+    Политика из компактного артефакта: прямой проход на NumPy без torch и SB3. Веса - представления
+    np.memmap только для чтения, поэтому процессы с одной политикой делят страницы кэша ОС,
+    а загрузка - чтение JSON и отображение файла. predict совместим с model.predict (в том числе
+    с маской действий, см. masking.masked_predict).
+    """
+
+    def __init__(self, path: str, verify: bool = False):
+        with open(path) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT or self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a compact policy manifest of version {FORMAT_VERSION}')
+        weights_path = os.path.join(os.path.dirname(path), self.manifest['weights'])
+        self._data = np.memmap(weights_path, dtype=np.uint8, mode='r')
+        if len(self._data) != self.manifest['weights_bytes']:
+            raise ValueError(f'{weights_path} size does not match the manifest')
+        self.tensors = {
+            entry['name']: np.frombuffer(self._data, dtype=entry['dtype'], offset=entry['offset'],
+                                         count=int(np.prod(entry['shape']))).reshape(entry['shape'])
+            for entry in self.manifest['tensors']
+        }
+        if verify:
+            digest = hashlib.sha256()
+            for tensor in self.tensors.values():
+                digest.update(tensor.tobytes())
+            if digest.hexdigest() != self.manifest['weights_sha256']:
+                raise ValueError(f'{weights_path} checksum does not match the manifest')
+
+        self.layers = self.manifest['layers']
+        self.version = self.manifest['version']
+        self.observation_space = gymnasium.spaces.Dict({
+            key: gymnasium.spaces.Box(low=space['low'], high=space['high'], shape=tuple(space['shape']),
+                                      dtype=np.dtype(space['dtype']))
+            for key, space in self.manifest['observation_space'].items()
+        })
+        self.action_space = gymnasium.spaces.Discrete(self.manifest['actions'])
+
+    def logits(self, obs: dict[str, np.ndarray]) -> np.ndarray:
+        """Логиты действий (B, actions) для пачки наблюдений."""
+        x = None
+        extra = {}
+        for layer in self.layers:
+            op = layer['op']
+            if op == 'flatten' and 'append' in layer:
+                x = np.concatenate([x.reshape(len(x), -1), extra[layer['append']]], axis=1)
+            elif op == 'flatten':
+                batch = len(obs[layer['keys'][0]])
+                x = np.concatenate([np.asarray(obs[key], dtype=np.float32).reshape(batch, -1)
+                                    for key in layer['keys']], axis=1)
+            elif op == 'egocentric':
+                x, compass = _egocentric(obs, layer['view_radius'], layer['window_obs'], layer['cells'])
+                extra = {'compass': compass}
+            elif op == 'conv2d':
+                x = _conv2d(x, self.tensors[layer['weight']], self.tensors[layer['bias']], layer['stride'],
+                            layer['padding'])
+            elif op == 'linear':
+                x = x @ self.tensors[layer['weight']].T + self.tensors[layer['bias']]
+            elif op == 'tanh':
+                np.tanh(x, out=x)
+            elif op == 'relu':
+                np.maximum(x, 0, out=x)
+            else:
+                raise ValueError(f'Unknown layer op: {op}')
+        return x
+
+    def __call__(self, obs: dict[str, np.ndarray]) -> np.ndarray:
+        """Детерминированные действия (B,) - как load_policy в inference_server.py."""
+        return self.logits(obs).argmax(axis=1)
+
+    def predict(self, obs: dict[str, np.ndarray], state=None, episode_start=None, deterministic: bool = False,
+                action_masks: Optional[np.ndarray] = None) -> tuple[np.ndarray, None]:
+        vectorized = np.ndim(obs['pos']) == 2
+        if not vectorized:
+            obs = {key: np.asarray(value)[None] for key, value in obs.items()}
+        logits = self.logits(obs)
+        if action_masks is not None:
+            logits = np.where(np.asarray(action_masks, dtype=bool).reshape(logits.shape), logits, -np.inf)
+        if deterministic:
+            actions = logits.argmax(axis=1)
+        else:
+            # Выбор по softmax методом Гумбеля
+            actions = (logits - np.log(-np.log(np.random.random(logits.shape)))).argmax(axis=1)
+        return (actions if vectorized else actions[0]), None
+
+
+def load_compact(path: str, verify: bool = False) -> CompactPolicy:
+    return CompactPolicy(path, verify)
+
+
+def load_model(path: str):
+    """Модель только для действий: манифест .json - CompactPolicy, иначе чекпоинт SB3 через PPO.load."""
+    if path.endswith('.json'):
+        return load_compact(path)
+    from stable_baselines3 import PPO
+
+    return PPO.load(path, device='cpu')
+
+
+def convert_all(checkpoints: list[str], out_dir: str) -> list[dict]:
+    """Пакетная конвертация: каждый чекпоинт -> out_dir/<имя без .zip>.json/.bin."""
+    os.makedirs(out_dir, exist_ok=True)
+    manifests = []
+    for checkpoint in checkpoints:
+        name = os.path.splitext(os.path.basename(checkpoint))[0]
+        manifest = export_compact(checkpoint, os.path.join(out_dir, name + '.json'))
+        manifests.append(manifest)
+        print(f'{checkpoint} -> {os.path.join(out_dir, name)}.json ({manifest["weights_bytes"]} bytes)', flush=True)
+    return manifests
+
+
+def _check(checkpoint: str, manifest_path: str, samples: int = 4096) -> dict:
+    """Сравнение с model.predict на случайных наблюдениях и время загрузки обоих форматов."""
+    from stable_baselines3 import PPO
+
+    start = time.perf_counter()
+    model = PPO.load(checkpoint, device='cpu')
+    zip_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    policy = load_compact(manifest_path)
+    compact_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(0)
+    obs = {key: rng.integers(int(space.low.min()), int(space.high.max()) + 1, (samples, *space.shape))
+           .astype(space.dtype) for key, space in model.observation_space.spaces.items()}
+    expected = model.predict(obs, deterministic=True)[0]
+    return {'checkpoint': os.path.basename(checkpoint), 'match': float((policy(obs) == expected).mean()),
+            'ppo_load_ms': zip_seconds * 1000, 'compact_load_ms': compact_seconds * 1000}
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Компактные артефакты политик: веса в memmap-файле и манифест JSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='Конвертировать чекпоинты .zip')
+    convert.add_argument('checkpoints', nargs='*', help='По умолчанию все models/*.zip')
+    convert.add_argument('--out', default='models/compact')
+    convert.add_argument('--check', action='store_true', help='Сверить действия с PPO.predict после конвертации')
+    info = commands.add_parser('info', help='Показать манифест')
+    info.add_argument('manifest')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        policy = load_compact(args.manifest, verify=True)
+        print(json.dumps({key: value for key, value in policy.manifest.items() if key != 'tensors'}, indent=2))
+        return
+
+    checkpoints = args.checkpoints or sorted(glob.glob('models/*.zip'))
+    convert_all(checkpoints, args.out)
+    if args.check:
+        for checkpoint in checkpoints:
+            name = os.path.splitext(os.path.basename(checkpoint))[0]
+            print(json.dumps(_check(checkpoint, os.path.join(args.out, name + '.json'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,4 @@
 from environment.carrier_robot_gym.carrier_robot_gym import CarrierRobotEnv
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+from environment.carrier_robot_gym.multi_robot import MultiCarrierRobotEnv
+from environment.carrier_robot_gym.large_map import LargeCarrierRobotEnv
@@ -4,46 +4,72 @@ from typing import Optional, Any, SupportsFloat, Dict
 import gymnasium
 import numpy as np
 from gymnasium.core import ActType, ObsType
-from matplotlib import pyplot as plt
 
+from environment.carrier_robot_gym.constants import CELL_EMPTY, CELL_BUSY, MOVES
 from environment.carrier_robot_gym.field import generate_field
-
-CELL_EMPTY = 0
-CELL_BUSY = 1
+from environment.carrier_robot_gym.layout_bank import open_layout_bank
+from environment.carrier_robot_gym.masking import valid_action_masks
+from environment.carrier_robot_gym.observation import ObservationBuffers
+from environment.carrier_robot_gym.paths import UNREACHABLE, LayoutDistances, get_distances
+from environment.carrier_robot_gym.profiling import profiled
+from environment.carrier_robot_gym.renderer import FrameViewer, GridRenderer
 
 
 class CarrierRobotEnv(gymnasium.Env):
     metadata = {'render_modes': ['human', 'rgb_array'], 'render_fps': 4}
 
-    def __init__(self, width: int = 10, height: int = 10, render_mode=None):
+    def __init__(self, width: int = 10, height: int = 10, render_mode=None, layout_bank=None,
+                 distance_shaping: float = 0.0, compact_obs: bool = False, view_radius: Optional[int] = None,
+                 reuse_obs: bool = False):
         super().__init__()
         if width <= 1 or height <= 1:
             raise ValueError('Height and width must be greater than 1')
 
+        # Путь к банку заранее сгенерированных складов (см. layout_bank.py) или None
+        self.layout_bank = open_layout_bank(layout_bank)
+        if self.layout_bank is not None and (self.layout_bank.height, self.layout_bank.width) != (height, width):
+            raise ValueError('Layout bank size does not match the field size')
+
         self.width = width
         self.height = height
         self.render_mode = render_mode
         self.time = 0
 
-        self.observation_space = gymnasium.spaces.Dict({
-            'field': gymnasium.spaces.Box(low=0, high=2, shape=(height, width), dtype=np.int8),
-            'pos': gymnasium.spaces.Box(low=0, high=max(width, height) - 1, shape=(2,), dtype=np.int64),
-            'target': gymnasium.spaces.Box(low=0, high=max(width, height) - 1, shape=(2,), dtype=np.int64),
-        })
+        # Наблюдения пишутся в заранее выделенные буферы (см. observation.py)
+        self._obs = ObservationBuffers(1, height, width, compact_obs, view_radius, reuse_obs)
+        self.observation_space = self._obs.space
         self.action_space = gymnasium.spaces.Discrete(5)
 
+        # Награда за каждый шаг, сокращающий кратчайший путь до цели (0 - без формирования награды)
+        self.distance_shaping = distance_shaping
+
         self.field = np.zeros((height, width), dtype=np.int8)
+        # Склад без робота - по нему считаются кратчайшие пути
+        self.layout = self.field.copy()
+        # Поля расстояний текущего склада: ищутся в кэше один раз за эпизод, а не на каждом шаге
+        self._distances = None
         self.pos = np.array([0, 0])
         self.target = np.array([0, 0])
         self.wall_density = 0.3
+        self._renderer = None
+        self._viewer = None
 
+    @profiled('env.reset')
     def reset(self, seed: Optional[int] = None, options: Optional[dict] = None) -> tuple[Dict, Any]:
         super().reset(seed=seed)
-        self.wall_density = random.uniform(0.2, 0.3)
-
-        self.field = self.generate_new_field(self.width, self.height)
-        self.field = np.array(generate_field(self.height, self.width, self.wall_density, 10000))
-
+        options = options or {}
+
+        if self.layout_bank is not None:
+            # options={'layout_index': i} - фиксированный склад из банка (для оценки)
+            index = options.get('layout_index')
+            if index is None:
+                index = self.layout_bank.sample_indices(self.np_random)
+            self.field = self.layout_bank[index]
+        else:
+            self.wall_density = self.np_random.uniform(0.2, 0.3)
+            self.field = generate_field(self.height, self.width, self.wall_density, 10000, self.np_random)
+        self.layout = self.field.copy()
+        self._distances = get_distances(self.layout) if self.distance_shaping else None
 
         self.target = self.find_random_cell(CELL_BUSY)
 
@@ -51,15 +77,14 @@ class CarrierRobotEnv(gymnasium.Env):
         self.pos = self.find_random_cell(CELL_EMPTY)
         self.field[tuple(self.pos)] = CELL_BUSY
 
-        # start TODO
-        # Поиск максимально отдаленной ячейки(для дообучения)
-        # self.target = self.find_the_most_remote_cell(self.pos, CELL_BUSY)
-
-        # end
+        if options.get('target') == 'remote':
+            # Поиск максимально отдаленного по пути стеллажа (для дообучения)
+            self.target = self.find_the_most_remote_cell(self.pos, CELL_BUSY)
 
         self.time = 0
         return self.get_obs(), {}
 
+    @profiled('env.step')
     def step(self, action: ActType) -> tuple[Dict, SupportsFloat, bool, bool, Dict]:
         direction = self.calculate_new_position(action)
         reward = 0
@@ -73,6 +98,8 @@ class CarrierRobotEnv(gymnasium.Env):
             info = {'win': True}
             return self.get_obs(), reward, terminated, False, info
 
+        distance = self.optimal_steps() if self.distance_shaping else 0
+
         if not self._is_valid_position(direction):
             reward = -11
             terminated = True
@@ -89,6 +116,8 @@ class CarrierRobotEnv(gymnasium.Env):
             terminated = True
             info = {'win': True}
 
+        if self.distance_shaping and distance != UNREACHABLE:
+            reward += self.distance_shaping * (distance - self.optimal_steps())
 
         reward -= 1.25 / (self.time + 1)
         self.time += 1
@@ -96,19 +125,22 @@ class CarrierRobotEnv(gymnasium.Env):
         return self.get_obs(), reward, terminated, False, info
 
     def render(self) -> Optional[np.ndarray]:
+        if self.render_mode not in ('human', 'rgb_array'):
+            return None
+        if self._renderer is None:
+            self._renderer = GridRenderer(self.height, self.width)
+        frame = self._renderer.draw(self.field, self.pos, self.target)
+
         if self.render_mode == 'human':
-            plt.clf()
-            plt.imshow(self.field, cmap='viridis', origin='lower')
-            plt.scatter(*self.pos[::-1], c='red', s=200, marker='s')
-            plt.scatter(*self.target[::-1], c='green', s=200, marker='s')
-            plt.title(f'Time: {self.time}')
-            plt.pause(0.1 / self.metadata['render_fps'])
-        elif self.render_mode == 'rgb_array':
-            return self.field.copy()
+            if self._viewer is None:
+                self._viewer = FrameViewer()
+            self._viewer.show(frame, f'Time: {self.time}', 0.1 / self.metadata['render_fps'])
+        else:
+            return frame.copy()
 
     def find_random_cell(self, cell_type: int) -> np.ndarray:
         positions = np.argwhere(self.field == cell_type)
-        return positions[np.random.choice(len(positions))]
+        return positions[self.np_random.choice(len(positions))]
 
     def _is_valid_position(self, pos: np.ndarray) -> np.ndarray[tuple[int, ...], np.dtype[bool]]:
         return (0 <= pos[0] < self.height) and (0 <= pos[1] < self.width)
@@ -118,13 +150,7 @@ class CarrierRobotEnv(gymnasium.Env):
         return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1]) == 1
 
     def calculate_new_position(self, action: int = 0) -> np.ndarray:
-        return np.clip(self.pos + [
-            (0, 0),  # Бездействие
-            (1, 0),  # Вниз
-            (0, 1),  # Вправо
-            (-1, 0),  # Вверх
-            (0, -1)  # Влево
-        ][action], -1, [self.height + 1, self.width + 1])
+        return np.clip(self.pos + MOVES[action], -1, [self.height + 1, self.width + 1])
 
     def generate_new_field(self, width, height) -> np.ndarray:
         wall_density = random.uniform(0.3, 0.5)
@@ -134,18 +160,30 @@ class CarrierRobotEnv(gymnasium.Env):
             field[tuple(pos)] = CELL_BUSY
         return field
 
+    @property
+    def distances(self) -> LayoutDistances:
+        """Поля расстояний склада текущего эпизода (без формирования награды - при первом обращении)."""
+        if self._distances is None:
+            self._distances = get_distances(self.layout)
+        return self._distances
+
     def find_the_most_remote_cell(self, center: np.ndarray[tuple[int, ...], np.dtype] ,cell_type: int):
-        cell = center
-        for i in range(self.height):
-            for j in range(self.width):
-                if self.field[i][j] == cell_type and \
-                    abs(i - center[0]) ** 2 + abs(j - center[1]) ** 2 > abs(cell[0] - center[0]) ** 2 + abs(cell[1] - center[1]) ** 2:
-                    cell = [i, j]
-        return cell
+        cell = self.distances.most_remote(center, cell_type)
+        return center if cell is None else cell
+
+    def optimal_steps(self) -> int:
+        """Длина кратчайшего пути от робота до цели по складу или UNREACHABLE."""
+        return self.distances.distance(self.pos, self.target)
+
+    def optimal_action(self) -> int:
+        """Действие кратчайшего пути к цели - базовая линия для сравнения с политикой."""
+        return self.distances.next_action(self.pos, self.target)
+
+    def action_masks(self) -> np.ndarray:
+        """Допустимые действия (5,): без выхода за поле и ходов в занятые клетки."""
+        return valid_action_masks(self.field[None], np.asarray(self.pos)[None])[0]
 
+    @profiled('env.get_obs')
     def get_obs(self) -> Dict:
-        return {
-            'field': self.field.copy(),
-            'pos': self.pos.copy(),
-            'target': self.target.copy()
-        }
\ No newline at end of file
+        self._obs.fill(self.field[None], self.pos[None], self.target[None])
+        return {key: value[0] for key, value in self._obs.get().items()}
@@ -0,0 +1,15 @@
+import numpy as np
+
+CELL_EMPTY = 0
+CELL_BUSY = 1
+# За границей склада (в окне наблюдения вокруг робота)
+CELL_OUTSIDE = 2
+
+# Смещения для действий 0-4
+MOVES = np.array([
+    (0, 0),  # Бездействие
+    (1, 0),  # Вниз
+    (0, 1),  # Вправо
+    (-1, 0),  # Вверх
+    (0, -1)  # Влево
+])
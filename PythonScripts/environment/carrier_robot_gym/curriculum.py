@@ -0,0 +1,152 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY, CELL_OUTSIDE
+from environment.carrier_robot_gym.field import generate_fields
+from environment.carrier_robot_gym.paths import UNREACHABLE, LayoutDistances
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv, sample_cells
+
+
+@dataclass(frozen=True)
+class CurriculumStage:
+    size: int
+    wall_density: tuple[float, float] = (0.2, 0.3)
+    # Наибольшая длина пути от старта до цели, None - цель любая
+    max_target_distance: Optional[int] = None
+
+
+DEFAULT_STAGES = (
+    CurriculumStage(5, (0.2, 0.25), 2),
+    CurriculumStage(5, (0.2, 0.3)),
+    CurriculumStage(8, (0.2, 0.3), 4),
+    CurriculumStage(8, (0.2, 0.3)),
+    CurriculumStage(10, (0.2, 0.3), 6),
+    CurriculumStage(10, (0.2, 0.3)),
+    CurriculumStage(16, (0.2, 0.3), 10),
+    CurriculumStage(16, (0.25, 0.3)),
+)
+
+
+class CurriculumScheduler:
+    """
+    Переход на следующий этап, когда доля побед за последние window эпизодов этапа не ниже promote_at.
+    Исходы хранятся в кольцевом буфере, поэтому учет пачки эпизодов - одна запись NumPy.
+    """
+
+    def __init__(self, stages: Sequence[CurriculumStage] = DEFAULT_STAGES, promote_at: float = 0.8,
+                 window: int = 2000):
+        self.stages = tuple(stages)
+        self.promote_at = promote_at
+        self.window = window
+        self.index = 0
+        self._outcomes = np.zeros(window, dtype=bool)
+        self._count = 0
+
+    @property
+    def stage(self) -> CurriculumStage:
+        return self.stages[self.index]
+
+    @property
+    def success_rate(self) -> float:
+        count = min(self._count, self.window)
+        return float(self._outcomes[:count].mean()) if count else 0.0
+
+    def record(self, wins: np.ndarray) -> None:
+        wins = np.asarray(wins, dtype=bool)[-self.window:]
+        slots = (self._count + np.arange(len(wins))) % self.window
+        self._outcomes[slots] = wins
+        self._count += len(wins)
+
+    def should_promote(self) -> bool:
+        return (self.index + 1 < len(self.stages) and self._count >= self.window
+                and self.success_rate >= self.promote_at)
+
+    def promote(self) -> CurriculumStage:
+        self.index += 1
+        self._count = 0
+        return self.stage
+
+
+class CurriculumVecEnv(CarrierRobotVecEnv):
+    """
+    Векторная среда с полем max_size x max_size, в котором каждый склад занимает левый верхний угол
+    своего размера, остальное - CELL_OUTSIDE. Пространство наблюдений не зависит от этапа, поэтому
+    одна политика учится на всех размерах (лучше всего с окном view_radius вокруг робота).
+    Новый этап применяется к эпизодам, начинающимся после set_stage.
+    """
+
+    def __init__(self, num_envs: int, max_size: int, stage: CurriculumStage = DEFAULT_STAGES[0],
+                 max_episode_steps: Optional[int] = None, seed: Optional[int] = None, **kwargs):
+        if stage.size > max_size:
+            raise ValueError('Stage size exceeds max_size')
+        self.stage = stage
+        super().__init__(num_envs, width=max_size, height=max_size, max_episode_steps=max_episode_steps,
+                         seed=seed, **kwargs)
+        self.dims = np.full((num_envs, 2), stage.size, dtype=np.int64)
+        self._bounds = self.dims
+
+    def set_stage(self, stage: CurriculumStage) -> None:
+        if stage.size > self.height:
+            raise ValueError('Stage size exceeds max_size')
+        self.stage = stage
+
+    def _reset_envs(self, indices: np.ndarray) -> None:
+        if len(indices) == 0:
+            return
+        size = self.stage.size
+        density = self._rng.uniform(*self.stage.wall_density, size=len(indices))
+        layouts = generate_fields(len(indices), size, size, density, rng=self._rng)
+        fields = np.full((len(indices), self.height, self.width), CELL_OUTSIDE, dtype=np.int8)
+        fields[:, :size, :size] = layouts
+        self.fields[indices] = fields
+        self.dims[indices] = size
+
+        pos = sample_cells(self._rng, fields == CELL_EMPTY)
+        if self.stage.max_target_distance is None:
+            target = sample_cells(self._rng, fields == CELL_BUSY)
+        else:
+            target = np.stack([self._near_shelf(layout, cell) for layout, cell in zip(layouts, pos)])
+        self.pos[indices] = pos
+        self.target[indices] = target
+        self.fields[indices, pos[:, 0], pos[:, 1]] = CELL_BUSY
+        self.time[indices] = 0
+
+    def _near_shelf(self, layout: np.ndarray, cell: np.ndarray) -> np.ndarray:
+        """Случайный стеллаж в пределах max_target_distance шагов (не соседний со стартом), иначе ближайший."""
+        distances = LayoutDistances(layout).shelf_distances(cell)
+        reachable = distances != UNREACHABLE
+        candidates = np.argwhere(reachable & (distances >= 1) & (distances <= self.stage.max_target_distance))
+        if len(candidates) == 0:
+            candidates = np.argwhere(reachable & (distances == distances[reachable].min())) if reachable.any() \
+                else np.argwhere(layout == CELL_BUSY)
+        return candidates[self._rng.integers(len(candidates))]
+
+
+class CurriculumCallback(BaseCallback):
+    """Передает исходы эпизодов планировщику и переключает этап среды CurriculumVecEnv."""
+
+    def __init__(self, scheduler: CurriculumScheduler, verbose: int = 0):
+        super().__init__(verbose)
+        self.scheduler = scheduler
+        # (шаг обучения, номер этапа) при каждом переходе
+        self.history: list[tuple[int, int]] = []
+
+    def _on_training_start(self) -> None:
+        self.training_env.env_method('set_stage', self.scheduler.stage)
+        self.history.append((self.num_timesteps, self.scheduler.index))
+
+    def _on_step(self) -> bool:
+        done = np.flatnonzero(self.locals['dones'])
+        if len(done):
+            infos = self.locals['infos']
+            self.scheduler.record(np.array(['win' in infos[i] for i in done]))
+            if self.scheduler.should_promote():
+                stage = self.scheduler.promote()
+                self.training_env.env_method('set_stage', stage)
+                self.history.append((self.num_timesteps, self.scheduler.index))
+                if self.verbose:
+                    print(f'Curriculum: stage {self.scheduler.index} {stage} at {self.num_timesteps} steps')
+        return True
@@ -0,0 +1,90 @@
+from typing import Sequence
+
+import gymnasium
+import torch
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+from torch import nn
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY, CELL_OUTSIDE
+
+# Каналы окна: свободно, занято, за границей склада, цель
+WINDOW_CHANNELS = 4
+
+
+def egocentric_window(field: torch.Tensor, pos: torch.Tensor, radius: int) -> torch.Tensor:
+    """
+    Окна (B, 2r+1, 2r+1) вокруг роботов из складов (B, H, W), клетки за границей - CELL_OUTSIDE.
+    Читаются только (2r+1)^2 клеток на робота, склад не копируется и не дополняется рамкой.
+    """
+    batch, height, width = field.shape
+    offsets = torch.arange(-radius, radius + 1, device=field.device)
+    rows = pos[:, 0, None] + offsets
+    cols = pos[:, 1, None] + offsets
+    inside = ((rows >= 0) & (rows < height))[:, :, None] & ((cols >= 0) & (cols < width))[:, None, :]
+    cells = field[torch.arange(batch, device=field.device)[:, None, None],
+                  rows.clamp(0, height - 1)[:, :, None], cols.clamp(0, width - 1)[:, None, :]]
+    return torch.where(inside, cells, torch.full_like(cells, CELL_OUTSIDE))
+
+
+class EgocentricExtractor(BaseFeaturesExtractor):
+    """
+    Признаки наблюдения CarrierRobotEnv без зависимости от размера склада: окно (2r+1, 2r+1) вокруг робота
+    (one-hot клеток и отметка цели, если она в окне) проходит через небольшую сверточную сеть,
+    а направление к цели - смещение target - pos, сжатое в (-1, 1) как d / (|d| + r).
+    Число параметров и стоимость прямого прохода не растут с площадью склада, поэтому веса, обученные
+    на 10x10, подходят складу любого размера: PPO.load(path, env=env,
+    custom_objects={'observation_space': env.observation_space}).
+    window_obs - поле наблюдения уже окно с роботом в центре (среды с view_radius), radius берется из него.
+    """
+
+    def __init__(self, observation_space: gymnasium.spaces.Dict, view_radius: int = 5,
+                 channels: Sequence[int] = (16, 32), features_dim: int = 64, window_obs: bool = False):
+        super().__init__(observation_space, features_dim)
+        if window_obs:
+            view_radius = observation_space['field'].shape[0] // 2
+        self.view_radius = view_radius
+        self.window_obs = window_obs
+
+        layers = []
+        in_channels = WINDOW_CHANNELS
+        for index, out_channels in enumerate(channels):
+            # Первая свертка сохраняет разрешение окна, следующие уменьшают его вдвое
+            layers += [nn.Conv2d(in_channels, out_channels, 3, stride=1 if index == 0 else 2, padding=1), nn.ReLU()]
+            in_channels = out_channels
+        self.cnn = nn.Sequential(*layers, nn.Flatten())
+        side = 2 * view_radius + 1
+        with torch.no_grad():
+            grid_features = self.cnn(torch.zeros(1, WINDOW_CHANNELS, side, side)).shape[1]
+        self.linear = nn.Sequential(nn.Linear(grid_features + 2, features_dim), nn.ReLU())
+
+    def encode(self, observations: dict[str, torch.Tensor]) -> tuple[torch.Tensor, torch.Tensor]:
+        """Каналы окна (B, 4, 2r+1, 2r+1) и направление к цели (B, 2)."""
+        radius = self.view_radius
+        pos = observations['pos'].long()
+        delta = observations['target'].long() - pos
+        window = observations['field'] if self.window_obs else egocentric_window(observations['field'], pos, radius)
+
+        # Отметка цели: клетка окна со смещением delta, вне окна - ни одной (без индексации маской для трассировки)
+        side = torch.arange(-radius, radius + 1, device=delta.device)
+        target = (side[None, :, None] == delta[:, 0, None, None]) & (side[None, None, :] == delta[:, 1, None, None])
+        grid = torch.stack([window == CELL_EMPTY, window == CELL_BUSY, window == CELL_OUTSIDE, target], dim=1)
+        return grid.float(), (delta / (delta.abs() + radius)).float()
+
+    def forward(self, observations: dict[str, torch.Tensor]) -> torch.Tensor:
+        grid, compass = self.encode(observations)
+        return self.linear(torch.cat([self.cnn(grid), compass], dim=1))
+
+
+EXTRACTORS = ('flatten', 'egocentric')
+
+
+def policy_kwargs(extractor: str = 'flatten', **extractor_kwargs) -> dict:
+    """
+    policy_kwargs для MultiInputPolicy: 'flatten' - по умолчанию SB3 (весь склад на вход MLP),
+    'egocentric' - EgocentricExtractor с аргументами extractor_kwargs.
+    """
+    if extractor == 'flatten':
+        return {}
+    if extractor == 'egocentric':
+        return {'features_extractor_class': EgocentricExtractor, 'features_extractor_kwargs': extractor_kwargs}
+    raise ValueError(f'Unknown features extractor: {extractor}, expected one of {", ".join(EXTRACTORS)}')
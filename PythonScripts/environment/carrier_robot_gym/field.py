@@ -1,6 +1,9 @@
-import random
 from collections import deque
 
+import numpy as np
+
+from environment.carrier_robot_gym.profiling import PROFILER, profiled
+
 
 def is_connected(grid, target=0):
     """Проверяет связность всех ячеек с заданным значением (0 или 1)."""
@@ -60,40 +63,131 @@ def has_wall_access(grid):
     return True
 
 
-def generate_field(rows, cols, wall_density, max_attempts=10000):
-    """Генерирует поле без рекурсии."""
-    for _ in range(max_attempts):
-        grid = [[1 if random.random() < wall_density else 0 for _ in range(cols)] for _ in range(rows)]
-
-        for r in range(rows):
-            for c in range(cols):
-                if grid[r][c] == 1:
-                    has_access = False
-                    for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                        nr, nc = r + dr, c + dc
-                        if 0 <= nr < rows and 0 <= nc < cols and grid[nr][nc] == 0:
-                            has_access = True
-                            break
-                    if not has_access:
-                        grid[r][c] = 0
-
-        # Проверяем связность нулей и доступность стен
-        if is_connected(grid, target=0) and has_wall_access(grid):
-            current_ones = sum(row.count(1) for row in grid)
-            target_ones = int(rows * cols * wall_density)
-            attempts = 0
-            while current_ones < target_ones and attempts < 1000:
-                r, c = random.randint(0, rows - 1), random.randint(0, cols - 1)
-                if grid[r][c] == 0:
-                    grid[r][c] = 1
-                    if has_wall_access(grid) and is_connected(grid, target=0):
-                        current_ones += 1
-                    else:
-                        grid[r][c] = 0
-                attempts += 1
-            return grid
-
-    raise RuntimeError(f"Не удалось сгенерировать поле за {max_attempts} попыток")
+# Кольцо из 8 соседей по часовой стрелке: С, СВ, В, ЮВ, Ю, ЮЗ, З, СЗ.
+# Соседние элементы кольца всегда смежны по стороне.
+_RING = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+_SIDES = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+_OUTSIDE = 2
+
+
+def free_cells_connected(grids):
+    """Проверяет связность нулей сразу для пачки полей (N, H, W) заливкой на массивах. Возвращает (N,) bool."""
+    free = grids == 0
+    count = len(free)
+    flat = free.reshape(count, -1)
+    reached = np.zeros_like(free)
+    reached.reshape(count, -1)[np.arange(count), flat.argmax(axis=1)] = flat.any(axis=1)
+
+    while True:
+        grown = reached.copy()
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown[:, :, 1:] |= reached[:, :, :-1]
+        grown[:, :, :-1] |= reached[:, :, 1:]
+        grown &= free
+        if np.array_equal(grown, reached):
+            break
+        reached = grown
+
+    return ~(free & ~reached).any(axis=(1, 2))
+
+
+def _free_neighbours(grids):
+    """Количество свободных соседей по стороне для каждой ячейки пачки полей."""
+    free = (grids == 0).astype(np.int8)
+    counts = np.zeros_like(free)
+    counts[:, 1:] += free[:, :-1]
+    counts[:, :-1] += free[:, 1:]
+    counts[:, :, 1:] += free[:, :, :-1]
+    counts[:, :, :-1] += free[:, :, 1:]
+    return counts
+
+
+def walls_accessible(grids):
+    """Проверяет, что в каждом поле пачки у каждой 1 есть сосед-0. Возвращает (N,) bool."""
+    return ~((grids == 1) & (_free_neighbours(grids) == 0)).any(axis=(1, 2))
+
+
+def _can_place_wall(grid, r, c):
+    """
+    Локальная проверка установки стены в свободную ячейку (r, c) поля с рамкой.
+    Стена должна иметь доступ, соседние стены не должны его потерять, а свободные соседи
+    должны оставаться связанными через кольцо вокруг ячейки (тогда связность всего поля сохраняется).
+    """
+    ring = [grid[r + dr][c + dc] == 0 for dr, dc in _RING]
+    if not (ring[0] or ring[2] or ring[4] or ring[6]):
+        return False
+
+    for dr, dc in _SIDES:
+        nr, nc = r + dr, c + dc
+        if grid[nr][nc] == 1 and not any(
+                grid[nr + ddr][nc + ddc] == 0 and (nr + ddr, nc + ddc) != (r, c) for ddr, ddc in _SIDES):
+            return False
+
+    if all(ring):
+        return True
+    start = ring.index(False)
+    arcs = 0
+    touches = False
+    for k in range(start + 1, start + 9):
+        if ring[k % 8]:
+            touches = touches or k % 2 == 0
+        else:
+            arcs += touches
+            touches = False
+    return arcs <= 1
+
+
+def _fill_walls(order, rows, cols, target_ones):
+    """Ставит стены в пустое поле в порядке order, пока не наберется target_ones, проверяя каждую установку локально."""
+    padded = [[_OUTSIDE] * (cols + 2)] + [[_OUTSIDE] + [0] * cols + [_OUTSIDE] for _ in range(rows)] + [[_OUTSIDE] * (cols + 2)]
+    current_ones = 0
+    tried = 0
+
+    for cell in order:
+        if current_ones >= target_ones:
+            break
+        tried += 1
+        r, c = cell // cols + 1, cell % cols + 1
+        if _can_place_wall(padded, r, c):
+            padded[r][c] = 1
+            current_ones += 1
+
+    if PROFILER.enabled:
+        # Проверенные ячейки, отвергнутые стены и склады, не добравшие плотность за max_attempts ячеек
+        PROFILER.count('field.cells_tried', tried)
+        PROFILER.count('field.walls_rejected', tried - current_ones)
+        PROFILER.count('field.layouts_short', int(current_ones < target_ones))
+    return np.array(padded, dtype=np.int8)[1:rows + 1, 1:cols + 1]
+
+
+@profiled('field.generate_fields')
+def generate_fields(count, rows, cols, wall_density, max_attempts=10000, rng=None):
+    """
+    Генерирует пачку полей (count, rows, cols) int8 с теми же гарантиями, что и generate_field:
+    свободные ячейки связны, у каждой стены есть свободный сосед.
+    wall_density - число или массив плотностей длины count, max_attempts - сколько ячеек пробуется под стены.
+    Вместо повторов случайная заготовка задает порядок: сначала пробуются ее стены, затем остальные ячейки.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    density = np.broadcast_to(np.asarray(wall_density, dtype=np.float64), (count,))
+
+    scores = rng.random((count, rows * cols))
+    scores += scores < density[:, None]
+    order = np.argsort(-scores, axis=1)[:, :max_attempts].tolist()
+
+    target_ones = (rows * cols * density).astype(int)
+    grids = np.empty((count, rows, cols), dtype=np.int8)
+    for i in range(count):
+        grids[i] = _fill_walls(order[i], rows, cols, target_ones[i])
+    if PROFILER.enabled:
+        PROFILER.count('field.layouts', count)
+    return grids
+
+
+def generate_field(rows, cols, wall_density, max_attempts=10000, rng=None):
+    """Генерирует поле (rows, cols) int8 без рекурсии."""
+    return generate_fields(1, rows, cols, wall_density, max_attempts, rng)[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY
+from environment.carrier_robot_gym.multi_robot import MultiCarrierRobotEnv
+from environment.carrier_robot_gym.paths import UNREACHABLE, get_distances
+
+# Стоимость назначения на недостижимый стеллаж
+UNREACHABLE_COST = 1e9
+
+
+@dataclass
+class PickTask:
+    id: int
+    shelf: tuple[int, int]
+    created: int
+    assigned: Optional[int] = None
+    robot: Optional[int] = None
+    done: Optional[int] = None
+
+
+class TaskQueue:
+    """Очередь заданий на подбор: задания приходят случайно со средней частотой rate в такт."""
+
+    def __init__(self, rng: np.random.Generator, rate: float = 0.5, max_pending: int = 1000):
+        self.rng = rng
+        self.rate = rate
+        self.max_pending = max_pending
+        self.pending: deque[PickTask] = deque()
+        self._next_id = 0
+
+    def generate(self, layout: np.ndarray, tick: int) -> None:
+        shelves = np.argwhere(layout == CELL_BUSY)
+        count = min(self.rng.poisson(self.rate), self.max_pending - len(self.pending))
+        for shelf in shelves[self.rng.choice(len(shelves), max(count, 0))]:
+            self.push(tuple(int(x) for x in shelf), tick)
+
+    def push(self, shelf: tuple[int, int], tick: int) -> PickTask:
+        task = PickTask(self._next_id, shelf, tick)
+        self._next_id += 1
+        self.pending.append(task)
+        return task
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+
+def hungarian(cost: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Венгерский алгоритм для прямоугольной матрицы стоимостей. Возвращает пары (строки, столбцы)."""
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.int64)  # match[j] - строка (с 1), назначенная столбцу j
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        min_v = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = ~used[1:] & (reduced < min_v[1:])
+            min_v[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(used[1:], np.inf, min_v[1:])
+            j1 = int(candidates.argmin()) + 1
+            delta = candidates[j1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            min_v[~used] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def _cost_matrix(layout: np.ndarray, positions: np.ndarray, tasks: list[PickTask]) -> np.ndarray:
+    """Длины кратчайших путей (роботы x задания) по кэшированным полям расстояний."""
+    distances = get_distances(layout)
+    cost = np.empty((len(positions), len(tasks)))
+    for k, task in enumerate(tasks):
+        steps = distances.to_shelf(task.shelf)[positions[:, 0], positions[:, 1]]
+        cost[:, k] = np.where(steps == UNREACHABLE, UNREACHABLE_COST, steps)
+    return cost
+
+
+def nearest_idle_dispatcher(layout: np.ndarray, positions: np.ndarray, tasks: list[PickTask]) -> list[tuple[int, int]]:
+    """Задания по очереди достаются ближайшему свободному роботу. Возвращает пары (робот, задание)."""
+    cost = _cost_matrix(layout, positions, tasks)
+    free = np.ones(len(positions), dtype=bool)
+    pairs = []
+    for k in range(min(len(tasks), len(positions))):
+        robot = int(np.where(free, cost[:, k], np.inf).argmin())
+        free[robot] = False
+        pairs.append((robot, k))
+    return pairs
+
+
+def hungarian_dispatcher(layout: np.ndarray, positions: np.ndarray, tasks: list[PickTask]) -> list[tuple[int, int]]:
+    """Назначение с минимальной суммой путей до стеллажей."""
+    rows, cols = hungarian(_cost_matrix(layout, positions, tasks))
+    return list(zip(rows.tolist(), cols.tolist()))
+
+
+DISPATCHERS: dict[str, Callable] = {
+    'nearest': nearest_idle_dispatcher,
+    'hungarian': hungarian_dispatcher,
+}
+
+
+class FleetOperator:
+    """
+    Длительная работа флота без сброса эпизода: роботы берут задания из очереди, дойдя до стеллажа,
+    освобождаются и получают новые. Свободные роботы стоят на месте.
+    Задание, не выполненное за task_timeout тактов, возвращается в начало очереди, а робот освобождается.
+    """
+
+    def __init__(self, env: MultiCarrierRobotEnv, policy: Callable[[dict], np.ndarray],
+                 dispatcher: Callable = hungarian_dispatcher, queue: Optional[TaskQueue] = None,
+                 tick_seconds: float = 1.0, task_timeout: Optional[int] = None):
+        env.reassign_targets = False
+        self.env = env
+        self.policy = policy
+        self.dispatcher = dispatcher
+        self.queue = queue if queue is not None else TaskQueue(env.np_random)
+        self.tick_seconds = tick_seconds
+        self.task_timeout = task_timeout
+
+        self.tasks: list[Optional[PickTask]] = [None] * env.count_agents
+        self.completed: list[PickTask] = []
+        self.tick = 0
+        self.collisions = 0
+        self.timeouts = 0
+        self.idle_ticks = 0
+        self.obs = None
+
+    def reset(self, **kwargs) -> None:
+        self.obs, _ = self.env.reset(**kwargs)
+        self.tasks = [None] * self.env.count_agents
+        self.completed.clear()
+        self.tick = self.collisions = self.timeouts = self.idle_ticks = 0
+
+    def _dispatch(self) -> None:
+        idle = [i for i, task in enumerate(self.tasks) if task is None]
+        if not idle or not self.queue.pending:
+            return
+        # Задания раздаются по порядку очереди: рассматривается ее голова по числу свободных роботов
+        tasks = list(islice(self.queue.pending, len(idle)))
+        for robot, k in self.dispatcher(self.env.layout, self.env.pos[idle], tasks):
+            task = tasks[k]
+            task.assigned, task.robot = self.tick, idle[robot]
+            self.tasks[idle[robot]] = task
+            self.env.target[idle[robot]] = task.shelf
+            self.queue.pending.remove(task)
+        self.obs = self.env.get_obs()
+
+    def run(self, ticks: int) -> dict:
+        if self.obs is None:
+            self.reset()
+        for _ in range(ticks):
+            self.queue.generate(self.env.layout, self.tick)
+            self._dispatch()
+
+            busy = self.busy
+            actions = np.where(busy, self.policy(self.obs), 0)
+            self.obs, _, terminated, _, infos = self.env.step(actions)
+            self.tick += 1
+            self.idle_ticks += int((~busy).sum())
+
+            for i in np.nonzero(terminated & busy)[0]:
+                if 'win' in infos[i]:
+                    self.tasks[i].done = self.tick
+                    self.completed.append(self.tasks[i])
+                    self.tasks[i] = None
+                else:
+                    self.collisions += 1
+
+            if self.task_timeout is not None:
+                self._release_stuck()
+        return self.metrics()
+
+    @property
+    def busy(self) -> np.ndarray:
+        """Маска (N,) роботов с заданием, свободные стоят на месте."""
+        return np.array([task is not None for task in self.tasks])
+
+    def _release_stuck(self) -> None:
+        for i, task in enumerate(self.tasks):
+            if task is not None and self.tick - task.assigned >= self.task_timeout:
+                task.assigned = task.robot = None
+                self.queue.pending.appendleft(task)
+                self.tasks[i] = None
+                self.timeouts += 1
+
+    def metrics(self) -> dict:
+        hours = self.tick * self.tick_seconds / 3600
+        # Время до подбора - от появления задания в очереди до прихода робота к стеллажу
+        pick_ticks = [task.done - task.created for task in self.completed]
+        return {
+            'ticks': self.tick,
+            'tasks_completed': len(self.completed),
+            'tasks_pending': len(self.queue),
+            'tasks_per_hour': len(self.completed) / hours if hours else 0.0,
+            'mean_time_to_pick': float(np.mean(pick_ticks)) * self.tick_seconds if pick_ticks else None,
+            'collisions': self.collisions,
+            'timeouts': self.timeouts,
+            'idle_fraction': self.idle_ticks / (self.tick * self.env.count_agents) if self.tick else 0.0,
+        }
@@ -0,0 +1,257 @@
+from typing import Any, Dict, Optional, SupportsFloat
+
+import gymnasium
+import numpy as np
+from gymnasium.core import ActType
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY, CELL_OUTSIDE, MOVES
+from environment.carrier_robot_gym.observation import coord_dtype
+from environment.carrier_robot_gym.profiling import profiled
+from environment.carrier_robot_gym.renderer import FrameViewer, GridRenderer
+
+
+def generate_racks(height: int, width: int, rack_length: int = 8, aisle_width: int = 2, fill: float = 0.6,
+                   rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Склад из двойных рядов стеллажей длиной rack_length между проходами шириной aisle_width.
+    Каждый стеллаж примыкает к продольному проходу, а поперечные проходы связывают все продольные,
+    поэтому проверки связности и доступа, как в generate_field, не нужны - генерация одна векторная
+    операция за O(H * W). fill - доля мест в рядах, занятых стеллажами.
+    """
+    rng = rng or np.random.default_rng()
+    rows = np.arange(height) % (aisle_width + 2)
+    racks = (rows >= aisle_width)[:, None] & (np.arange(width) % (rack_length + aisle_width) >= aisle_width)[None, :]
+    if rows[-1] == aisle_width + 1:
+        # Дальний ряд двойного стеллажа у нижнего края: прохода под ним нет, стеллажи были бы недоступны
+        racks[-1] = False
+    return (racks & (rng.random((height, width)) < fill)).astype(np.int8)
+
+
+class ChunkedField:
+    """
+    Склад, разбитый на квадратные блоки chunk x chunk. В складе только свободные клетки и стеллажи,
+    поэтому блок хранится битовой маской стеллажей (np.packbits по строкам, бит на клетку - в 8 раз
+    меньше плотного int8), а блоки без стеллажей не хранятся вовсе. Чтение клетки и окна вокруг робота
+    затрагивает не больше четырех блоков (при 2r+1 <= chunk) и не зависит от площади склада.
+    Случайная клетка выбирается по числам свободных клеток и стеллажей в блоках: блок - по накопленным
+    суммам (двоичный поиск), клетка - распаковкой одного блока, O(chunk^2) независимо от площади.
+    """
+
+    def __init__(self, field: np.ndarray, chunk: int = 64):
+        if not np.isin(field, (CELL_EMPTY, CELL_BUSY)).all():
+            raise ValueError('Layout may contain only empty cells and shelves')
+        self.height, self.width = field.shape
+        self.chunk = chunk
+        self.chunks: dict[tuple[int, int], np.ndarray] = {}
+        chunk_rows, chunk_cols = -(-self.height // chunk), -(-self.width // chunk)
+        shelves = np.zeros((chunk_rows, chunk_cols), dtype=np.int64)
+        areas = np.zeros((chunk_rows, chunk_cols), dtype=np.int64)
+        for row in range(0, self.height, chunk):
+            for col in range(0, self.width, chunk):
+                block = field[row:row + chunk, col:col + chunk] == CELL_BUSY
+                areas[row // chunk, col // chunk] = block.size
+                shelves[row // chunk, col // chunk] = block.sum()
+                if block.any():
+                    self.chunks[row // chunk, col // chunk] = np.packbits(block, axis=1)
+        # Накопленные числа клеток каждого вида по блокам в порядке строк
+        self._cumulative = {CELL_EMPTY: np.cumsum(areas - shelves), CELL_BUSY: np.cumsum(shelves)}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.nbytes for block in self.chunks.values()) + \
+            sum(counts.nbytes for counts in self._cumulative.values())
+
+    def _block_shape(self, chunk_row: int, chunk_col: int) -> tuple[int, int]:
+        return (min(self.chunk, self.height - chunk_row * self.chunk),
+                min(self.chunk, self.width - chunk_col * self.chunk))
+
+    def _unpack(self, chunk_row: int, chunk_col: int, rows: slice = slice(None)) -> np.ndarray:
+        """Маска стеллажей блока (или его строк rows) как int8 со значениями CELL_EMPTY / CELL_BUSY."""
+        height, width = self._block_shape(chunk_row, chunk_col)
+        block = self.chunks.get((chunk_row, chunk_col))
+        if block is None:
+            return np.full((len(range(height)[rows]), width), CELL_EMPTY, dtype=np.int8)
+        return np.unpackbits(block[rows], axis=1, count=width).view(np.int8)
+
+    def __getitem__(self, cell) -> int:
+        row, col = cell
+        block = self.chunks.get((row // self.chunk, col // self.chunk))
+        if block is None:
+            return CELL_EMPTY
+        col %= self.chunk
+        return CELL_BUSY if block[row % self.chunk, col >> 3] >> (7 - (col & 7)) & 1 else CELL_EMPTY
+
+    def sample(self, rng: np.random.Generator, cell_type: int = CELL_EMPTY) -> np.ndarray:
+        cumulative = self._cumulative[cell_type]
+        k = int(rng.integers(cumulative[-1]))
+        index = int(np.searchsorted(cumulative, k, side='right'))
+        k -= int(cumulative[index - 1]) if index else 0
+        chunk_row, chunk_col = divmod(index, -(-self.width // self.chunk))
+        cell = np.flatnonzero(self._unpack(chunk_row, chunk_col) == cell_type)[k]
+        row, col = divmod(int(cell), self._block_shape(chunk_row, chunk_col)[1])
+        return np.array([chunk_row * self.chunk + row, chunk_col * self.chunk + col])
+
+    def window(self, row: int, col: int, radius: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Окно (2r+1, 2r+1) с центром в (row, col), клетки за границей склада - CELL_OUTSIDE."""
+        size = 2 * radius + 1
+        if out is None:
+            out = np.empty((size, size), dtype=np.int8)
+        out.fill(CELL_OUTSIDE)
+        top, left = row - radius, col - radius
+        row_start, row_stop = max(top, 0), min(top + size, self.height)
+        col_start, col_stop = max(left, 0), min(left + size, self.width)
+        chunk = self.chunk
+        for chunk_row in range(row_start // chunk, (row_stop - 1) // chunk + 1):
+            rows = slice(max(row_start, chunk_row * chunk), min(row_stop, (chunk_row + 1) * chunk))
+            for chunk_col in range(col_start // chunk, (col_stop - 1) // chunk + 1):
+                cols = slice(max(col_start, chunk_col * chunk), min(col_stop, (chunk_col + 1) * chunk))
+                region = out[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]
+                if (chunk_row, chunk_col) not in self.chunks:
+                    region.fill(CELL_EMPTY)
+                else:
+                    block_rows = slice(rows.start - chunk_row * chunk, rows.stop - chunk_row * chunk)
+                    region[:] = self._unpack(chunk_row, chunk_col, block_rows)[
+                        :, cols.start - chunk_col * chunk:cols.stop - chunk_col * chunk]
+        return out
+
+    def to_dense(self) -> np.ndarray:
+        field = np.zeros((self.height, self.width), dtype=np.int8)
+        for chunk_row, chunk_col in self.chunks:
+            block = self._unpack(chunk_row, chunk_col)
+            row, col = chunk_row * self.chunk, chunk_col * self.chunk
+            field[row:row + block.shape[0], col:col + block.shape[1]] = block
+        return field
+
+
+class LargeCarrierRobotEnv(gymnasium.Env):
+    """
+    Один робот на большом складе (сотни клеток на сторону). Правила и награды как в CarrierRobotEnv,
+    но склад хранится блоками (ChunkedField), а наблюдение - окно view_radius вокруг робота,
+    как у CarrierRobotEnv(view_radius=...), поэтому политики, обученные с окном, переносятся сюда.
+    Склад генерируется один раз (generate_racks) и переиспользуется между эпизодами: сброс только
+    выбирает старт и цель по индексам, шаг читает несколько клеток - оба не зависят от площади.
+    Новый склад: reset(options={'layout': поле (H, W)}) или reset(options={'new_layout': True}).
+    """
+    metadata = {'render_modes': ['human', 'rgb_array'], 'render_fps': 4}
+
+    def __init__(self, width: int = 256, height: int = 256, view_radius: int = 3, render_mode=None,
+                 layout: Optional[np.ndarray] = None, chunk: int = 64, compact_obs: bool = False, **rack_kwargs):
+        super().__init__()
+        if width <= 1 or height <= 1:
+            raise ValueError('Height and width must be greater than 1')
+        if view_radius < 1:
+            raise ValueError('view_radius must be at least 1')
+        if layout is not None and layout.shape != (height, width):
+            raise ValueError('Layout size does not match the field size')
+
+        self.width = width
+        self.height = height
+        self.view_radius = view_radius
+        self.render_mode = render_mode
+        self.chunk = chunk
+        # Параметры generate_racks
+        self.rack_kwargs = rack_kwargs
+        self.layout = None if layout is None else ChunkedField(layout, chunk)
+
+        dtype = coord_dtype(height, width) if compact_obs else np.dtype(np.int64)
+        side = 2 * view_radius + 1
+        self.observation_space = gymnasium.spaces.Dict({
+            'field': gymnasium.spaces.Box(low=0, high=CELL_OUTSIDE, shape=(side, side), dtype=np.int8),
+            'pos': gymnasium.spaces.Box(low=0, high=max(width, height) - 1, shape=(2,), dtype=dtype),
+            'target': gymnasium.spaces.Box(low=0, high=max(width, height) - 1, shape=(2,), dtype=dtype),
+        })
+        self.action_space = gymnasium.spaces.Discrete(5)
+        self._coord_dtype = dtype
+
+        self.time = 0
+        self.pos = np.array([0, 0])
+        self.target = np.array([0, 0])
+        self._window = np.empty((side, side), dtype=np.int8)
+        self._renderer = None
+        self._viewer = None
+
+    @profiled('large_env.reset')
+    def reset(self, seed: Optional[int] = None, options: Optional[dict] = None) -> tuple[Dict, Any]:
+        super().reset(seed=seed)
+        options = options or {}
+        if options.get('layout') is not None:
+            self.layout = ChunkedField(np.asarray(options['layout'], dtype=np.int8), self.chunk)
+        elif self.layout is None or options.get('new_layout'):
+            self.layout = ChunkedField(generate_racks(self.height, self.width, rng=self.np_random,
+                                                      **self.rack_kwargs), self.chunk)
+
+        self.target = self.layout.sample(self.np_random, CELL_BUSY)
+        self.pos = self.layout.sample(self.np_random, CELL_EMPTY)
+        self.time = 0
+        return self.get_obs(), {}
+
+    @profiled('large_env.step')
+    def step(self, action: ActType) -> tuple[Dict, SupportsFloat, bool, bool, Dict]:
+        if self._is_adjacent(self.pos, self.target):
+            return self.get_obs(), 1, True, False, {'win': True}
+
+        direction = self.pos + MOVES[action]
+        reward = 0
+        terminated = False
+        info = {}
+
+        if not (0 <= direction[0] < self.height and 0 <= direction[1] < self.width):
+            reward = -11
+            terminated = True
+        elif self.layout[direction] == CELL_BUSY:
+            # Робота нет в self.layout, поэтому бездействие не считается столкновением само по себе
+            reward = -1
+            terminated = True
+        else:
+            self.pos = direction
+
+        if self._is_adjacent(self.pos, self.target):
+            reward += 1
+            terminated = True
+            info = {'win': True}
+
+        reward -= 1.25 / (self.time + 1)
+        self.time += 1
+
+        return self.get_obs(), reward, terminated, False, info
+
+    @staticmethod
+    def _is_adjacent(pos1: np.ndarray, pos2: np.ndarray) -> bool:
+        return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1]) == 1
+
+    def _fill_window(self) -> np.ndarray:
+        self.layout.window(int(self.pos[0]), int(self.pos[1]), self.view_radius, out=self._window)
+        self._window[self.view_radius, self.view_radius] = CELL_BUSY
+        return self._window
+
+    def get_obs(self) -> Dict:
+        return {
+            'field': self._fill_window().copy(),
+            'pos': self.pos.astype(self._coord_dtype),
+            'target': self.target.astype(self._coord_dtype),
+        }
+
+    def action_masks(self) -> np.ndarray:
+        """Допустимые действия (5,): соседняя клетка окна свободна (за границей склада - CELL_OUTSIDE)."""
+        window = self._fill_window()
+        cells = self.view_radius + MOVES
+        masks = window[cells[:, 0], cells[:, 1]] == CELL_EMPTY
+        masks[0] = True
+        return masks
+
+    def render(self) -> Optional[np.ndarray]:
+        """Окно вокруг робота: рисовать весь склад на каждом кадре стоило бы O(H * W)."""
+        if self.render_mode not in ('human', 'rgb_array'):
+            return None
+        if self._renderer is None:
+            self._renderer = GridRenderer(*self._window.shape)
+        target = self.target - self.pos + self.view_radius
+        targets = target[None] if ((0 <= target) & (target < len(self._window))).all() else ()
+        frame = self._renderer.draw(self._fill_window(), [self.view_radius] * 2, targets)
+
+        if self.render_mode == 'human':
+            if self._viewer is None:
+                self._viewer = FrameViewer()
+            self._viewer.show(frame, f'Time: {self.time}  Pos: {tuple(self.pos)}', 0.1 / self.metadata['render_fps'])
+        else:
+            return frame.copy()
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence
+
+import numpy as np
+
+from environment.carrier_robot_gym.field import generate_fields
+
+
+def bank_path(directory: str, height: int, width: int, density: Sequence[float]) -> str:
+    """Имя файла банка для размера поля и диапазона плотности."""
+    return os.path.join(directory, f'layouts_{height}x{width}_{density[0]:.2f}-{density[1]:.2f}.npy')
+
+
+def _generate_chunk(size: int, height: int, width: int, density: Sequence[float], packed: bool,
+                    seed: np.random.SeedSequence) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    fields = generate_fields(size, height, width, rng.uniform(*density, size=size), rng=rng)
+    return np.packbits(fields.reshape(size, height * width), axis=1) if packed else fields
+
+
+def build_layout_bank(path: str, count: int, height: int, width: int,
+                      density: Sequence[float] = (0.2, 0.3), seed: int = 0, packed: bool = True,
+                      holdout: int = 0, chunk: int = 4096, workers: int = 1) -> 'LayoutBank':
+    """
+    Заранее генерирует count складов и пишет их в .npy (упакованными битами или int8) и .json с описанием.
+    Последние holdout складов зарезервированы для оценки и не выдаются при обучении.
+    Каждый кусок получает свой SeedSequence, поэтому результат не зависит от числа процессов workers.
+    """
+    if not 0 <= holdout < count:
+        raise ValueError('Holdout must be in [0, count)')
+
+    cells = height * width
+    shape = (count, (cells + 7) // 8) if packed else (count, height, width)
+    dtype = np.uint8 if packed else np.int8
+    starts = range(0, count, chunk)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    args = [(min(chunk, count - start), height, width, density, packed, chunk_seed)
+            for start, chunk_seed in zip(starts, seeds)]
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = pool.map(_generate_chunk, *zip(*args))
+            for start, rows in zip(starts, chunks):
+                data[start:start + len(rows)] = rows
+    else:
+        for start, chunk_args in zip(starts, args):
+            data[start:start + chunk_args[0]] = _generate_chunk(*chunk_args)
+    data.flush()
+    del data
+
+    meta = {
+        'height': height,
+        'width': width,
+        'density': list(density),
+        'count': count,
+        'holdout': holdout,
+        'packed': packed,
+        'seed': seed,
+    }
+    with open(_meta_path(path), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return LayoutBank(path)
+
+
+def _meta_path(path: str) -> str:
+    return os.path.splitext(path)[0] + '.json'
+
+
+class LayoutBank:
+    """
+    Банк заранее сгенерированных складов, открытый через np.memmap.
+    Файл отображается в память только при первом обращении, поэтому банк можно передавать в процессы
+    SubprocVecEnv: все воркеры читают одни и те же страницы из кэша ОС.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(_meta_path(path)) as f:
+            meta = json.load(f)
+        self.height = meta['height']
+        self.width = meta['width']
+        self.density = tuple(meta['density'])
+        self.count = meta['count']
+        self.holdout = meta['holdout']
+        self.packed = meta['packed']
+        self._data: Optional[np.ndarray] = None
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            self._data = np.load(self.path, mmap_mode='r')
+        return self._data
+
+    @property
+    def train_count(self) -> int:
+        return self.count - self.holdout
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.take(np.array([index]))[0]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        """Возвращает склады с указанными номерами как (N, height, width) int8."""
+        rows = self.data[np.asarray(indices)]
+        if not self.packed:
+            return np.array(rows, dtype=np.int8)
+        cells = np.unpackbits(rows, axis=1, count=self.height * self.width)
+        return cells.reshape(len(indices), self.height, self.width).astype(np.int8)
+
+    def sample_indices(self, rng: np.random.Generator, size: Optional[int] = None):
+        """Случайные номера обучающих складов из генератора среды - выбор воспроизводим по seed."""
+        return rng.integers(0, self.train_count, size=size)
+
+    def holdout_indices(self) -> np.ndarray:
+        """Фиксированные номера складов для оценки."""
+        return np.arange(self.train_count, self.count)
+
+
+def open_layout_bank(layout_bank) -> Optional[LayoutBank]:
+    """Принимает путь к банку или готовый LayoutBank."""
+    if layout_bank is None or isinstance(layout_bank, LayoutBank):
+        return layout_bank
+    return LayoutBank(layout_bank)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Генерация банка складов')
+    parser.add_argument('--out', default='layouts')
+    parser.add_argument('--height', type=int, default=10)
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--density', type=float, nargs=2, default=(0.2, 0.3))
+    parser.add_argument('--count', type=int, default=1_000_000)
+    parser.add_argument('--holdout', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--int8', action='store_true', help='Хранить поля без упаковки в биты')
+    args = parser.parse_args()
+
+    path = bank_path(args.out, args.height, args.width, args.density)
+    bank = build_layout_bank(path, args.count, args.height, args.width, args.density, args.seed,
+                             packed=not args.int8, holdout=args.holdout, workers=args.workers)
+    print(f'{path}: {len(bank)} layouts, {os.path.getsize(path) / 2 ** 20:.1f} MiB')
@@ -0,0 +1,54 @@
+import inspect
+from typing import Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, MOVES
+
+
+def valid_action_masks(fields: np.ndarray, pos: np.ndarray, bounds: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Допустимые действия (N, 5) для N роботов: ход не выводит за поле и не упирается в занятую клетку.
+    fields - (N, H, W) (можно представление broadcast_to общего склада), pos - (N, 2),
+    bounds - размеры поля (2,) или свои для каждой среды (N, 2). Бездействие допустимо всегда.
+    """
+    count, height, width = fields.shape
+    bounds = np.array([height, width]) if bounds is None else np.asarray(bounds).reshape(-1, 1, 2)
+    cells = pos[:, None, :] + MOVES[None]
+    inside = ((cells >= 0) & (cells < bounds)).all(axis=2)
+    safe = np.where(inside[..., None], cells, pos[:, None, :])
+    masks = inside & (fields[np.arange(count)[:, None], safe[..., 0], safe[..., 1]] != CELL_BUSY)
+    masks[:, 0] = True
+    return masks
+
+
+def maskable_ppo():
+    """Класс MaskablePPO из sb3-contrib (необязательная зависимость)."""
+    try:
+        from sb3_contrib import MaskablePPO
+    except ImportError as e:
+        raise ImportError('Masked training requires sb3-contrib: pip install sb3-contrib') from e
+    return MaskablePPO
+
+
+def masked_predict(model, obs: dict, masks: np.ndarray, deterministic: bool = True) -> np.ndarray:
+    """
+    predict с маской действий. MaskablePPO принимает маску сам, для обычной модели SB3
+    логиты недопустимых действий обнуляются в вероятности перед выбором.
+    """
+    if 'action_masks' in inspect.signature(model.predict).parameters:
+        return model.predict(obs, deterministic=deterministic, action_masks=masks)[0]
+
+    import torch
+
+    obs_tensor, vectorized = model.policy.obs_to_tensor(obs)
+    with torch.no_grad():
+        logits = model.policy.get_distribution(obs_tensor).distribution.logits
+        masks = torch.as_tensor(np.asarray(masks, dtype=bool), device=logits.device).reshape(logits.shape)
+        logits = logits.masked_fill(~masks, -torch.inf)
+        if deterministic:
+            actions = logits.argmax(dim=1)
+        else:
+            actions = torch.distributions.Categorical(logits=logits).sample()
+    actions = actions.cpu().numpy()
+    return actions if vectorized else actions[0]
@@ -0,0 +1,219 @@
+from typing import Any, Dict, Optional
+
+import gymnasium
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY, MOVES
+from environment.carrier_robot_gym.field import generate_field
+from environment.carrier_robot_gym.layout_bank import open_layout_bank
+from environment.carrier_robot_gym.masking import valid_action_masks
+from environment.carrier_robot_gym.observation import ObservationBuffers
+from environment.carrier_robot_gym.profiling import profiled
+from environment.carrier_robot_gym.renderer import FrameViewer, GridRenderer
+
+
+def resolve_conflicts(current: np.ndarray, desired: np.ndarray, go: np.ndarray, width: int) -> np.ndarray:
+    """
+    Разрешает конфликты одновременных ходов роботов. current и desired - (N, 2) клетки до и после хода,
+    go - (N,) кто пытается сдвинуться. Возвращает маску роботов, которым ход запрещен:
+    - в одну клетку претендуют несколько роботов: проходит робот с меньшим номером,
+      если клетку не занимает стоящий робот;
+    - два робота меняются местами: оба стоят;
+    - клетка занята роботом, который сам не смог уйти: блокировка распространяется по цепочке.
+    """
+    count = len(current)
+    current_id = current[:, 0] * width + current[:, 1]
+    desired_id = desired[:, 0] * width + desired[:, 1]
+    go = go.copy()
+    blocked = np.zeros(count, dtype=bool)
+
+    by_cell = np.argsort(current_id)
+    occupant_pos = np.minimum(np.searchsorted(current_id[by_cell], desired_id), count - 1)
+    occupant = by_cell[occupant_pos]
+    has_occupant = current_id[occupant] == desired_id
+    swap = go & has_occupant & (desired_id[occupant] == current_id) & (occupant != np.arange(count))
+    swap &= go[occupant]
+    blocked |= swap
+    go &= ~swap
+
+    while True:
+        final_id = np.where(go, desired_id, current_id)
+        order = np.argsort(final_id, kind='stable')
+        sorted_id = final_id[order]
+        first = np.r_[True, sorted_id[1:] != sorted_id[:-1]]
+        group = np.cumsum(first) - 1
+        stationary = np.zeros(group[-1] + 1, dtype=bool)
+        np.logical_or.at(stationary, group, ~go[order])
+
+        lose = np.zeros(count, dtype=bool)
+        lose[order] = go[order] & (stationary[group] | ~first)
+        if not lose.any():
+            return blocked
+        blocked |= lose
+        go &= ~lose
+
+
+class MultiCarrierRobotEnv(gymnasium.Env):
+    """
+    Склад с несколькими роботами, которые ходят одновременно: одно действие на робота за такт.
+    Наблюдения и награды каждого робота совпадают с CarrierRobotEnv, поэтому обученные модели
+    получают все наблюдения одной пачкой и выбирают действия за один проход сети.
+    Поле в наблюдении - общее для всех роботов (только для чтения).
+    """
+    metadata = {'render_modes': ['human', 'rgb_array'], 'render_fps': 4}
+
+    def __init__(self, width: int = 10, height: int = 10, count_agents: int = 3, render_mode=None,
+                 layout_bank=None, reassign_targets: bool = True, compact_obs: bool = False,
+                 view_radius: Optional[int] = None, reuse_obs: bool = False):
+        super().__init__()
+        if width <= 1 or height <= 1:
+            raise ValueError('Height and width must be greater than 1')
+        if count_agents < 1:
+            raise ValueError('There must be at least one robot')
+
+        self.width = width
+        self.height = height
+        self.count_agents = count_agents
+        self.render_mode = render_mode
+        self.layout_bank = open_layout_bank(layout_bank)
+        if self.layout_bank is not None and (self.layout_bank.height, self.layout_bank.width) != (height, width):
+            raise ValueError('Layout bank size does not match the field size')
+        # Выдавать новую цель роботу, дошедшему до своей
+        self.reassign_targets = reassign_targets
+
+        self._obs = ObservationBuffers(count_agents, height, width, compact_obs, view_radius, reuse_obs)
+        self.single_observation_space = self._obs.space
+        self.single_action_space = gymnasium.spaces.Discrete(5)
+        self.observation_space = gymnasium.spaces.Dict({
+            key: gymnasium.spaces.Box(low=space.low.min(), high=space.high.max(),
+                                      shape=(count_agents, *space.shape), dtype=space.dtype)
+            for key, space in self.single_observation_space.items()
+        })
+        self.action_space = gymnasium.spaces.MultiDiscrete([5] * count_agents)
+
+        # layout - склад без роботов, field - склад, где клетки роботов заняты
+        self.layout = np.zeros((height, width), dtype=np.int8)
+        self.field = self.layout.copy()
+        self.pos = np.zeros((count_agents, 2), dtype=np.int64)
+        self.target = np.zeros((count_agents, 2), dtype=np.int64)
+        self.time = np.zeros(count_agents, dtype=np.int64)
+        self._robots = np.arange(count_agents)
+        self._renderer = None
+        self._viewer = None
+
+    @profiled('multi_env.reset')
+    def reset(self, seed: Optional[int] = None, options: Optional[dict] = None) -> tuple[Dict, Any]:
+        """
+        options: 'layout' - готовый склад (H, W), 'pos' / 'target' - (k, 2) клетки первых k роботов,
+        'layout_index' - номер склада из банка.
+        """
+        super().reset(seed=seed)
+        options = options or {}
+
+        if 'layout' in options:
+            self.layout = np.array(options['layout'], dtype=np.int8)
+        elif self.layout_bank is not None:
+            index = options.get('layout_index')
+            if index is None:
+                index = self.layout_bank.sample_indices(self.np_random)
+            self.layout = self.layout_bank[index]
+        else:
+            density = self.np_random.uniform(0.2, 0.3)
+            self.layout = generate_field(self.height, self.width, density, 10000, self.np_random)
+
+        given_pos = np.asarray(options.get('pos', np.zeros((0, 2))), dtype=np.int64).reshape(-1, 2)
+        free = np.argwhere(self.layout == CELL_EMPTY)
+        taken = np.isin(free[:, 0] * self.width + free[:, 1], given_pos[:, 0] * self.width + given_pos[:, 1])
+        free = free[~taken]
+        self.pos[:len(given_pos)] = given_pos
+        self.pos[len(given_pos):] = free[self.np_random.choice(len(free), self.count_agents - len(given_pos),
+                                                               replace=False)]
+
+        given_target = np.asarray(options.get('target', np.zeros((0, 2))), dtype=np.int64).reshape(-1, 2)
+        self.target[:len(given_target)] = given_target
+        self.target[len(given_target):] = self._random_shelves(self.count_agents - len(given_target))
+
+        self.field = self.layout.copy()
+        self.field[self.pos[:, 0], self.pos[:, 1]] = CELL_BUSY
+        self.time[:] = 0
+        return self.get_obs(), {}
+
+    @profiled('multi_env.step')
+    def step(self, actions) -> tuple[Dict, np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        """
+        Один такт для всех роботов. Возвращает наблюдения, награды, terminated и truncated размера N
+        и список info по роботам. Робот с terminated продолжает работу с того же места: при победе
+        получает новую цель (если reassign_targets), после столкновения отсчет времени начинается заново.
+        """
+        actions = np.asarray(actions, dtype=np.int64).reshape(self.count_agents)
+        pos, target = self.pos, self.target
+
+        pre_win = np.abs(pos - target).sum(axis=1) == 1
+        desired = pos + MOVES[actions]
+        valid = ((desired >= 0) & (desired < (self.height, self.width))).all(axis=1)
+        safe = np.where(valid[:, None], desired, pos)
+        moving = (desired != pos).any(axis=1)
+        shelf = self.layout[safe[:, 0], safe[:, 1]] == CELL_BUSY
+
+        invalid = ~pre_win & ~valid
+        go = ~pre_win & valid & moving & ~shelf
+        robot_collision = resolve_conflicts(pos, safe, go, self.width)
+        collision = ~pre_win & valid & moving & (shelf | robot_collision)
+        movers = self._robots[go & ~robot_collision]
+
+        self.field[pos[movers, 0], pos[movers, 1]] = CELL_EMPTY
+        pos[movers] = desired[movers]
+        self.field[pos[movers, 0], pos[movers, 1]] = CELL_BUSY
+
+        post_win = ~pre_win & (np.abs(pos - target).sum(axis=1) == 1)
+
+        rewards = np.zeros(self.count_agents, dtype=np.float32)
+        rewards[pre_win] = 1
+        rewards[invalid] = -11
+        rewards[collision] = -1
+        rewards[post_win] += 1
+        active = ~pre_win
+        rewards[active] -= 1.25 / (self.time[active] + 1)
+        self.time[active] += 1
+
+        wins = pre_win | post_win
+        terminated = wins | invalid | collision
+        infos = [{} for _ in range(self.count_agents)]
+        for i in self._robots[terminated]:
+            infos[i] = {'win': True} if wins[i] else {'collision': True}
+
+        if self.reassign_targets and wins.any():
+            self.target[wins] = self._random_shelves(int(wins.sum()))
+        self.time[terminated] = 0
+
+        return self.get_obs(), rewards, terminated, np.zeros(self.count_agents, dtype=bool), infos
+
+    def _random_shelves(self, count: int) -> np.ndarray:
+        shelves = np.argwhere(self.layout == CELL_BUSY)
+        return shelves[self.np_random.choice(len(shelves), count)]
+
+    def action_masks(self) -> np.ndarray:
+        """
+        Допустимые действия (N, 5) по стеллажам и границам склада. Клетки других роботов не исключаются:
+        они могут освободиться на этом же такте, столкновения разбирает resolve_conflicts.
+        """
+        layout = np.broadcast_to(self.layout, (self.count_agents, self.height, self.width))
+        return valid_action_masks(layout, self.pos)
+
+    def get_obs(self) -> Dict:
+        self._obs.fill(self.field, self.pos, self.target)
+        return self._obs.get()
+
+    def render(self) -> Optional[np.ndarray]:
+        if self.render_mode not in ('human', 'rgb_array'):
+            return None
+        if self._renderer is None:
+            self._renderer = GridRenderer(self.height, self.width)
+        frame = self._renderer.draw(self.field, self.pos, self.target)
+
+        if self.render_mode == 'human':
+            if self._viewer is None:
+                self._viewer = FrameViewer()
+            self._viewer.show(frame, pause=0.1 / self.metadata['render_fps'])
+        else:
+            return frame.copy()
@@ -0,0 +1,100 @@
+from typing import Optional
+
+import gymnasium
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_OUTSIDE
+from environment.carrier_robot_gym.profiling import profiled
+
+
+def coord_dtype(height: int, width: int) -> np.dtype:
+    """Наименьший знаковый целый тип, в который помещаются координаты и смещения на поле."""
+    return np.min_scalar_type(-max(height, width))
+
+
+class ObservationBuffers:
+    """
+    Предвыделенные буферы наблюдений для count сред (или роботов на одном складе).
+    compact - координаты в наименьшем целом типе вместо int64,
+    view_radius - вместо всего склада окно (2r+1, 2r+1) с роботом в центре, клетки за границей - CELL_OUTSIDE,
+    reuse - возвращать сами буферы без копии: они перезаписываются при следующем наблюдении.
+    """
+
+    def __init__(self, count: int, height: int, width: int, compact: bool = False,
+                 view_radius: Optional[int] = None, reuse: bool = False):
+        self.count = count
+        self.height = height
+        self.width = width
+        self.view_radius = view_radius
+        self.reuse = reuse
+        self.coord_dtype = coord_dtype(height, width) if compact else np.dtype(np.int64)
+
+        field_shape = (height, width) if view_radius is None else (2 * view_radius + 1,) * 2
+        self.space = gymnasium.spaces.Dict({
+            'field': gymnasium.spaces.Box(low=0, high=CELL_OUTSIDE, shape=field_shape, dtype=np.int8),
+            'pos': gymnasium.spaces.Box(low=0, high=max(width, height) - 1, shape=(2,), dtype=self.coord_dtype),
+            'target': gymnasium.spaces.Box(low=0, high=max(width, height) - 1, shape=(2,), dtype=self.coord_dtype),
+        })
+
+        self.field = np.zeros((count, *field_shape), dtype=np.int8)
+        self.pos = np.zeros((count, 2), dtype=self.coord_dtype)
+        self.target = np.zeros((count, 2), dtype=self.coord_dtype)
+        self._field_view = self.field
+
+        if view_radius is not None:
+            # Склады с рамкой шириной view_radius: окно робота в (r, c) - срез padded[r:r+2R+1, c:c+2R+1]
+            self._padded = np.full((count, height + 2 * view_radius, width + 2 * view_radius), CELL_OUTSIDE,
+                                   dtype=np.int8)
+            padded_height, padded_width = self._padded.shape[1:]
+            side = np.arange(2 * view_radius + 1)
+            self._offsets = side[:, None] * padded_width + side[None, :]
+            self._base = np.arange(count) * padded_height * padded_width
+            self._index = np.zeros(self.field.shape, dtype=np.int64)
+            # Внутренняя часть рамки: среда может хранить склады прямо в ней, тогда fill их не копирует
+            self.interior = self._padded[:, view_radius:view_radius + height, view_radius:view_radius + width]
+
+    @profiled('observation.fill')
+    def fill(self, fields: np.ndarray, pos: np.ndarray, target: np.ndarray,
+             indices: Optional[np.ndarray] = None) -> None:
+        """
+        Записывает наблюдения в буферы. fields - (count, H, W) или общий склад (H, W),
+        indices - обновить только эти среды (после сброса), остальные строки буферов не трогаются.
+        """
+        rows = slice(None) if indices is None else indices
+        shared = fields.ndim == 2
+        self.pos[rows] = pos[rows]
+        self.target[rows] = target[rows]
+        self._field_view = self.field
+
+        if self.view_radius is None:
+            if shared:
+                # Общий склад не копируется: у всех роботов одно представление только для чтения,
+                # без reuse get() отдает его копию
+                self._field_view = np.broadcast_to(fields, self.field.shape)
+            else:
+                self.field[rows] = fields[rows]
+            return
+
+        if shared:
+            self.interior[0] = fields
+            base = self._base[:1]
+        else:
+            if fields is not self.interior:
+                self.interior[rows] = fields[rows]
+            base = self._base
+        base = base + pos[:, 0] * self._padded.shape[2] + pos[:, 1]
+        np.add(base[:, None, None], self._offsets, out=self._index)
+        np.take(self._padded.ravel(), self._index, out=self.field)
+
+    def get(self) -> dict[str, np.ndarray]:
+        """
+        Последние записанные наблюдения: сами буферы при reuse, иначе копии. Общий склад копируется
+        один раз и снова размножается представлением, иначе наблюдение менялось бы вместе со складом среды.
+        """
+        if self.reuse:
+            return {'field': self._field_view, 'pos': self.pos, 'target': self.target}
+        if self._field_view is self.field:
+            field = self.field.copy()
+        else:
+            field = np.broadcast_to(self._field_view[0].copy(), self.field.shape)
+        return {'field': field, 'pos': self.pos.copy(), 'target': self.target.copy()}
@@ -0,0 +1,167 @@
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY, MOVES
+
+UNREACHABLE = -1
+
+
+def layout_hash(layout: np.ndarray) -> str:
+    """Ключ склада для кэша: хеш размеров и упакованной маски стеллажей."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.asarray(layout.shape, dtype=np.int32).tobytes())
+    digest.update(np.packbits(layout == CELL_BUSY).tobytes())
+    return digest.hexdigest()
+
+
+def bfs_distances(free: np.ndarray, sources: np.ndarray) -> np.ndarray:
+    """
+    Расстояния в шагах от множества стартовых ячеек sources (маска) по свободным ячейкам free.
+    Волна расширяется сдвигами массивов, недостижимые ячейки получают UNREACHABLE.
+    """
+    distances = np.full(free.shape, UNREACHABLE, dtype=np.int32)
+    frontier = sources & free
+    visited = frontier.copy()
+    step = 0
+    while frontier.any():
+        distances[frontier] = step
+        grown = np.zeros_like(frontier)
+        grown[1:] |= frontier[:-1]
+        grown[:-1] |= frontier[1:]
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        frontier = grown & free & ~visited
+        visited |= frontier
+        step += 1
+    return distances
+
+
+def _neighbour_values(values: np.ndarray, fill) -> np.ndarray:
+    """Значения соседей каждой ячейки в порядке действий 1-4 (вниз, вправо, вверх, влево): (4, H, W)."""
+    padded = np.pad(values, 1, constant_values=fill)
+    height, width = values.shape
+    return np.stack([padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width] for dr, dc in MOVES[1:]])
+
+
+class LayoutDistances:
+    """
+    Поля расстояний для одного склада. Считаются лениво и запоминаются, после чего
+    расстояние и следующий шаг до любого стеллажа выдаются за O(1). Поля до стеллажей и следующих
+    действий хранятся LRU на max_cached стеллажей: каждое - массив размером со склад.
+    """
+
+    def __init__(self, layout: np.ndarray, max_cached: int = 64):
+        self.layout = np.array(layout, dtype=np.int8)
+        self.free = self.layout == CELL_EMPTY
+        self.max_cached = max_cached
+        self._to_shelf: OrderedDict[tuple[int, int], np.ndarray] = OrderedDict()
+        self._next_action: OrderedDict[tuple[int, int], np.ndarray] = OrderedDict()
+        self._from_cell: OrderedDict[tuple[int, int], np.ndarray] = OrderedDict()
+
+    def to_shelf(self, shelf) -> np.ndarray:
+        """Сколько шагов из каждой свободной ячейки до клетки рядом со стеллажом shelf."""
+        key = (int(shelf[0]), int(shelf[1]))
+        if key in self._to_shelf:
+            self._to_shelf.move_to_end(key)
+        else:
+            sources = np.zeros_like(self.free)
+            for dr, dc in MOVES[1:]:
+                r, c = key[0] + dr, key[1] + dc
+                if 0 <= r < self.free.shape[0] and 0 <= c < self.free.shape[1]:
+                    sources[r, c] = True
+            self._to_shelf[key] = bfs_distances(self.free, sources)
+            if len(self._to_shelf) > self.max_cached:
+                self._to_shelf.popitem(last=False)
+        return self._to_shelf[key]
+
+    def distance(self, pos, shelf) -> int:
+        """Длина кратчайшего пути от pos до стеллажа shelf или UNREACHABLE."""
+        return int(self.to_shelf(shelf)[pos[0], pos[1]])
+
+    def next_actions(self, shelf) -> np.ndarray:
+        """Оптимальное действие (1-4) из каждой ячейки в сторону стеллажа shelf, 0 - уже на месте или путь не найден."""
+        key = (int(shelf[0]), int(shelf[1]))
+        if key in self._next_action:
+            self._next_action.move_to_end(key)
+        else:
+            distances = self.to_shelf(key)
+            around = _neighbour_values(np.where(distances == UNREACHABLE, np.iinfo(np.int32).max, distances),
+                                       np.iinfo(np.int32).max)
+            best = around.argmin(axis=0)
+            closer = np.take_along_axis(around, best[None], axis=0)[0] == distances - 1
+            self._next_action[key] = np.where(closer & (distances > 0), best + 1, 0).astype(np.int8)
+            if len(self._next_action) > self.max_cached:
+                self._next_action.popitem(last=False)
+        return self._next_action[key]
+
+    def next_action(self, pos, shelf) -> int:
+        return int(self.next_actions(shelf)[pos[0], pos[1]])
+
+    def from_cell(self, cell, max_cached: int = 64) -> np.ndarray:
+        """Расстояния от свободной ячейки cell до всех свободных ячеек."""
+        key = (int(cell[0]), int(cell[1]))
+        if key in self._from_cell:
+            self._from_cell.move_to_end(key)
+        else:
+            sources = np.zeros_like(self.free)
+            sources[key] = True
+            self._from_cell[key] = bfs_distances(self.free | sources, sources)
+            if len(self._from_cell) > max_cached:
+                self._from_cell.popitem(last=False)
+        return self._from_cell[key]
+
+    def shelf_distances(self, cell) -> np.ndarray:
+        """Для каждого стеллажа - сколько шагов от cell до клетки рядом с ним, для остальных ячеек UNREACHABLE."""
+        distances = self.from_cell(cell)
+        big = np.iinfo(np.int32).max
+        around = _neighbour_values(np.where(distances == UNREACHABLE, big, distances), big).min(axis=0)
+        return np.where((self.layout == CELL_BUSY) & (around < big), around, UNREACHABLE)
+
+    def most_remote(self, cell, cell_type: int = CELL_BUSY) -> Optional[np.ndarray]:
+        """Самая удаленная по пути достижимая ячейка типа cell_type (стеллаж или свободная клетка)."""
+        distances = self.shelf_distances(cell) if cell_type == CELL_BUSY else self.from_cell(cell)
+        if distances.max() == UNREACHABLE:
+            return None
+        return np.array(np.unravel_index(distances.argmax(), distances.shape))
+
+
+class DistanceCache:
+    """LRU-кэш LayoutDistances по хешу склада."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, LayoutDistances] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, layout: np.ndarray) -> LayoutDistances:
+        key = layout_hash(layout)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = LayoutDistances(layout)
+        self._entries[key] = entry
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+DISTANCE_CACHE = DistanceCache()
+
+
+def get_distances(layout: np.ndarray) -> LayoutDistances:
+    """Поля расстояний склада из общего кэша процесса."""
+    return DISTANCE_CACHE.get(layout)
@@ -0,0 +1,397 @@
+import heapq
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY
+from environment.carrier_robot_gym.paths import UNREACHABLE
+
+
+class ResumableSearch:
+    """
+    Обратный A* от клеток рядом со стеллажом (Reverse Resumable A*). Поиск не начинается заново
+    для каждого запроса: открытый список и найденные расстояния сохраняются, и запрос расстояния
+    до новой клетки только продолжает раскрытие, пока она не будет закрыта. Закрытые клетки
+    получают точное расстояние до стеллажа, поэтому оно же служит эвристикой пространственно-временного A*.
+    """
+
+    def __init__(self, planner: 'PathPlanner', shelf: int, origin: int):
+        self.planner = planner
+        self.shelf = shelf
+        self.origin_row, self.origin_col = divmod(origin, planner.width)
+        # g - расстояния открытых и закрытых клеток, parent - следующий шаг к стеллажу
+        self.g: dict[int, int] = {}
+        self.parent: dict[int, int] = {}
+        self.closed: set[int] = set()
+        self.heap: list[tuple[int, int, int]] = []
+        for goal in planner.free_neighbours(shelf):
+            self.g[goal] = 0
+            self.parent[goal] = goal
+            heapq.heappush(self.heap, (self._heuristic(goal), 0, goal))
+
+    def _heuristic(self, cell: int) -> int:
+        row, col = divmod(cell, self.planner.width)
+        return abs(row - self.origin_row) + abs(col - self.origin_col)
+
+    def distance(self, cell: int, deadline: Optional[float] = None) -> Optional[int]:
+        """
+        Шагов от свободной клетки cell до клетки рядом со стеллажом или UNREACHABLE.
+        deadline - момент time.perf_counter(), после которого поиск прерывается с ответом None;
+        раскрытое до этого сохраняется и продолжится при следующем запросе.
+        """
+        if cell in self.closed:
+            return self.g[cell]
+        g, closed, parent, heap = self.g, self.closed, self.parent, self.heap
+        neighbours = self.planner.free_neighbours
+        expanded = 0
+        while heap:
+            expanded += 1
+            if deadline is not None and expanded % 256 == 0 and time.perf_counter() > deadline:
+                return None
+            _, cost, node = heapq.heappop(heap)
+            if node in closed or cost > g[node]:
+                continue
+            closed.add(node)
+            for next_cell in neighbours(node):
+                if cost + 1 < g.get(next_cell, cost + 2):
+                    g[next_cell] = cost + 1
+                    parent[next_cell] = node
+                    heapq.heappush(heap, (cost + 1 + self._heuristic(next_cell), cost + 1, next_cell))
+            if node == cell:
+                return cost
+        return UNREACHABLE
+
+    def path(self, cell: int) -> Optional[list[int]]:
+        if self.distance(cell) == UNREACHABLE:
+            return None
+        path = [cell]
+        while self.g[path[-1]]:
+            path.append(self.parent[path[-1]])
+        return path
+
+    def touches(self, cells) -> bool:
+        """Затрагивает ли изменение клеток cells уже найденные расстояния."""
+        return any(cell in self.g for cell in cells)
+
+
+class PathPlanner:
+    """
+    Кратчайшие пути по складу до клеток рядом со стеллажами. На каждый стеллаж хранится свой
+    ResumableSearch (LRU на max_searches стеллажей), так что повторные запросы к той же цели
+    из любых клеток почти бесплатны. Изменение клетки (set_cell) сбрасывает только поиски,
+    которые до нее дошли. Клетки - номера row * width + col, методы с координатами принимают (row, col).
+    layout - склад (H, W) или ChunkedField.
+    """
+
+    def __init__(self, layout, max_searches: int = 256):
+        if hasattr(layout, 'to_dense'):
+            layout = layout.to_dense()
+        self.height, self.width = layout.shape
+        self.blocked = bytearray((np.asarray(layout) == CELL_BUSY).ravel().tobytes())
+        self.max_searches = max_searches
+        self._searches: OrderedDict[int, ResumableSearch] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Номер клетки по смещению -> действие (порядок MOVES)
+        self.actions = {0: 0, self.width: 1, 1: 2, -self.width: 3, -1: 4}
+
+    def cell(self, pos) -> int:
+        return int(pos[0]) * self.width + int(pos[1])
+
+    def free_neighbours(self, cell: int) -> list[int]:
+        """Свободные соседи в порядке действий 1-4 (вниз, вправо, вверх, влево)."""
+        row, col = divmod(cell, self.width)
+        blocked, width = self.blocked, self.width
+        result = []
+        if row + 1 < self.height and not blocked[cell + width]:
+            result.append(cell + width)
+        if col + 1 < width and not blocked[cell + 1]:
+            result.append(cell + 1)
+        if row > 0 and not blocked[cell - width]:
+            result.append(cell - width)
+        if col > 0 and not blocked[cell - 1]:
+            result.append(cell - 1)
+        return result
+
+    def _around(self, cell: int) -> list[int]:
+        row, col = divmod(cell, self.width)
+        cells = [cell]
+        for dr, dc in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+            if 0 <= row + dr < self.height and 0 <= col + dc < self.width:
+                cells.append(cell + dr * self.width + dc)
+        return cells
+
+    def search(self, shelf: int, origin: Optional[int] = None) -> ResumableSearch:
+        entry = self._searches.get(shelf)
+        if entry is not None:
+            self.hits += 1
+            self._searches.move_to_end(shelf)
+            return entry
+        self.misses += 1
+        entry = ResumableSearch(self, shelf, shelf if origin is None else origin)
+        self._searches[shelf] = entry
+        if len(self._searches) > self.max_searches:
+            self._searches.popitem(last=False)
+        return entry
+
+    def distance(self, start, shelf) -> int:
+        start = self.cell(start)
+        return self.search(self.cell(shelf), start).distance(start)
+
+    def path(self, start, shelf) -> Optional[np.ndarray]:
+        """Клетки (k + 1, 2) от start до клетки рядом со стеллажом shelf или None, если пути нет."""
+        start = self.cell(start)
+        cells = self.search(self.cell(shelf), start).path(start)
+        return None if cells is None else np.array([divmod(cell, self.width) for cell in cells])
+
+    def next_action(self, start, shelf) -> int:
+        """Первое действие кратчайшего пути, 0 - уже рядом со стеллажом или пути нет."""
+        start = self.cell(start)
+        search = self.search(self.cell(shelf), start)
+        if search.distance(start) in (0, UNREACHABLE):
+            return 0
+        return self.actions[search.parent[start] - start]
+
+    def set_cell(self, pos, value: int) -> None:
+        """Изменение склада (стеллаж поставлен или убран): сбрасываются только поиски, дошедшие до этого места."""
+        cell = self.cell(pos)
+        self.blocked[cell] = value == CELL_BUSY
+        around = self._around(cell)
+        for shelf in [shelf for shelf, search in self._searches.items() if shelf in around or search.touches(around)]:
+            del self._searches[shelf]
+            self.invalidations += 1
+
+
+class ReservationTable:
+    """Пространственно-временная таблица: занятые клетки (такт, клетка) и переходы (такт, откуда, куда)."""
+
+    def __init__(self):
+        self.cells: set[tuple[int, int]] = set()
+        self.edges: set[tuple[int, int, int]] = set()
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.edges.clear()
+
+    def is_free(self, t: int, cell: int, previous: int) -> bool:
+        """Можно ли перейти из previous в cell к такту t: клетка свободна и никто не идет навстречу."""
+        return (t, cell) not in self.cells and (t, cell, previous) not in self.edges
+
+    def reserve(self, cells: list[int], hold_until: int = 0) -> None:
+        """Клетки пути с такта 0, последняя остается занятой до такта hold_until включительно."""
+        for t, cell in enumerate(cells):
+            self.cells.add((t, cell))
+            if t:
+                self.edges.add((t, cells[t - 1], cell))
+        for t in range(len(cells), hold_until + 1):
+            self.cells.add((t, cells[-1]))
+
+
+class CooperativePlanner:
+    """
+    Совместное планирование флота (Windowed Hierarchical Cooperative A*): роботы по очереди ищут путь
+    в пространстве-времени на window тактов вперед и резервируют его в ReservationTable, эвристика -
+    точное расстояние до стеллажа из PathPlanner. Роботы, еще не спланированные на этом такте,
+    считаются препятствием только на первом такте плана (дальше они успеют уйти, а план все равно
+    пересчитывается каждый такт), поэтому итоговые ходы не конфликтуют. Первыми планируются дольше всех
+    простоявшие роботы.
+    tick_budget - сколько секунд можно потратить на такт: не уложившиеся роботы остаются без плана
+    (planned=False), им ход выбирает локальная политика, а начатый для них поиск продолжится на следующем такте.
+    patience - сколько тактов робот может простоять не у цели, прежде чем на столько же тактов его отдадут
+    локальной политике (planned=False) со сбросом приоритета: в узком проходе встречные роботы иначе
+    бесконечно ждут друг друга.
+    """
+
+    def __init__(self, planner: PathPlanner, window: int = 16, tick_budget: Optional[float] = None,
+                 max_expansions: int = 2000, patience: Optional[int] = 8):
+        self.planner = planner
+        self.window = window
+        self.tick_budget = tick_budget
+        self.max_expansions = max_expansions
+        self.patience = patience
+        self.table = ReservationTable()
+        self._waiting = np.zeros(0, dtype=np.int64)
+        self._yielding = np.zeros(0, dtype=np.int64)
+        self._starts: list[int] = []
+        self._stuck = np.zeros(0, dtype=bool)
+        self.last_tick_seconds = 0.0
+
+    def plan(self, positions: np.ndarray, targets: np.ndarray,
+             active: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Действия (N,) на этот такт и маска (N,) роботов, для которых план найден.
+        active - маска роботов, которые могут двигаться; остальные стоят на месте все window тактов.
+        """
+        start_time = time.perf_counter()
+        deadline = None if self.tick_budget is None else start_time + self.tick_budget
+        planner = self.planner
+        count = len(positions)
+        starts = [planner.cell(pos) for pos in positions]
+        shelves = [planner.cell(target) for target in targets]
+        # Простой считается по фактическим позициям: ход мог выбрать и не планировщик
+        at_goal = np.array([abs(start // planner.width - shelf // planner.width)
+                            + abs(start % planner.width - shelf % planner.width) == 1
+                            for start, shelf in zip(starts, shelves)])
+        if active is not None:
+            at_goal |= ~active
+        if len(self._waiting) != count or len(self._starts) != count:
+            self._waiting = np.zeros(count, dtype=np.int64)
+            self._yielding = np.zeros(count, dtype=np.int64)
+        else:
+            stayed = np.array(starts) == np.array(self._starts)
+            self._waiting = np.where(stayed & ~at_goal, self._waiting + 1, 0)
+        self._starts = starts
+        if self.patience is not None:
+            expired = self._waiting > self.patience
+            self._yielding[expired] = self.patience
+            self._waiting[expired] = 0
+
+        self.table.clear()
+        static = set(starts)
+        actions = np.zeros(count, dtype=np.int64)
+        planned = np.zeros(count, dtype=bool)
+        self._stuck = np.zeros(count, dtype=bool)
+        if active is not None:
+            for robot in np.flatnonzero(~active):
+                static.discard(starts[robot])
+                self.table.reserve([starts[robot]], self.window)
+            planned |= ~active
+        for robot in np.argsort(-self._waiting, kind='stable'):
+            if planned[robot]:
+                continue
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            if self._yielding[robot]:
+                self._stuck[robot] = True
+                continue
+            start = starts[robot]
+            static.discard(start)
+            cells = self._plan_robot(start, shelves[robot], static, deadline)
+            if cells is None:
+                self._stuck[robot] = deadline is None or time.perf_counter() <= deadline
+                static.add(start)
+                continue
+            self.table.reserve(cells, self.window)
+            planned[robot] = True
+            if len(cells) > 1:
+                actions[robot] = planner.actions[cells[1] - start]
+        self._yielding = np.maximum(self._yielding - 1, 0)
+        self.last_tick_seconds = time.perf_counter() - start_time
+        return actions, planned
+
+    @property
+    def stuck(self) -> np.ndarray:
+        """
+        Маска (N,) застрявших на последнем такте роботов: простоявших дольше patience тактов
+        или не нашедших пути. Роботы, до которых не дошла очередь из-за tick_budget, сюда не входят.
+        """
+        return self._stuck
+
+    def _plan_robot(self, start: int, shelf: int, static: set[int],
+                    deadline: Optional[float] = None) -> Optional[list[int]]:
+        """
+        Пространственно-временной A* на window тактов. Ожидание на месте - тоже ход.
+        static - клетки еще не спланированных роботов, занятые только на первом такте.
+        """
+        search = self.planner.search(shelf, start)
+        window, table = self.window, self.table
+        distance = search.distance(start, deadline)
+        if distance is None or distance == UNREACHABLE:
+            return None
+
+        heap = [(distance, distance, 0, start)]
+        parent: dict[tuple[int, int], Optional[tuple[int, int]]] = {(start, 0): None}
+        expansions = 0
+        while heap:
+            _, h, t, cell = heapq.heappop(heap)
+            if t == window or (h == 0 and all((k, cell) not in table.cells for k in range(t + 1, window + 1))):
+                cells = []
+                node = (cell, t)
+                while node is not None:
+                    cells.append(node[0])
+                    node = parent[node]
+                return cells[::-1]
+
+            expansions += 1
+            if expansions > self.max_expansions or \
+                    (deadline is not None and expansions % 64 == 0 and time.perf_counter() > deadline):
+                return None
+            for next_cell in (cell, *self.planner.free_neighbours(cell)):
+                key = (next_cell, t + 1)
+                if key in parent or (t == 0 and next_cell in static) or not table.is_free(t + 1, next_cell, cell):
+                    continue
+                h = search.distance(next_cell, deadline)
+                if h is None:
+                    return None
+                if h == UNREACHABLE:
+                    continue
+                parent[key] = (cell, t)
+                heapq.heappush(heap, (t + 1 + h, h, t + 1, next_cell))
+        return None
+
+    def local_actions(self, positions: np.ndarray, planned: np.ndarray, proposed: np.ndarray) -> np.ndarray:
+        """
+        Ходы роботов без плана (например, от RL-политики): ход, конфликтующий с резервами на следующий
+        такт или с другими роботами без плана, заменяется ожиданием.
+        """
+        planner = self.planner
+        actions = np.zeros(len(positions), dtype=np.int64)
+        unplanned = np.flatnonzero(~planned)
+        static = {planner.cell(positions[i]) for i in unplanned}
+        for robot in unplanned:
+            start = planner.cell(positions[robot])
+            action = int(proposed[robot])
+            step = next((delta for delta, a in planner.actions.items() if a == action), 0)
+            target = start + step
+            if action and target in planner.free_neighbours(start) and target not in static \
+                    and self.table.is_free(1, target, start):
+                static.discard(start)
+                static.add(target)
+                self.table.cells.add((1, target))
+                self.table.edges.add((1, start, target))
+                actions[robot] = action
+        return actions
+
+
+class PlannerPolicy:
+    """
+    Политика флота для MultiCarrierRobotEnv / FleetOperator: маршруты строит CooperativePlanner,
+    а локальная политика (обученная модель, fallback(obs) -> действия) управляет только роботами,
+    которым план не достался. Без fallback застрявшие роботы (CooperativePlanner.stuck) уступают дорогу -
+    делают случайный безопасный ход, остальные без плана ждут.
+    Склад берется из env.layout и перестраивается после смены склада.
+    active() - маска роботов, которыми управляет политика (у FleetOperator - FleetOperator.busy),
+    остальные считаются стоящими на месте.
+    """
+
+    def __init__(self, env, fallback: Optional[Callable[[dict], np.ndarray]] = None, window: int = 16,
+                 tick_budget: Optional[float] = None, patience: Optional[int] = 8, seed: Optional[int] = None,
+                 active: Optional[Callable[[], np.ndarray]] = None):
+        self.env = env
+        self.fallback = fallback
+        self.active = active
+        self.window = window
+        self.tick_budget = tick_budget
+        self.patience = patience
+        self.cooperative: Optional[CooperativePlanner] = None
+        self._layout = None
+        self._rng = np.random.default_rng(seed)
+
+    def __call__(self, obs: dict) -> np.ndarray:
+        if self.cooperative is None or self.env.layout is not self._layout:
+            self._layout = self.env.layout
+            self.cooperative = CooperativePlanner(PathPlanner(self._layout), self.window, self.tick_budget,
+                                                  patience=self.patience)
+        actions, planned = self.cooperative.plan(self.env.pos, self.env.target,
+                                                 None if self.active is None else self.active())
+        if not planned.all():
+            if self.fallback is not None:
+                proposed = np.asarray(self.fallback(obs))
+            else:
+                proposed = np.where(self.cooperative.stuck, self._rng.integers(1, 5, len(planned)), 0)
+            local = self.cooperative.local_actions(self.env.pos, planned, proposed)
+            actions = np.where(planned, actions, local)
+        return actions
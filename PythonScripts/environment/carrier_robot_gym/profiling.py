@@ -0,0 +1,138 @@
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+class Profiler:
+    """
+    Таймеры участков и счетчики горячего пути. Выключен по умолчанию: инструментированная функция
+    тогда стоит одну проверку флага. Включается enable() или переменной окружения CARRIER_PROFILE=1.
+    Время участков включающее: reset среды содержит и вложенную генерацию склада.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        # имя -> [вызовы, сумма секунд, максимум секунд]
+        self.timers: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._since = time.time()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Статистика с момента предыдущего сброса: времена в миллисекундах и счетчики."""
+        with self._lock:
+            now = time.time()
+            snapshot = {
+                'time': now,
+                'interval': now - self._since,
+                'timers': {name: {'calls': calls, 'total_ms': total * 1000, 'mean_us': total / calls * 1e6,
+                                  'max_us': longest * 1e6}
+                           for name, (calls, total, longest) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+            if reset:
+                self.timers = {}
+                self.counters = {}
+                self._since = now
+        return snapshot
+
+    def merge(self, snapshot: dict, prefix: str = '') -> None:
+        """Добавляет снимок другого профайлера (например, процесса-воркера), имена участков - с prefix."""
+        with self._lock:
+            for name, timer in snapshot['timers'].items():
+                total = self.timers.setdefault(prefix + name, [0, 0.0, 0.0])
+                total[0] += timer['calls']
+                total[1] += timer['total_ms'] / 1000
+                total[2] = max(total[2], timer['max_us'] / 1e6)
+            for name, value in snapshot['counters'].items():
+                self.counters[prefix + name] = self.counters.get(prefix + name, 0) + value
+
+    def reset(self) -> None:
+        self.snapshot(reset=True)
+
+    def dump(self, path: str, reset: bool = True) -> dict:
+        """Дописывает снимок строкой JSON в path."""
+        snapshot = self.snapshot(reset)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(snapshot) + '\n')
+        return snapshot
+
+
+PROFILER = Profiler(os.environ.get('CARRIER_PROFILE', '') not in ('', '0'))
+
+
+def profiled(name: str) -> Callable:
+    """Декоратор: время вызовов функции копится в PROFILER под именем name, пока он включен."""
+
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PROFILER.add_time(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+class PeriodicDump:
+    """Фоновый поток, который каждые every секунд дописывает снимок PROFILER в файл."""
+
+    def __init__(self, path: str, every: float = 60.0, profiler: Optional[Profiler] = None):
+        self.path = path
+        self.every = every
+        self.profiler = profiler or PROFILER
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'PeriodicDump':
+        self.profiler.enable()
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.every):
+            self.profiler.dump(self.path)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.profiler.dump(self.path)
+
+    def __enter__(self) -> 'PeriodicDump':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,165 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_OUTSIDE
+
+# Виды клеток кадра
+TILE_EMPTY = 0
+TILE_SHELF = 1
+TILE_TARGET = 2
+TILE_ROBOT = 3
+TILE_OUTSIDE = 4
+
+COLORS = {
+    TILE_EMPTY: (255, 255, 255),
+    TILE_SHELF: (128, 128, 128),
+    TILE_TARGET: (40, 170, 70),
+    TILE_ROBOT: (40, 90, 220),
+    TILE_OUTSIDE: (60, 60, 60),
+}
+GRID_COLOR = (210, 210, 210)
+
+
+def _make_tiles(cell_size: int, grid_lines: bool) -> np.ndarray:
+    """Готовые плитки (вид, cell_size, cell_size, 3) для всех видов клеток."""
+    tiles = np.empty((len(COLORS), cell_size, cell_size, 3), dtype=np.uint8)
+    for kind, color in COLORS.items():
+        tiles[kind] = color
+
+    # Робот - круг на пустой клетке
+    tiles[TILE_ROBOT] = COLORS[TILE_EMPTY]
+    center = (cell_size - 1) / 2
+    yy, xx = np.mgrid[:cell_size, :cell_size]
+    tiles[TILE_ROBOT][(yy - center) ** 2 + (xx - center) ** 2 <= (cell_size * 0.4) ** 2] = COLORS[TILE_ROBOT]
+
+    if grid_lines and cell_size > 2:
+        tiles[:, -1, :] = GRID_COLOR
+        tiles[:, :, -1] = GRID_COLOR
+    return tiles
+
+
+class GridRenderer:
+    """
+    Растеризует склад, роботов и цели в RGB-кадр NumPy. Между кадрами перерисовываются
+    только клетки, чей вид изменился, одной векторной записью.
+    """
+
+    def __init__(self, height: int, width: int, cell_size: int = 16, grid_lines: bool = True):
+        self.height = height
+        self.width = width
+        self.cell_size = cell_size
+        self.tiles = _make_tiles(cell_size, grid_lines)
+        self.frame = np.zeros((height * cell_size, width * cell_size, 3), dtype=np.uint8)
+        # Вид каждой клетки в текущем кадре, -1 - еще не нарисована
+        self.kinds = np.full((height, width), -1, dtype=np.int8)
+        # Кадр как (H, cell, W, cell, 3) - представление того же буфера
+        self._cells = self.frame.reshape(height, cell_size, width, cell_size, 3)
+
+    def draw(self, field: np.ndarray, positions=(), targets=()) -> np.ndarray:
+        """Обновляет кадр. field - склад (клетки роботов могут быть заняты), positions/targets - (N, 2)."""
+        kinds = np.where(field == CELL_BUSY, TILE_SHELF, TILE_EMPTY).astype(np.int8)
+        kinds[field == CELL_OUTSIDE] = TILE_OUTSIDE
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1, 2)
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        kinds[targets[:, 0], targets[:, 1]] = TILE_TARGET
+        kinds[positions[:, 0], positions[:, 1]] = TILE_ROBOT
+
+        rows, cols = np.nonzero(kinds != self.kinds)
+        if len(rows):
+            self._cells[rows, :, cols] = self.tiles[kinds[rows, cols]]
+            self.kinds = kinds
+        return self.frame
+
+    def invalidate(self) -> None:
+        """Следующий draw перерисует кадр целиком."""
+        self.kinds[:] = -1
+
+
+class FrameRecorder:
+    """
+    Потоковая запись кадров без дисплея. Формат определяется расширением:
+    .mp4/.avi/.webm - через imageio (нужен imageio[ffmpeg]), .gif - через Pillow,
+    остальное - сырые кадры подряд в одном файле и .json с формой кадра (читается через np.memmap).
+    """
+
+    def __init__(self, path: str, fps: int = 30):
+        self.path = path
+        self.fps = fps
+        self.count = 0
+        self.shape: Optional[tuple] = None
+        self._extension = os.path.splitext(path)[1].lower()
+        self._writer = None
+        self._gif_frames = []
+
+        if self._extension in ('.mp4', '.avi', '.webm'):
+            try:
+                import imageio
+            except ImportError as e:
+                raise ImportError('Video recording requires imageio: pip install imageio[ffmpeg]') from e
+            self._writer = imageio.get_writer(path, fps=fps, macro_block_size=1)
+        elif self._extension != '.gif':
+            self._writer = open(path, 'wb')
+
+    def write(self, frame: np.ndarray) -> None:
+        if self.shape is None:
+            self.shape = frame.shape
+        self.count += 1
+        if self._extension == '.gif':
+            # Pillow собирает GIF только целиком, поэтому кадры держатся в памяти
+            self._gif_frames.append(frame.copy())
+        elif self._extension in ('.mp4', '.avi', '.webm'):
+            self._writer.append_data(frame)
+        else:
+            self._writer.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+    def close(self) -> None:
+        if self._extension == '.gif':
+            if self._gif_frames:
+                from PIL import Image
+
+                images = [Image.fromarray(frame) for frame in self._gif_frames]
+                images[0].save(self.path, save_all=True, append_images=images[1:],
+                               duration=int(1000 / self.fps), loop=0)
+            self._gif_frames.clear()
+        elif self._writer is not None:
+            self._writer.close()
+            if self._extension not in ('.mp4', '.avi', '.webm'):
+                with open(os.path.splitext(self.path)[0] + '.json', 'w') as f:
+                    json.dump({'shape': list(self.shape or ()), 'count': self.count, 'fps': self.fps,
+                               'dtype': 'uint8'}, f)
+        self._writer = None
+
+    def __enter__(self) -> 'FrameRecorder':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def load_raw_frames(path: str) -> np.ndarray:
+    """Открывает сырую запись FrameRecorder как массив (кадры, H, W, 3) без чтения в память."""
+    with open(os.path.splitext(path)[0] + '.json') as f:
+        meta = json.load(f)
+    return np.memmap(path, dtype=np.uint8, mode='r', shape=(meta['count'], *meta['shape']))
+
+
+class FrameViewer:
+    """Показывает кадры в окне matplotlib, обновляя одно изображение вместо перерисовки фигуры."""
+
+    def __init__(self):
+        self._image = None
+
+    def show(self, frame: np.ndarray, title: str = '', pause: float = 0.01) -> None:
+        from matplotlib import pyplot as plt
+
+        if self._image is None or not plt.fignum_exists(self._image.figure.number):
+            plt.figure()
+            plt.axis('off')
+            self._image = plt.imshow(frame, interpolation='nearest')
+        else:
+            self._image.set_data(frame)
+        plt.title(title)
+        plt.pause(pause)
@@ -0,0 +1,390 @@
+import argparse
+import csv
+import io
+import mmap
+import os
+import struct
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.constants import CELL_BUSY
+from environment.carrier_robot_gym.multi_robot import MultiCarrierRobotEnv
+from environment.carrier_robot_gym.paths import layout_hash
+
+# Запись файла: 4 байта вида, 8 байт длины, затем сжатый .npz
+_HEADER = struct.Struct('<4sQ')
+LAYOUT = b'LAYT'
+EPISODE = b'EPIS'
+ACTIONS = b'ACTN'
+TARGETS = b'TRGT'
+SNAPSHOT = b'SNAP'
+
+
+def _encode(**arrays) -> bytes:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _decode(payload: bytes) -> dict[str, np.ndarray]:
+    with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _records(data) -> Iterator[tuple[bytes, int, int]]:
+    """Целые записи (вид, начало содержимого, длина) по одним заголовкам, содержимое не читается."""
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        kind, length = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        if start + length > len(data):
+            break  # Недописанная запись в конце файла
+        yield kind, start, length
+        offset = start + length
+
+
+def _payload(data, start: int, length: int, *keys: str) -> dict[str, np.ndarray]:
+    """Массивы записи; keys - распаковать только эти (остальные члены .npz не читаются)."""
+    if not keys:
+        return _decode(data[start:start + length])
+    with np.load(io.BytesIO(data[start:start + length]), allow_pickle=False) as arrays:
+        return {key: arrays[key] for key in keys}
+
+
+def _map(f) -> bytes:
+    """Файл, отображенный в память только для чтения (пустой файл отобразить нельзя)."""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+
+def _recover(path: str) -> int:
+    """
+    Подготовка записи к дописыванию: номер последнего эпизода. Файл проходится только по заголовкам,
+    распаковывается одна последняя запись EPISODE. Недописанный хвост прошлого запуска обрезается,
+    иначе новые записи легли бы после него и читатель остановился бы на обрыве, не увидев их.
+    """
+    episode = None
+    end = 0
+    with open(path, 'rb') as f:
+        data = _map(f)
+        try:
+            for kind, start, length in _records(data):
+                end = start + length
+                if kind == EPISODE:
+                    episode = (start, length)
+            size = len(data)
+            number = -1 if episode is None else int(_payload(data, *episode, 'episode')['episode'])
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    if end < size:
+        os.truncate(path, end)
+    return number
+
+
+class EpisodeRecorder:
+    """
+    Запись эпизодов CarrierRobotEnv или MultiCarrierRobotEnv в дописываемый файл:
+    склад (один раз на хеш), старт, цели, поток действий пачками по chunk_steps шагов
+    и снимки состояния каждые snapshot_every шагов для быстрой перемотки.
+    Смена цели записывается перед шагом, на котором она впервые действует, поэтому
+    назначения FleetOperator и новые цели после победы воспроизводятся одинаково.
+    Остальные атрибуты берутся у обернутой среды.
+    """
+
+    def __init__(self, env, path: str, snapshot_every: int = 256, chunk_steps: int = 1024):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.chunk_steps = chunk_steps
+
+        # Хеши складов, уже записанных в этом запуске. Прошлые не читаются: склад, встреченный снова,
+        # записывается еще раз (читатель берет любую из одинаковых записей)
+        self._layouts: set[str] = set()
+        self.episode = _recover(path) if os.path.exists(path) else -1
+        self._file = open(path, 'ab')
+        self._actions: list[np.ndarray] = []
+        self._chunk_start = 0
+        self.step_index = 0
+        self._targets: Optional[np.ndarray] = None
+        self.env = env
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def __setattr__(self, name, value):
+        # Свои атрибуты создаются в __init__, остальные (например, reassign_targets у FleetOperator) - у среды
+        if name in self.__dict__ or 'env' not in self.__dict__ or name == 'env':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.env, name, value)
+
+    def _state(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        env = self.env
+        return (np.asarray(env.pos).reshape(-1, 2), np.asarray(env.target).reshape(-1, 2),
+                np.asarray(env.time).reshape(-1))
+
+    def _write(self, kind: bytes, **arrays) -> None:
+        payload = _encode(**arrays)
+        self._file.write(_HEADER.pack(kind, len(payload)))
+        self._file.write(payload)
+
+    def _flush_actions(self) -> None:
+        if self._actions:
+            self._write(ACTIONS, episode=self.episode, start=self._chunk_start, count=len(self._actions),
+                        actions=np.stack(self._actions).astype(np.uint8))
+            self._actions = []
+            self._file.flush()
+        self._chunk_start = self.step_index
+
+    def reset(self, **kwargs):
+        self._flush_actions()
+        result = self.env.reset(**kwargs)
+        layout = self.env.layout
+        key = layout_hash(layout)
+        if key not in self._layouts:
+            self._layouts.add(key)
+            self._write(LAYOUT, hash=np.array(key), layout=np.asarray(layout, dtype=np.int8))
+
+        pos, target, _ = self._state()
+        self.episode += 1
+        self.step_index = self._chunk_start = 0
+        self._targets = target.copy()
+        self._write(EPISODE, episode=self.episode, hash=np.array(key), pos=pos, target=target)
+        self._file.flush()
+        return result
+
+    def step(self, actions):
+        pos, target, time = self._state()
+        changed = np.flatnonzero((target != self._targets).any(axis=1))
+        if len(changed):
+            self._write(TARGETS, episode=self.episode, step=self.step_index, robots=changed, target=target[changed])
+            self._targets = target.copy()
+        if self.step_index and self.step_index % self.snapshot_every == 0:
+            self._write(SNAPSHOT, episode=self.episode, step=self.step_index, pos=pos, target=target, time=time)
+
+        self._actions.append(np.asarray(actions).reshape(-1))
+        self.step_index += 1
+        if len(self._actions) >= self.chunk_steps:
+            self._flush_actions()
+        return self.env.step(actions)
+
+    def close(self) -> None:
+        self._flush_actions()
+        self._file.close()
+
+
+@dataclass
+class _EpisodeIndex:
+    hash: str
+    pos: np.ndarray
+    target: np.ndarray
+    # (первый шаг, смещение записи) пачек действий и снимков, события целей по шагам
+    chunks: list[tuple[int, int, int]] = field(default_factory=list)
+    snapshots: list[tuple[int, int, int]] = field(default_factory=list)
+    target_events: dict[int, tuple[np.ndarray, np.ndarray]] = field(default_factory=dict)
+    length: int = 0
+
+
+class ReplayLog:
+    """
+    Чтение записи EpisodeRecorder. Файл отображается в память (mmap), а не читается целиком. При открытии
+    он просматривается по заголовкам записей, действия распаковываются только при обращении
+    (последние пачки кэшируются).
+    """
+
+    def __init__(self, path: str, cache_chunks: int = 8):
+        self.path = path
+        self.layouts: dict[str, int] = {}
+        self.episodes: list[_EpisodeIndex] = []
+        self._cache: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._cache_chunks = cache_chunks
+        with open(path, 'rb') as f:
+            self._data = _map(f)
+        self._scan()
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __enter__(self) -> 'ReplayLog':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _payload(self, start: int, length: int, *keys: str) -> dict[str, np.ndarray]:
+        return _payload(self._data, start, length, *keys)
+
+    def _scan(self) -> None:
+        for kind, start, length in _records(self._data):
+            if kind == LAYOUT:
+                self.layouts[str(self._payload(start, length, 'hash')['hash'])] = start
+            elif kind == EPISODE:
+                record = self._payload(start, length)
+                self.episodes.append(_EpisodeIndex(str(record['hash']), record['pos'], record['target']))
+            elif kind == ACTIONS:
+                record = self._payload(start, length, 'episode', 'start', 'count')
+                episode = self.episodes[int(record['episode'])]
+                episode.chunks.append((int(record['start']), start, length))
+                episode.length = max(episode.length, int(record['start']) + int(record['count']))
+            elif kind == SNAPSHOT:
+                record = self._payload(start, length, 'episode', 'step')
+                self.episodes[int(record['episode'])].snapshots.append((int(record['step']), start, length))
+            elif kind == TARGETS:
+                record = self._payload(start, length)
+                self.episodes[int(record['episode'])].target_events[int(record['step'])] = \
+                    (record['robots'], record['target'])
+
+    def layout(self, episode: int) -> np.ndarray:
+        start = self.layouts[self.episodes[episode].hash]
+        kind, length = _HEADER.unpack_from(self._data, start - _HEADER.size)
+        return self._payload(start, length)['layout']
+
+    def actions(self, episode: int) -> np.ndarray:
+        """Все действия эпизода (шаги, роботы)."""
+        chunks = self.episodes[episode].chunks
+        return np.concatenate([self._chunk(start, length) for _, start, length in chunks]) if chunks \
+            else np.zeros((0, len(self.episodes[episode].pos)), dtype=np.uint8)
+
+    def _chunk(self, start: int, length: int) -> np.ndarray:
+        if start in self._cache:
+            self._cache.move_to_end(start)
+        else:
+            self._cache[start] = self._payload(start, length)['actions']
+            if len(self._cache) > self._cache_chunks:
+                self._cache.popitem(last=False)
+        return self._cache[start]
+
+    def _actions_from(self, episode: int, step: int) -> Iterator[np.ndarray]:
+        for first, start, length in self.episodes[episode].chunks:
+            chunk = self._chunk(start, length)
+            if first + len(chunk) <= step:
+                continue
+            yield from chunk[max(0, step - first):]
+
+    def _env(self, episode: int) -> MultiCarrierRobotEnv:
+        index = self.episodes[episode]
+        layout = self.layout(episode)
+        env = MultiCarrierRobotEnv(width=layout.shape[1], height=layout.shape[0], count_agents=len(index.pos),
+                                   reassign_targets=False)
+        env.reset(options={'layout': layout, 'pos': index.pos, 'target': index.target})
+        return env
+
+    def _restore(self, env: MultiCarrierRobotEnv, pos: np.ndarray, target: np.ndarray, time: np.ndarray) -> None:
+        env.pos[:] = pos
+        env.target[:] = target
+        env.time[:] = time
+        env.field = env.layout.copy()
+        env.field[env.pos[:, 0], env.pos[:, 1]] = CELL_BUSY
+
+    def replay(self, episode: int, start: int = 0, stop: Optional[int] = None) \
+            -> Iterator[tuple[int, MultiCarrierRobotEnv, Optional[tuple]]]:
+        """
+        Шаги эпизода от start до stop: (номер шага, среда в состоянии перед шагом, результат предыдущего шага).
+        Перемотка к start идет от ближайшего снимка, а не с начала эпизода.
+        """
+        index = self.episodes[episode]
+        stop = index.length if stop is None else min(stop, index.length)
+        env = self._env(episode)
+        step = 0
+        snapshots = [snapshot for snapshot in index.snapshots if snapshot[0] <= start]
+        if snapshots:
+            step, offset, length = snapshots[-1]
+            snapshot = self._payload(offset, length)
+            self._restore(env, snapshot['pos'], snapshot['target'], snapshot['time'])
+
+        result = None
+        actions = self._actions_from(episode, step)
+        while step <= stop:
+            # Цели, действующие с этого шага (для шага со снимком они уже учтены в снимке)
+            if step in index.target_events:
+                robots, target = index.target_events[step]
+                env.target[robots] = target
+            if step >= start:
+                yield step, env, result
+            if step == stop:
+                return
+            result = env.step(next(actions))[1:]
+            step += 1
+
+    def state_at(self, episode: int, step: int) -> dict[str, np.ndarray]:
+        """Состояние перед шагом step: поле, позиции, цели и время роботов."""
+        for _, env, _ in self.replay(episode, step, step):
+            return {'field': env.field.copy(), 'pos': env.pos.copy(), 'target': env.target.copy(),
+                    'time': env.time.copy()}
+        raise IndexError(f'Step {step} is out of range')
+
+    def episode_stats(self, episode: int) -> dict:
+        """Итоги эпизода по всем роботам: победы, столкновения, выходы за поле, сумма наград."""
+        wins = collisions = off_grid = 0
+        total = 0.0
+        for _, _, result in self.replay(episode):
+            if result is None:
+                continue
+            rewards, terminated, _, infos = result
+            total += float(rewards.sum())
+            off_grid += int((rewards <= -10).sum())
+            wins += sum('win' in info for info in infos)
+            collisions += sum('collision' in info for info in infos)
+        collisions -= off_grid  # Выход за поле помечен в info как столкновение
+        return {'episode': episode, 'robots': len(self.episodes[episode].pos), 'steps': self.episodes[episode].length,
+                'wins': wins, 'collisions': collisions, 'off_grid': off_grid, 'total_reward': total}
+
+    def export_stats(self, path: Optional[str] = None) -> list[dict]:
+        stats = [self.episode_stats(episode) for episode in range(len(self.episodes))]
+        if path is not None and stats:
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(stats[0]))
+                writer.writeheader()
+                writer.writerows(stats)
+        return stats
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Просмотр и статистика записей эпизодов')
+    parser.add_argument('log')
+    commands = parser.add_subparsers(dest='command', required=True)
+    stats = commands.add_parser('stats', help='Итоги всех эпизодов')
+    stats.add_argument('--csv')
+    show = commands.add_parser('show', help='Состояние склада перед шагом')
+    show.add_argument('episode', type=int)
+    show.add_argument('step', type=int)
+    video = commands.add_parser('video', help='Записать эпизод в видео/GIF')
+    video.add_argument('episode', type=int)
+    video.add_argument('out')
+    video.add_argument('--start', type=int, default=0)
+    video.add_argument('--stop', type=int)
+    video.add_argument('--fps', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    log = ReplayLog(args.log)
+    if args.command == 'stats':
+        totals = defaultdict(float)
+        for row in log.export_stats(args.csv):
+            print(row)
+            for key in ('steps', 'wins', 'collisions', 'off_grid'):
+                totals[key] += row[key]
+        print('total', dict(totals))
+    elif args.command == 'show':
+        state = log.state_at(args.episode, args.step)
+        grid = state['field'].astype(str)
+        grid[grid == '0'], grid[grid == '1'] = '.', '#'
+        for i, (target, pos) in enumerate(zip(state['target'], state['pos'])):
+            grid[tuple(target)] = 'T'
+            grid[tuple(pos)] = str(i % 10)
+        print('\n'.join(' '.join(row) for row in grid))
+        print('time', state['time'].tolist())
+    else:
+        from environment.carrier_robot_gym.renderer import FrameRecorder, GridRenderer
+
+        renderer = None
+        with FrameRecorder(args.out, args.fps) as recorder:
+            for _, env, _ in log.replay(args.episode, args.start, args.stop):
+                renderer = renderer or GridRenderer(env.height, env.width)
+                recorder.write(renderer.draw(env.field, env.pos, env.target))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import multiprocessing
+import os
+import time
+from typing import Any, Optional, Sequence
+
+import gymnasium
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvIndices, VecEnvStepReturn
+
+from environment.carrier_robot_gym.profiling import PROFILER
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+
+# Команды воркерам: шаг по действиям из общей памяти, вызов с аргументами через канал, завершение
+STEP, CALL, CLOSE = 0, 1, 2
+
+
+class _SharedArrays:
+    """Массивы NumPy поверх одного блока общей памяти: specs - имя -> (dtype, shape)."""
+
+    def __init__(self, specs: dict[str, tuple[str, tuple]], raw=None, context=None):
+        offsets = {}
+        size = 0
+        for name, (dtype, shape) in specs.items():
+            offsets[name] = size
+            size += -(-np.dtype(dtype).itemsize * int(np.prod(shape)) // 8) * 8
+        self.raw = raw if raw is not None else context.RawArray('b', max(size, 1))
+        self.arrays = {name: np.frombuffer(self.raw, dtype=dtype, count=int(np.prod(shape)),
+                                           offset=offsets[name]).reshape(shape)
+                       for name, (dtype, shape) in specs.items()}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+
+def _worker(raw, specs: dict, index: int, start: int, stop: int, env_class: type, env_kwargs: dict,
+            go, done, conn) -> None:
+    """
+    Воркер index владеет средами [start, stop): шагает их одной векторной средой env_class и пишет
+    наблюдения, награды и завершения прямо в общую память. Такт - пара семафоров: go - команда
+    выставлена, done - воркер закончил. Ошибка шага отмечается в errors[index], а само исключение
+    передается по каналу, и воркер все равно отпускает done.
+    """
+    shared = _SharedArrays(specs, raw)
+    rows = slice(start, stop)
+    try:
+        env = env_class(stop - start, reuse_obs=True, **env_kwargs)
+    except Exception as e:  # noqa: BLE001 - ошибка передается в основной процесс
+        conn.send(e)
+        conn.close()
+        return
+    # Готовность: запуск процесса (spawn, импорт torch) не ограничен timeout такта
+    conn.send(None)
+    keys = list(env.observation_space.spaces)
+
+    def write(obs: dict) -> None:
+        for key in keys:
+            shared[f'obs_{key}'][rows] = obs[key]
+
+    try:
+        while True:
+            go.acquire()
+            command = shared['command'][0]
+            if command == CLOSE:
+                break
+            if command == STEP:
+                try:
+                    obs, rewards, dones, infos = env.step(shared['actions'][rows])
+                    write(obs)
+                    shared['rewards'][rows] = rewards
+                    shared['dones'][rows] = dones
+                    for i in np.flatnonzero(dones):
+                        shared['wins'][start + i] = infos[i].get('win', False)
+                        shared['truncated'][start + i] = infos[i]['TimeLimit.truncated']
+                        for key in keys:
+                            shared[f'terminal_{key}'][start + i] = infos[i]['terminal_observation'][key]
+                except Exception as e:  # noqa: BLE001 - ошибка передается в основной процесс
+                    shared['errors'][index] = True
+                    conn.send(e)
+            else:
+                kind, name, args, kwargs, indices = conn.recv()
+                try:
+                    result = None
+                    if indices is None:
+                        pass
+                    elif kind == 'reset':
+                        env._seeds = list(args[rows])
+                        write(env.reset())
+                    elif kind == 'get_attr':
+                        result = env.get_attr(name, indices)
+                    elif kind == 'set_attr':
+                        env.set_attr(name, args, indices)
+                    elif kind == 'env_method':
+                        result = env.env_method(name, *args, indices=indices, **kwargs)
+                    elif kind == 'get_images':
+                        images = env.get_images()
+                        result = [images[i] for i in indices]
+                    elif kind == 'profile':
+                        if args:
+                            PROFILER.enable()
+                        else:
+                            PROFILER.disable()
+                        result = [PROFILER.snapshot(reset=True)]
+                    conn.send(result)
+                except Exception as e:  # noqa: BLE001 - ошибка передается в основной процесс
+                    conn.send(e)
+            done.release()
+    finally:
+        env.close()
+        conn.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Многопроцессная векторная среда без сериализации на шаге. num_envs сред делятся на блоки
+    по числу воркеров, каждый воркер шагает свой блок векторной средой env_class (по умолчанию
+    CarrierRobotVecEnv) и пишет результаты в общие массивы NumPy. Основной процесс только кладет
+    действия в общую память и ждет барьер, по каналам идут лишь редкие вызовы (reset с seed,
+    get_attr, env_method, get_images). Последнее наблюдение завершившихся эпизодов тоже лежит
+    в общей памяти. Аргументы env_kwargs передаются env_class, seed воркера w - seed + w.
+    reuse_obs - как у CarrierRobotVecEnv: step возвращает сами общие буферы без копии, с model.learn
+    несовместим.
+    Исключение в среде воркера поднимается в основном процессе из step / вызова. Если воркер умер
+    или не ответил за timeout секунд, поднимается RuntimeError и среда закрывается.
+    """
+
+    def __init__(self, num_envs: int, num_workers: Optional[int] = None, env_class: type = CarrierRobotVecEnv,
+                 seed: Optional[int] = None, reuse_obs: bool = False, start_method: str = 'spawn',
+                 timeout: Optional[float] = 60.0, **env_kwargs):
+        probe = env_class(1, **env_kwargs)
+        observation_space, action_space = probe.observation_space, probe.action_space
+        probe.close()
+        self.num_envs = num_envs
+        self.env_class = env_class
+        self.batched_methods = getattr(env_class, 'batched_methods', frozenset())
+        self.reuse_obs = reuse_obs
+        self.timeout = timeout
+
+        num_workers = min(num_workers or os.cpu_count() or 1, num_envs)
+        self.blocks = np.array_split(np.arange(num_envs), num_workers)
+        specs = {'command': ('int64', (1,)), 'actions': ('int64', (num_envs,)),
+                 'rewards': ('float32', (num_envs,)), 'dones': ('bool', (num_envs,)),
+                 'wins': ('bool', (num_envs,)), 'truncated': ('bool', (num_envs,)),
+                 'errors': ('bool', (num_workers,))}
+        for key, space in observation_space.spaces.items():
+            specs[f'obs_{key}'] = (space.dtype.str, (num_envs, *space.shape))
+            specs[f'terminal_{key}'] = (space.dtype.str, (num_envs, *space.shape))
+
+        # spawn: форк процесса с уже запущенными потоками torch может зависнуть
+        context = multiprocessing.get_context(start_method)
+        self._shared = _SharedArrays(specs, context=context)
+        # Не Barrier: его Condition навсегда ждет участника, убитого посреди ожидания
+        self._go = [context.Semaphore(0) for _ in self.blocks]
+        self._done = [context.Semaphore(0) for _ in self.blocks]
+        self._conns = []
+        self._processes = []
+        for w, block in enumerate(self.blocks):
+            parent, child = context.Pipe()
+            kwargs = dict(env_kwargs, seed=None if seed is None else seed + w)
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(self._shared.raw, specs, w, int(block[0]), int(block[-1]) + 1,
+                                            env_class, kwargs, self._go[w], self._done[w], child))
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        self._keys = list(observation_space.spaces)
+        self.closed = False
+        for conn in self._conns:
+            try:
+                error = conn.recv()
+            except EOFError:
+                error = RuntimeError('SharedMemoryVecEnv worker died during startup')
+            if error is not None:
+                self._terminate()
+                raise error
+        # Базовый конструктор уже опрашивает воркеры (get_attr('render_mode'))
+        super().__init__(num_envs, observation_space, action_space)
+
+    def _wait(self) -> None:
+        """Ждет окончания такта всеми воркерами, не дольше timeout секунд, проверяя, что они живы."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        for w, (done, process) in enumerate(zip(self._done, self._processes)):
+            while not done.acquire(timeout=0.1):
+                if not process.is_alive():
+                    self._fail(f'worker {w} died with exit code {process.exitcode}')
+                if deadline is not None and time.monotonic() > deadline:
+                    self._fail(f'worker {w} did not respond in {self.timeout} s')
+
+    def _fail(self, reason: str) -> None:
+        self._terminate()
+        raise RuntimeError(f'SharedMemoryVecEnv is closed: {reason}')
+
+    def _terminate(self) -> None:
+        for process in self._processes:
+            process.terminate()
+            process.join()
+        for conn in self._conns:
+            conn.close()
+        self.closed = True
+
+    def _run(self, command: int) -> None:
+        self._shared['command'][0] = command
+        for go in self._go:
+            go.release()
+
+    def _call(self, kind: str, name: str = '', args: Any = (), kwargs: Optional[dict] = None,
+              indices: VecEnvIndices = None) -> list[Any]:
+        """Вызов в воркерах, которым принадлежат indices. Результаты по средам в порядке indices."""
+        indices = list(self._get_indices(indices))
+        local = [[int(i - block[0]) for i in indices if block[0] <= i <= block[-1]] for block in self.blocks]
+        self._run(CALL)
+        for conn, block_indices in zip(self._conns, local):
+            conn.send((kind, name, args, kwargs or {}, block_indices or None))
+        try:
+            results = [conn.recv() for conn in self._conns]
+        except EOFError:
+            # Воркер умер, не ответив: _wait назовет его
+            results = []
+        self._wait()
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        by_env = {}
+        for block, block_indices, result in zip(self.blocks, local, results):
+            for i, value in zip(block_indices, result or ()):
+                by_env[int(block[0]) + i] = value
+        return [by_env.get(i) for i in indices]
+
+    def _observations(self, prefix: str = 'obs') -> dict[str, np.ndarray]:
+        obs = {key: self._shared[f'{prefix}_{key}'] for key in self._keys}
+        return obs if self.reuse_obs else {key: value.copy() for key, value in obs.items()}
+
+    def reset(self):
+        # Воркер берет из списка seed своего блока
+        self._call('reset', args=list(self._seeds))
+        self._reset_seeds()
+        self._reset_options()
+        return self._observations()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._shared['actions'][:] = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+        self._run(STEP)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        self._wait()
+        errors = self._shared['errors']
+        if errors.any():
+            failed = [conn.recv() for conn, error in zip(self._conns, errors) if error]
+            errors[:] = False
+            raise failed[0]
+        dones = self._shared['dones'].copy()
+        infos: list[dict[str, Any]] = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(dones):
+            if self._shared['wins'][i]:
+                infos[i]['win'] = True
+            infos[i]['TimeLimit.truncated'] = bool(self._shared['truncated'][i])
+            infos[i]['terminal_observation'] = {key: self._shared[f'terminal_{key}'][i].copy() for key in self._keys}
+        return self._observations(), self._shared['rewards'].copy(), dones, infos
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._run(CLOSE)
+        for process in self._processes:
+            process.join()
+        for conn in self._conns:
+            conn.close()
+        self.closed = True
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> list[Any]:
+        return self._call('get_attr', attr_name, indices=indices)
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        self._call('set_attr', attr_name, value, indices=indices)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> list[Any]:
+        return self._call('env_method', method_name, method_args, method_kwargs, indices)
+
+    def env_is_wrapped(self, wrapper_class: type[gymnasium.Wrapper], indices: VecEnvIndices = None) -> list[bool]:
+        return [False for _ in self._get_indices(indices)]
+
+    def action_masks(self) -> np.ndarray:
+        """Допустимые действия (N, 5): каждый воркер считает маски своего блока."""
+        return np.stack(self.env_method('action_masks'))
+
+    def get_images(self) -> Sequence[Optional[np.ndarray]]:
+        return self._call('get_images')
+
+    def profile(self, enabled: bool = True) -> list[dict]:
+        """
+        Включает или выключает PROFILER в воркерах (у каждого процесса свой) и возвращает их снимки
+        с предыдущего вызова, по одному на воркер.
+        """
+        return self._call('profile', args=enabled, indices=[int(block[0]) for block in self.blocks])
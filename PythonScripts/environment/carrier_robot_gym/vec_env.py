@@ -0,0 +1,195 @@
+from typing import Any, Optional, Sequence
+
+import gymnasium
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvIndices, VecEnvStepReturn
+
+from environment.carrier_robot_gym.carrier_robot_gym import CELL_BUSY, CELL_EMPTY, MOVES
+from environment.carrier_robot_gym.field import generate_fields
+from environment.carrier_robot_gym.layout_bank import open_layout_bank
+from environment.carrier_robot_gym.masking import valid_action_masks
+from environment.carrier_robot_gym.observation import ObservationBuffers
+from environment.carrier_robot_gym.profiling import profiled
+from environment.carrier_robot_gym.renderer import GridRenderer
+
+
+def sample_cells(rng: np.random.Generator, mask: np.ndarray) -> np.ndarray:
+    """
+    Выбирает по одной случайной ячейке из маски (N, H, W) для каждого поля. Возвращает (N, 2).
+    Поле без подходящих ячеек (склад банка без стеллажей или без свободных клеток) - ошибка,
+    иначе argmax молча вернул бы (0, 0).
+    """
+    n, height, width = mask.shape
+    empty = np.flatnonzero(~mask.any(axis=(1, 2)))
+    if len(empty):
+        raise ValueError(f'{len(empty)} of {n} fields have no cells to sample (first: #{empty[0]})')
+    scores = rng.random(mask.shape)
+    scores[~mask] = -1.0
+    flat = scores.reshape(n, -1).argmax(axis=1)
+    return np.stack(np.divmod(flat, width), axis=1)
+
+
+class CarrierRobotVecEnv(VecEnv):
+    """
+    Векторизованный движок CarrierRobotEnv: N складов шагают одним вызовом NumPy.
+    Награды и условия завершения совпадают с CarrierRobotEnv.step, эпизоды перезапускаются автоматически.
+    reuse_obs=True несовместим с model.learn (см. комментарий в __init__): для обучения нужен reuse_obs=False,
+    тогда step и reset возвращают копии. Буферы без копии - для циклов, которые сами копируют наблюдения
+    (акторы actor_learner, бенчмарки).
+    """
+    # Методы, возвращающие массив по всем средам, а не одно значение
+    batched_methods = frozenset({'action_masks'})
+
+    def __init__(self, num_envs: int, width: int = 10, height: int = 10, render_mode=None,
+                 wall_density: tuple[float, float] = (0.2, 0.3), max_episode_steps: Optional[int] = None,
+                 seed: Optional[int] = None, layout_bank=None, compact_obs: bool = False,
+                 view_radius: Optional[int] = None, reuse_obs: bool = False):
+        if width <= 1 or height <= 1:
+            raise ValueError('Height and width must be greater than 1')
+
+        self.layout_bank = open_layout_bank(layout_bank)
+        if self.layout_bank is not None and (self.layout_bank.height, self.layout_bank.width) != (height, width):
+            raise ValueError('Layout bank size does not match the field size')
+
+        self.width = width
+        self.height = height
+        self.render_mode = render_mode
+        self.wall_density = wall_density
+        self.max_episode_steps = max_episode_steps
+
+        # reuse_obs: step возвращает одни и те же буферы, потребитель должен скопировать их до следующего шага.
+        # Для model.learn не подходит: SB3 кладет наблюдение в RolloutBuffer уже после следующего step
+        self._obs = ObservationBuffers(num_envs, height, width, compact_obs, view_radius, reuse_obs)
+        super().__init__(num_envs, self._obs.space, gymnasium.spaces.Discrete(5))
+
+        # В режиме окна склады живут внутри рамки буфера наблюдений, чтобы не копировать их каждый шаг
+        self.fields = self._obs.interior if view_radius is not None else np.zeros((num_envs, height, width), np.int8)
+        self.pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.target = np.zeros((num_envs, 2), dtype=np.int64)
+        self.time = np.zeros(num_envs, dtype=np.int64)
+
+        self._rng = np.random.default_rng(seed)
+        self._actions = np.zeros(num_envs, dtype=np.int64)
+        self._all = np.arange(num_envs)
+        # Границы поля для проверки хода: общие (2,) или свои у каждой среды (N, 2), см. curriculum.py
+        self._bounds = np.array([height, width])
+        self._renderers = None
+
+    def reset(self):
+        seeds = [s for s in self._seeds if s is not None]
+        if seeds:
+            self._rng = np.random.default_rng(seeds[0])
+        self._reset_envs(self._all)
+        self._reset_seeds()
+        self._reset_options()
+        self._obs.fill(self.fields, self.pos, self.target)
+        return self._obs.get()
+
+    @profiled('vec_env.reset_envs')
+    def _reset_envs(self, indices: np.ndarray) -> None:
+        """Генерирует новые склады, цели и стартовые позиции для указанных сред."""
+        if len(indices) == 0:
+            return
+        if self.layout_bank is not None:
+            fields = self.layout_bank.take(self.layout_bank.sample_indices(self._rng, len(indices)))
+        else:
+            density = self._rng.uniform(*self.wall_density, size=len(indices))
+            fields = generate_fields(len(indices), self.height, self.width, density, rng=self._rng)
+        self.fields[indices] = fields
+
+        self.target[indices] = sample_cells(self._rng, fields == CELL_BUSY)
+        pos = sample_cells(self._rng, fields == CELL_EMPTY)
+        self.pos[indices] = pos
+        self.fields[indices, pos[:, 0], pos[:, 1]] = CELL_BUSY
+        self.time[indices] = 0
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+    @profiled('vec_env.step_wait')
+    def step_wait(self) -> VecEnvStepReturn:
+        envs = self._all
+        pos, target = self.pos, self.target
+
+        # Победа до хода: шаг не выполняется и время не идет
+        pre_win = np.abs(pos - target).sum(axis=1) == 1
+
+        direction = pos + MOVES[self._actions]
+        valid = ((direction >= 0) & (direction < self._bounds)).all(axis=1)
+        safe = np.where(valid[:, None], direction, pos)
+        moved = (direction != pos).any(axis=1)
+        busy = (self.fields[envs, safe[:, 0], safe[:, 1]] == CELL_BUSY) & moved
+
+        invalid = ~pre_win & ~valid
+        collision = ~pre_win & valid & busy
+        movers = envs[~pre_win & valid & ~busy]
+
+        self.fields[movers, pos[movers, 0], pos[movers, 1]] = CELL_EMPTY
+        pos[movers] = direction[movers]
+        self.fields[movers, pos[movers, 0], pos[movers, 1]] = CELL_BUSY
+
+        post_win = ~pre_win & (np.abs(pos - target).sum(axis=1) == 1)
+
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        rewards[pre_win] = 1
+        rewards[invalid] = -11
+        rewards[collision] = -1
+        rewards[post_win] += 1
+
+        active = ~pre_win
+        rewards[active] -= 1.25 / (self.time[active] + 1)
+        self.time[active] += 1
+
+        terminated = pre_win | invalid | collision | post_win
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        if self.max_episode_steps is not None:
+            truncated = ~terminated & (self.time >= self.max_episode_steps)
+        dones = terminated | truncated
+
+        wins = pre_win | post_win
+        infos: list[dict[str, Any]] = [{} for _ in range(self.num_envs)]
+        done_envs = envs[dones]
+        self._obs.fill(self.fields, pos, target)
+        if len(done_envs):
+            # Последние наблюдения копируются из буферов, затем перезаписываются только строки сброшенных сред
+            terminal = {'field': self._obs.field[done_envs], 'pos': self._obs.pos[done_envs],
+                        'target': self._obs.target[done_envs]}
+            for k, i in enumerate(done_envs):
+                if wins[i]:
+                    infos[i]['win'] = True
+                infos[i]['TimeLimit.truncated'] = bool(truncated[i])
+                infos[i]['terminal_observation'] = {key: value[k] for key, value in terminal.items()}
+            self._reset_envs(done_envs)
+            self._obs.fill(self.fields, self.pos, self.target, done_envs)
+
+        return self._obs.get(), rewards, dones, infos
+
+    def action_masks(self) -> np.ndarray:
+        """Допустимые действия всех сред (N, 5) одним вызовом NumPy."""
+        return valid_action_masks(self.fields, self.pos, self._bounds)
+
+    def close(self) -> None:
+        pass
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> list[Any]:
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> list[Any]:
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        if method_name in self.batched_methods:
+            # Метод считает сразу все среды: каждой достается своя строка (так маски получает MaskablePPO)
+            return [result[i] for i in self._get_indices(indices)]
+        return [result for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class: type[gymnasium.Wrapper], indices: VecEnvIndices = None) -> list[bool]:
+        return [False for _ in self._get_indices(indices)]
+
+    def get_images(self) -> Sequence[Optional[np.ndarray]]:
+        if self._renderers is None:
+            self._renderers = [GridRenderer(self.height, self.width) for _ in range(self.num_envs)]
+        return [renderer.draw(self.fields[i], self.pos[i], self.target[i]).copy()
+                for i, renderer in enumerate(self._renderers)]
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from typing import Optional
+
+import numpy as np
+from stable_baselines3 import PPO
+
+from compact_policy import load_model
+from environment.carrier_robot_gym.constants import CELL_BUSY, CELL_EMPTY
+from environment.carrier_robot_gym.field import generate_fields
+from environment.carrier_robot_gym.layout_bank import open_layout_bank
+from environment.carrier_robot_gym.masking import masked_predict
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv, sample_cells
+
+
+def make_episodes(count: int, height: int, width: int, seed: int = 0, layout_bank=None) -> dict[str, np.ndarray]:
+    """
+    Фиксированный набор эпизодов (склад, цель, старт) - одинаковый для всех сравниваемых моделей.
+    Склады берутся из отложенной части банка или генерируются из seed.
+    """
+    rng = np.random.default_rng(seed)
+    bank = open_layout_bank(layout_bank)
+    if bank is not None:
+        indices = bank.holdout_indices()
+        if len(indices) == 0:
+            indices = np.arange(len(bank))
+        fields = bank.take(np.resize(indices, count))
+    else:
+        fields = generate_fields(count, height, width, rng.uniform(0.2, 0.3, size=count), rng=rng)
+
+    target = sample_cells(rng, fields == CELL_BUSY)
+    pos = sample_cells(rng, fields == CELL_EMPTY)
+    return {'field': fields, 'pos': pos, 'target': target}
+
+
+class FixedEpisodeVecEnv(CarrierRobotVecEnv):
+    """Векторная среда, которая вместо случайных складов по очереди выдает эпизоды из заданного набора."""
+
+    def __init__(self, num_envs: int, episodes: dict[str, np.ndarray], max_episode_steps: int):
+        height, width = episodes['field'].shape[1:]
+        self.episodes = episodes
+        self.next_episode = 0
+        # Номер эпизода в каждом слоте, -1 - слот больше не используется
+        self.slot_episode = np.full(num_envs, -1)
+        super().__init__(num_envs, width=width, height=height, max_episode_steps=max_episode_steps)
+
+    def _reset_envs(self, indices: np.ndarray) -> None:
+        left = len(self.episodes['field']) - self.next_episode
+        taken = indices[:left]
+        self.slot_episode[indices[left:]] = -1
+        if len(taken) == 0:
+            return
+
+        episode = np.arange(self.next_episode, self.next_episode + len(taken))
+        self.next_episode += len(taken)
+        self.slot_episode[taken] = episode
+        self.fields[taken] = self.episodes['field'][episode]
+        self.target[taken] = self.episodes['target'][episode]
+        pos = self.episodes['pos'][episode]
+        self.pos[taken] = pos
+        self.fields[taken, pos[:, 0], pos[:, 1]] = CELL_BUSY
+        self.time[taken] = 0
+
+
+def evaluate(model: PPO, episodes: dict[str, np.ndarray], num_envs: int = 256, max_steps: int = 100,
+             deterministic: bool = True, masked: bool = False) -> dict:
+    """
+    Прогоняет все эпизоды набора на одной модели без отрисовки, predict вызывается пачкой на все среды.
+    masked - действия выбираются только из допустимых (env.action_masks()).
+    """
+    count = len(episodes['field'])
+    env = FixedEpisodeVecEnv(min(num_envs, count), episodes, max_steps)
+    obs = env.reset()
+
+    wins = collisions = off_grid = timeouts = steps = finished = 0
+    episode_length = np.zeros(env.num_envs, dtype=np.int64)
+    episode_steps = []
+    start = time.perf_counter()
+    while finished < count:
+        active = env.slot_episode >= 0
+        if masked:
+            actions = masked_predict(model, obs, env.action_masks(), deterministic)
+        else:
+            actions, _ = model.predict(obs, deterministic=deterministic)
+        obs, rewards, dones, infos = env.step(actions)
+        steps += int(active.sum())
+        episode_length += 1
+
+        for i in np.nonzero(dones & active)[0]:
+            finished += 1
+            episode_steps.append(int(episode_length[i]))
+            if 'win' in infos[i]:
+                wins += 1
+            elif infos[i]['TimeLimit.truncated']:
+                timeouts += 1
+            elif rewards[i] < -10:
+                off_grid += 1
+            else:
+                collisions += 1
+        episode_length[dones] = 0
+    elapsed = time.perf_counter() - start
+
+    return {
+        'episodes': count,
+        'success_rate': wins / count,
+        'collision_rate': collisions / count,
+        'off_grid_rate': off_grid / count,
+        'timeout_rate': timeouts / count,
+        'mean_steps': float(np.mean(episode_steps)),
+        'env_steps_per_sec': steps / elapsed,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description='Оценка сохраненных моделей без отрисовки')
+    parser.add_argument('checkpoints', nargs='*', default=['models/*.zip'], help='Пути или маски .zip (или манифестов компактных политик .json)')
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--envs', type=int, default=256)
+    parser.add_argument('--max-steps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout-bank', help='Банк складов (папка с банками или файл .npy)')
+    parser.add_argument('--stochastic', action='store_true')
+    parser.add_argument('--masked', action='store_true', help='Выбирать только допустимые действия')
+    parser.add_argument('--json', help='Куда сохранить результаты в JSON')
+    parser.add_argument('--csv', help='Куда сохранить результаты в CSV')
+    args = parser.parse_args(argv)
+
+    paths = sorted(path for pattern in args.checkpoints for path in glob.glob(pattern))
+    episode_sets = {}
+    results = []
+    for path in paths:
+        model = load_model(path)
+        size = model.observation_space['field'].shape
+        if size not in episode_sets:
+            bank = args.layout_bank
+            if bank is not None and os.path.isdir(bank):
+                bank = next(iter(glob.glob(os.path.join(bank, f'layouts_{size[0]}x{size[1]}_*.npy'))), None)
+            episode_sets[size] = make_episodes(args.episodes, *size, seed=args.seed, layout_bank=bank)
+
+        result = {'checkpoint': os.path.basename(path), 'grid': f'{size[0]}x{size[1]}', 'masked': args.masked}
+        result.update(evaluate(model, episode_sets[size], args.envs, args.max_steps, not args.stochastic,
+                               args.masked))
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.csv and results:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
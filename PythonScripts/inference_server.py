@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+
+OBS_KEYS = ('field', 'pos', 'target')
+
+
+class _ExportedPolicy(torch.nn.Module):
+    """Только ветка действий политики SB3: признаки -> MLP -> argmax логитов (детерминированный predict)."""
+
+    def __init__(self, policy):
+        super().__init__()
+        self.extractor = policy.pi_features_extractor
+        self.policy_net = policy.mlp_extractor.policy_net
+        self.action_net = policy.action_net
+
+    def forward(self, field: torch.Tensor, pos: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        features = self.extractor({'field': field.float(), 'pos': pos.float(), 'target': target.float()})
+        return self.action_net(self.policy_net(features)).argmax(dim=1)
+
+
+def _example_inputs(model: PPO) -> tuple[torch.Tensor, ...]:
+    space = model.observation_space
+    return tuple(torch.zeros((1, *space[key].shape), dtype=torch.from_numpy(np.zeros(0, space[key].dtype)).dtype)
+                 for key in OBS_KEYS)
+
+
+def export_policy(model: PPO, path: str) -> None:
+    """Экспорт политики для CPU: .pt - TorchScript, .onnx - ONNX (нужен пакет onnx)."""
+    module = _ExportedPolicy(model.policy.to('cpu')).eval()
+    example = _example_inputs(model)
+    if path.endswith('.onnx'):
+        torch.onnx.export(module, example, path, input_names=list(OBS_KEYS), output_names=['action'],
+                          dynamic_axes={key: {0: 'batch'} for key in (*OBS_KEYS, 'action')})
+    else:
+        with torch.no_grad():
+            torch.jit.save(torch.jit.trace(module, example), path)
+
+
+def load_policy(path: str) -> Callable[[dict[str, np.ndarray]], np.ndarray]:
+    """
+    Политика для пачки наблюдений {'field': (B, H, W), 'pos': (B, 2), 'target': (B, 2)} -> действия (B,).
+    Чекпоинт .zip экспортируется в TorchScript в памяти, .pt и .onnx загружаются как есть,
+    манифест .json - компактная политика на NumPy (compact_policy.py).
+    """
+    if path.endswith('.json'):
+        from compact_policy import load_compact
+
+        return load_compact(path)
+    if path.endswith('.onnx'):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError('ONNX policies require onnxruntime: pip install onnxruntime') from e
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        return lambda obs: session.run(None, {key: obs[key] for key in OBS_KEYS})[0]
+
+    if path.endswith('.zip'):
+        model = PPO.load(path, device='cpu')
+        module = torch.jit.trace(_ExportedPolicy(model.policy).eval(), _example_inputs(model))
+    else:
+        module = torch.jit.load(path)
+    module = torch.jit.optimize_for_inference(torch.jit.freeze(module.eval()))
+
+    def policy(obs: dict[str, np.ndarray]) -> np.ndarray:
+        with torch.inference_mode():
+            return module(*(torch.from_numpy(np.ascontiguousarray(obs[key])) for key in OBS_KEYS)).numpy()
+
+    return policy
+
+
+class LatencyStats:
+    """
+    Размеры пачек за время работы сервера и задержки последних window запросов: память ограничена
+    и у долго работающего сервера, а перцентили отражают текущую нагрузку. Максимум - за все время.
+    """
+
+    def __init__(self, window: int = 100_000):
+        self.latencies: deque = deque(maxlen=window)
+        self.max_latency = 0.0
+        self.batch_sizes: Counter = Counter()
+        self.requests = 0
+        self.robots = 0
+        self.started = time.perf_counter()
+
+    def add(self, latency: float, robots: int) -> None:
+        self.latencies.append(latency)
+        self.max_latency = max(self.max_latency, latency)
+        self.requests += 1
+        self.robots += robots
+
+    def report(self) -> dict:
+        latencies = np.fromiter(self.latencies, float, len(self.latencies)) * 1000 if self.latencies else np.zeros(1)
+        # Гистограмма размеров пачек по степеням двойки: ключ - верхняя граница корзины
+        histogram = Counter()
+        for size, count in self.batch_sizes.items():
+            histogram[1 << (size - 1).bit_length()] += count
+        elapsed = time.perf_counter() - self.started
+        return {
+            'requests': self.requests,
+            'robots': self.robots,
+            'robots_per_sec': self.robots / elapsed if elapsed else 0.0,
+            'latency_window': len(self.latencies),
+            'latency_ms_p50': float(np.percentile(latencies, 50)),
+            'latency_ms_p99': float(np.percentile(latencies, 99)),
+            'latency_ms_max': self.max_latency * 1000,
+            'batches': sum(self.batch_sizes.values()),
+            'mean_batch': self.robots / max(1, sum(self.batch_sizes.values())),
+            'batch_histogram': {str(bound): histogram[bound] for bound in sorted(histogram)},
+        }
+
+
+class BatchingInferenceServer:
+    """
+    Динамическая пачка: запросы (наблюдения одного или нескольких роботов) копятся до max_batch роботов
+    или max_wait секунд после первого запроса и считаются одним вызовом политики.
+    Политика работает в отдельном потоке, пока цикл asyncio собирает следующую пачку.
+    В пачку попадают только запросы с полем того же размера, что у первого, остальные ждут следующей пачки.
+    Ошибка сборки пачки или политики возвращается только запросам этой пачки.
+    """
+
+    def __init__(self, policy: Callable[[dict[str, np.ndarray]], np.ndarray], max_batch: int = 256,
+                 max_wait: float = 0.002):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = LatencyStats()
+        self._queue: Optional[asyncio.Queue] = None
+        # Запросы с другим размером поля, отложенные до следующей пачки
+        self._deferred: deque = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def predict(self, obs: dict[str, np.ndarray]) -> np.ndarray:
+        """Действия для пачки наблюдений одного контроллера (первая ось - роботы)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((obs, future, time.perf_counter()))
+        return await future
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [self._deferred.popleft() if self._deferred else await self._queue.get()]
+            shape = np.shape(items[0][0]['field'])[1:]
+            size = len(items[0][0]['pos'])
+            deferred = deque()
+            while self._deferred and size < self.max_batch:
+                item = self._deferred.popleft()
+                if np.shape(item[0]['field'])[1:] == shape:
+                    items.append(item)
+                    size += len(item[0]['pos'])
+                else:
+                    deferred.append(item)
+            self._deferred.extendleft(reversed(deferred))
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if np.shape(item[0]['field'])[1:] != shape:
+                    self._deferred.append(item)
+                    continue
+                items.append(item)
+                size += len(item[0]['pos'])
+
+            try:
+                batch = {key: np.concatenate([obs[key] for obs, _, _ in items]) for key in OBS_KEYS}
+                actions = await loop.run_in_executor(self._executor, self.policy, batch)
+            except Exception as e:  # noqa: BLE001 - ошибка пачки возвращается всем ее запросам
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self.stats.batch_sizes[size] += 1
+            offset = 0
+            for obs, future, started in items:
+                count = len(obs['pos'])
+                if not future.done():
+                    future.set_result(actions[offset:offset + count])
+                offset += count
+                self.stats.add(now - started, count)
+
+
+def _decode(message: dict) -> dict[str, np.ndarray]:
+    return {
+        'field': np.asarray(message['field'], dtype=np.int8),
+        'pos': np.asarray(message['pos'], dtype=np.int64).reshape(-1, 2),
+        'target': np.asarray(message['target'], dtype=np.int64).reshape(-1, 2),
+    }
+
+
+async def serve(server: BatchingInferenceServer, host: str = '127.0.0.1', port: int = 8765) -> asyncio.AbstractServer:
+    """
+    Протокол - строки JSON. Запрос {"field": [...], "pos": [[r, c], ...], "target": [[r, c], ...]}
+    (поле (H, W) общее для всех роботов или (N, H, W)) -> {"actions": [...]}; {"cmd": "stats"} -> статистика.
+    """
+    server.start()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message.get('cmd') == 'stats':
+                    response = server.stats.report()
+                else:
+                    obs = _decode(message)
+                    if obs['field'].ndim == 2:
+                        obs['field'] = np.broadcast_to(obs['field'], (len(obs['pos']), *obs['field'].shape))
+                    response = {'actions': (await server.predict(obs)).tolist()}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except Exception as e:  # noqa: BLE001 - любая ошибка запроса или политики возвращается клиенту
+            writer.write(json.dumps({'error': str(e)}).encode() + b'\n')
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+class InferenceClient:
+    """
+    Синхронный клиент сервера: вызывается как политика obs -> действия, как model.predict(obs, deterministic=True)[0]
+    (сервер всегда выбирает действие с наибольшим логитом).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765):
+        self._socket = socket.create_connection((host, port))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile('rwb')
+
+    def _request(self, message: dict) -> dict:
+        self._file.write(json.dumps(message).encode() + b'\n')
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    def __call__(self, obs: dict[str, np.ndarray]) -> np.ndarray:
+        field = np.asarray(obs['field'])
+        # Общее поле всех роботов (MultiCarrierRobotEnv) отправляется один раз
+        if field.ndim == 3 and field.strides[0] == 0:
+            field = field[0]
+        message = {'field': field.tolist(), 'pos': np.asarray(obs['pos']).tolist(),
+                   'target': np.asarray(obs['target']).tolist()}
+        return np.asarray(self._request(message)['actions'])
+
+    def stats(self) -> dict:
+        return self._request({'cmd': 'stats'})
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+
+async def _load_test(host: str, port: int, controllers: int, robots: int, ticks: int, shape: tuple) -> dict:
+    """Нагрузка: controllers контроллеров по robots роботов, каждый такт - один запрос на всех своих роботов."""
+    from environment.carrier_robot_gym.multi_robot import MultiCarrierRobotEnv
+
+    async def controller(seed: int) -> None:
+        env = MultiCarrierRobotEnv(width=shape[1], height=shape[0], count_agents=robots)
+        obs, _ = env.reset(seed=seed)
+        reader, writer = await asyncio.open_connection(host, port)
+        for _ in range(ticks):
+            message = {'field': env.field.tolist(), 'pos': obs['pos'].tolist(), 'target': obs['target'].tolist()}
+            writer.write(json.dumps(message).encode() + b'\n')
+            await writer.drain()
+            actions = json.loads(await reader.readline())['actions']
+            obs, *_ = env.step(actions)
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*(controller(seed) for seed in range(controllers)))
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"cmd": "stats"}\n')
+    await writer.drain()
+    report = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return report
+
+
+async def _main(args: argparse.Namespace) -> None:
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    server = BatchingInferenceServer(load_policy(args.checkpoint), args.max_batch, args.max_wait_ms / 1000)
+    listener = await serve(server, args.host, args.port)
+    print(f'Serving {os.path.basename(args.checkpoint)} on {args.host}:{args.port}', flush=True)
+
+    if args.load_test:
+        if args.checkpoint.endswith('.zip'):
+            model_shape = PPO.load(args.checkpoint, device='cpu').observation_space['field'].shape
+        elif args.checkpoint.endswith('.json'):
+            model_shape = tuple(server.policy.manifest['grid'])
+        else:
+            model_shape = tuple(args.load_test_shape)
+        report = await _load_test(args.host, args.port, args.load_test, args.robots, args.ticks, model_shape)
+        print(json.dumps(report, indent=2))
+        listener.close()
+        await listener.wait_closed()
+        await server.stop()
+        return
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Сервер инференса с динамической пачкой для управления флотом')
+    parser.add_argument('checkpoint', help='Чекпоинт .zip, TorchScript .pt, .onnx или манифест компактной политики .json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, help='Число потоков torch')
+    parser.add_argument('--export', help='Только экспортировать политику в .pt или .onnx и выйти')
+    parser.add_argument('--load-test', type=int, metavar='CONTROLLERS',
+                        help='Запустить нагрузку из стольких контроллеров и вывести задержки')
+    parser.add_argument('--robots', type=int, default=8, help='Роботов на контроллер при нагрузке')
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--load-test-shape', type=int, nargs=2, default=(10, 10))
+    args = parser.parse_args(argv)
+
+    if args.export:
+        export_policy(PPO.load(args.checkpoint, device='cpu'), args.export)
+        return
+    asyncio.run(_main(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,220 +1,200 @@
+import json
 from time import sleep
+from typing import Optional
+
 import gymnasium as gym
 import gymnasium.spaces
 import numpy as np
 from gymnasium import register
-from matplotlib import pyplot as plt
 from stable_baselines3 import PPO, A2C
-from stable_baselines3.common.callbacks import BaseCallback
-from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.vec_env import SubprocVecEnv
 
+import actor_learner
+from compact_policy import load_model
 from environment.carrier_robot_gym.carrier_robot_gym import CarrierRobotEnv, CELL_EMPTY, CELL_BUSY
-from collections import defaultdict
-
-
-class RewardLoggerCallback(BaseCallback):
-    def __init__(self, verbose=0):
-        super().__init__(verbose)
-        self.episode_rewards = []
-        self.episode_lengths = []
-        self.step_rewards = []
-        self.episode_info = defaultdict(list)
-        self.current_episode_rewards = 0.0
-        self.current_episode_length = 0
-        self.average_rewards = []
-        self.average_reward = 0
-        self.count = 0
-
-    def _on_step(self) -> bool:
-        infos = self.locals.get('infos', [{}])
-        dones = self.locals.get('dones', [False])
-        rewards = self.locals.get('rewards', [0.0])
-        self.count += 1
-        if self.count % 100_000 == 0:
-            self.step_rewards.append(rewards[0])
-            self.current_episode_rewards += rewards[0]
-            self.current_episode_length += 1
-
-            self.average_reward += rewards[0]
-
-            self.average_rewards.append(self.average_reward / self.count)
-
-            if dones[0]:
-                self.episode_rewards.append(self.current_episode_rewards)
-                self.episode_lengths.append(self.current_episode_length)
-
-                # Сохраняем только числовые метрики из инфо
-                for key, value in infos[0].items():
-                    if isinstance(value, (int, float, np.number)):
-                        self.episode_info[key].append(float(value))
-
-                self.current_episode_rewards = 0.0
-                self.current_episode_length = 0
-
-        return True
-
-    def _on_rollout_end(self):
-        if len(self.episode_rewards) > 0:
-            print("\n--- Episode Stats ---")
-            print(f"Mean Reward: {np.mean(self.episode_rewards):.2f}")
-            print(f"Mean Length: {np.mean(self.episode_lengths):.2f}")
-
-            # Выводим только числовые метрики
-            for key in self.episode_info:
-                if len(self.episode_info[key]) > 0:
-                    print(f"{key}: {np.mean(self.episode_info[key]):.2f}")
-            print("----------------------\n")
-
-
-def learn(width: int = 10, height: int = 10):
+from environment.carrier_robot_gym.curriculum import (CurriculumCallback, CurriculumScheduler, CurriculumVecEnv,
+                                                       DEFAULT_STAGES)
+from environment.carrier_robot_gym.features import policy_kwargs
+from environment.carrier_robot_gym.fleet import DISPATCHERS, FleetOperator, TaskQueue
+from environment.carrier_robot_gym.masking import maskable_ppo, masked_predict
+from environment.carrier_robot_gym.multi_robot import MultiCarrierRobotEnv
+from environment.carrier_robot_gym.planning import PlannerPolicy
+from environment.carrier_robot_gym.renderer import FrameRecorder, FrameViewer, GridRenderer
+from environment.carrier_robot_gym.replay import EpisodeRecorder
+from environment.carrier_robot_gym.shared_vec_env import SharedMemoryVecEnv
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+from inference_server import InferenceClient
+from telemetry import ProfilingCallback, TelemetryCallback, plot_runs, run_log_path
+
+
+def learn(width: int = 10, height: int = 10, n_envs: int = 4, masked: bool = False,
+          num_workers: Optional[int] = None, profile: bool = False, extractor: str = 'flatten'):
     # env = CarrierRobotEnv(width=width, height=height, render_mode='human')
-    callback = RewardLoggerCallback()
-
-    env = make_vec_env(
-        env_id='CarrierRobot-v0',
-        n_envs=4,
-        env_kwargs={"width": width, "height": height, "render_mode": "human"}
-
-    )
-    #
-    # # Инициализация PPO
-    # model = PPO(
-    #     "MultiInputPolicy",
-    #     env=env,
-    #     learning_rate=3e-4,
-    #     n_steps=2048,
-    #     batch_size=64,
-    #     gamma=0.99,
-    #     verbose=1,
-    #     device="auto"
-    # )
-    model = PPO.load('models/CarrierRobot v33 10x10 20m.zip', env=env)
+    # Лог телеметрии - свой файл на каждый запуск (logs/telemetry-<время>-<pid>.csv)
+    callback = TelemetryCallback()
+    callbacks = [callback]
+    if profile:
+        # Время сред, генерации складов, сбора роллаутов и обновлений: python telemetry.py profile <файл .jsonl>
+        callbacks.append(ProfilingCallback())
+
+    # Все склады шагают одним вызовом NumPy, num_workers - разделить их между процессами с общей памятью
+    if num_workers:
+        env = SharedMemoryVecEnv(n_envs, num_workers, width=width, height=height)
+    else:
+        env = CarrierRobotVecEnv(n_envs, width=width, height=height)
+    # extractor='egocentric' - окно вокруг робота со свертками (features.py): размер сети не зависит от склада
+    if masked:
+        # Недопустимые ходы исключаются из выборки: env.action_masks() считается для всех сред сразу
+        model = maskable_ppo()('MultiInputPolicy', env=env, policy_kwargs=policy_kwargs(extractor), verbose=1)
+    elif extractor != 'flatten':
+        model = PPO('MultiInputPolicy', env=env, policy_kwargs=policy_kwargs(extractor), verbose=1)
+    else:
+        model = PPO.load('models/CarrierRobot v33 10x10 20m.zip', env=env)
 
     # model = PPO.load('models/CarrierRobot v25 5x5 10m', env=env)
-    model.learn(total_timesteps=20_000, callback=callback)
+    model.learn(total_timesteps=20_000, callback=callbacks)
     model.save('CarrierRobot')
 
-    # Визуализация данных
-    plt.figure(figsize=(14, 8))
-
-    # График наград за шаг
-    plt.subplot(3, 1, 1)
-    plt.plot(callback.step_rewards, alpha=0.3)
-
-    plt.ylim(-20)
-    plt.title('Step Rewards')
-    plt.xlabel('Step')
-
-    # Гистограмма наград
-    plt.subplot(3, 1, 2)
-    plt.hist(callback.step_rewards, bins=50)
-    plt.title('Rewards Distribution')
-
-    # График наград за эпизод
-    plt.subplot(3, 1, 3)
-    plt.plot(callback.average_rewards)
-    plt.ylim(-15, 10)
-    plt.title('Average Rewards')
-    plt.grid()
-    plt.xlabel('Episode')
-
-    plt.tight_layout()
-    plt.savefig('training_stats.png')
-    plt.show()
-
-
-def play(version: str, width: int = 10, height: int = 10, count_agents: int = 3):
-    envs = []
-    for i in range(count_agents):
-        envs.append(CarrierRobotEnv(width=width, height=height, render_mode='human'))
-
-    model = PPO.load(version)
-    envs = reset(envs, count_agents)
-    field = envs[0].field
+    # Графики по логу телеметрии, сравнение прогонов: python telemetry.py compare logs/*.csv
+    plot_runs([callback.path], out='training_stats.png')
+
+
+def learn_async(width: int = 5, height: int = 5, num_actors: Optional[int] = None, total_timesteps: int = 20_000_000,
+                extractor: str = 'flatten', target_success: Optional[float] = None):
+    """
+    Асинхронно: акторы в отдельных процессах собирают траектории, пока сеть обучается (actor_learner.py).
+    Сравнение с синхронным PPO.learn: python actor_learner.py compare --size 5 --target 0.8
+    """
+    model, report = actor_learner.learn_async(total_timesteps, width, height, num_actors, extractor=extractor,
+                                              max_episode_steps=20 * max(width, height),
+                                              target_success=target_success)
+    model.save(f'CarrierRobot async {width}x{height}')
+    print(actor_learner.format_reports([report]))
+
+
+def learn_curriculum(max_size: int = 16, view_radius: int = 3, n_envs: int = 64, total_timesteps: int = 10_000_000,
+                     promote_at: float = 0.8):
+    """Одна политика на всех размерах: склад растет по этапам curriculum.DEFAULT_STAGES по доле побед."""
+    scheduler = CurriculumScheduler([stage for stage in DEFAULT_STAGES if stage.size <= max_size], promote_at)
+    env = CurriculumVecEnv(n_envs, max_size, scheduler.stage, max_episode_steps=4 * max_size,
+                           view_radius=view_radius)
+    model = PPO('MultiInputPolicy', env=env, n_steps=256, batch_size=2048, verbose=1)
+
+    curriculum = CurriculumCallback(scheduler, verbose=1)
+    model.learn(total_timesteps=total_timesteps, callback=[curriculum, TelemetryCallback(run_log_path('curriculum'))])
+    model.save(f'CarrierRobot curriculum {max_size}x{max_size} r{view_radius}')
+    print('Stage changes (timesteps, stage):', curriculum.history)
+
+
+def model_policy(model, env, masked: bool = True, deterministic: bool = True):
+    """
+    Политика obs -> действия роботов env из модели: masked - ходы за поле и в стеллажи не выбираются,
+    deterministic задается явно, чтобы play, operate и record вели чекпоинт одинаково.
+    """
+    if masked:
+        return lambda obs: masked_predict(model, obs, env.action_masks(), deterministic)
+    return lambda obs: model.predict(obs, deterministic=deterministic)[0]
+
+
+def play(version: str, width: int = 10, height: int = 10, count_agents: int = 3,
+         server: Optional[tuple[str, int]] = None, replay_path: Optional[str] = None, masked: bool = True,
+         deterministic: bool = True):
+    env = MultiCarrierRobotEnv(width=width, height=height, count_agents=count_agents)
+    if replay_path is not None:
+        # Запись для разбора столкновений: python -m environment.carrier_robot_gym.replay <файл> stats
+        env = EpisodeRecorder(env, replay_path)
+
+    # server=(host, port) - действия считает общий сервер инференса (inference_server.py) вместо своей модели
+    # deterministic задается явно в обоих случаях, чтобы чекпоинт вел себя одинаково при любом способе вызова
+    if server is not None:
+        if not deterministic:
+            raise ValueError('The inference server returns argmax actions only, use deterministic=True')
+        policy = InferenceClient(*server)
+    else:
+        # Чекпоинт .zip или манифест компактной политики .json (compact_policy.py)
+        policy = model_policy(load_model(version), env, masked, deterministic)
+    obs = reset(env)
 
     while True:
-        for i in range(count_agents):
-            envs[i].field = field
-            action, state = model.predict(envs[i].get_obs())
-            print(i + 1, '---', action)
-            obs, reward, terminated, _, info = envs[i].step(action)
-
-            field = obs['field']
-            render(envs, field, width, height)
-
-
-            if terminated and 'win' in info:
-                target_pos = envs[i].find_random_cell(CELL_BUSY)
-                while any(np.array_equal(envs[j].pos, target_pos) for j in range(count_agents)):
-                    target_pos = envs[i].find_random_cell(CELL_BUSY)
+        # Действия всех роботов за один проход сети, затем один одновременный такт
+        actions = policy(obs)
+        print(' '.join(f'{i + 1} --- {action}' for i, action in enumerate(actions)))
+        obs, rewards, terminated, _, infos = env.step(actions)
+
+        render(env.pos, env.target, env.field, width, height)
+
+        if any(terminated[i] and 'win' not in infos[i] for i in range(count_agents)):
+            obs = reset(env)
+
+
+def operate(version: str, width: int = 10, height: int = 10, count_agents: int = 3, ticks: int = 10_000,
+            dispatcher: str = 'hungarian', task_rate: float = 0.5, tick_seconds: float = 1.0,
+            task_timeout: Optional[int] = 200, planner: bool = False, tick_budget: Optional[float] = None,
+            masked: bool = True, deterministic: bool = True) -> dict:
+    """
+    Работа флота по очереди заданий без сброса эпизода, метрики пропускной способности склада.
+    planner - маршруты строит CooperativePlanner, модель ведет только роботов, не получивших план
+    за tick_budget секунд такта.
+    """
+    env = MultiCarrierRobotEnv(width=width, height=height, count_agents=count_agents)
+    policy = model_policy(load_model(version), env, masked, deterministic)
+    if planner:
+        policy = PlannerPolicy(env, fallback=policy, tick_budget=tick_budget, active=lambda: operator.busy)
+
+    operator = FleetOperator(env, policy, DISPATCHERS[dispatcher],
+                             TaskQueue(env.np_random, rate=task_rate), tick_seconds, task_timeout)
+    operator.reset()
+    metrics = operator.run(ticks)
+    print(json.dumps(metrics, indent=2))
+    return metrics
+
+
+def reset(env: MultiCarrierRobotEnv):
+    # Поле спец
+    if (env.height, env.width) == (5, 5):
+        obs, _ = env.reset(options={
+            'layout': np.array([
+                [0, 1, 1, 1, 0],
+                [1, 0, 0, 0, 1],
+                [1, 0, 0, 0, 1],
+                [1, 0, 0, 0, 1],
+                [0, 1, 1, 1, 0],
+            ]),
+            'pos': [[1, 1]],
+            'target': [[2, 4]],
+        })
+        return obs
+    # end
 
-                envs[i].target = target_pos
+    obs, _ = env.reset()
+    return obs
 
-            elif terminated:
-                envs = reset(envs, count_agents)
-                field = envs[0].field
-                break
 
+_renderer: Optional[GridRenderer] = None
+_viewer = FrameViewer()
 
-        for i in range(count_agents):
-            envs[i].field = field
 
+def render(positions, targets, field, width: int = 10, height: int = 10) -> None:
+    global _renderer
+    if _renderer is None or (_renderer.height, _renderer.width) != (height, width):
+        _renderer = GridRenderer(height, width)
+    _viewer.show(_renderer.draw(field, positions, targets), pause=0.01)
 
-def reset(envs, count_agents):
-    envs[0].reset()
 
-    # Поле спец
-    envs[0].field = np.array([
-        [0, 1, 1, 1, 0],
-        [1, 1, 0, 0, 1],
-        [1, 0, 0, 0, 1],
-        [1, 0, 0, 0, 1],
-        [0, 1, 1, 1, 0],
-    ])
-    envs[0].pos = np.array([1, 1])
-    envs[0].target = np.array([2, 4])
-    # end
+def record(version: str, path: str, width: int = 10, height: int = 10, count_agents: int = 3, ticks: int = 500,
+           fps: int = 8, masked: bool = True, deterministic: bool = True) -> None:
+    """Прогон модели без окна с записью кадров в файл (.mp4/.gif/сырые кадры)."""
+    env = MultiCarrierRobotEnv(width=width, height=height, count_agents=count_agents, render_mode='rgb_array')
+    policy = model_policy(load_model(version), env, masked, deterministic)
+    obs = reset(env)
 
-    field: np.ndarray[np.int8] = envs[0].field
-    for i in range(1, count_agents):
-        envs[i].field = field
-        envs[i].pos = envs[i].find_random_cell(CELL_EMPTY)
-        field[tuple(envs[i].pos)] = CELL_BUSY
-
-        target_pos = envs[i].find_random_cell(CELL_BUSY)
-        while any(np.array_equal(envs[j].pos, target_pos) for j in range(count_agents)):
-            target_pos = envs[i].find_random_cell(CELL_BUSY)
-
-        envs[i].target = target_pos
-
-        field = envs[i].field
-
-    for i in range(count_agents):
-        envs[i].field = field
-
-    return envs
-
-
-def render(envs, field, width: int = 10, height: int = 10) -> None:
-    plt.clf()
-    # Отрисовка сетки
-    plt.grid(True, color='gray', linestyle='--', linewidth=0.5)
-    plt.xticks(np.arange(0, width + 1, 1))
-    plt.yticks(np.arange(0, height + 1, 1))
-    for i in range(height):
-        for j in range(width):
-            if field[i][j] == 1:
-                plt.scatter(j + 0.5, i + 0.5, s=500, c='gray', marker='s')
-
-    for i in range(len(envs)):
-        plt.scatter(envs[i].target[1] + 0.5, envs[i].target[0] + 0.5, s=500, c='green', marker='s')
-        # print(i, envs[i].target)
-        plt.scatter(envs[i].pos[1] + 0.5, envs[i].pos[0] + 0.5, s=500, c='blue', marker='o')
-    plt.xlim(0, width)
-    plt.ylim(height, 0)
-    plt.gca().set_aspect('equal')
-    plt.pause(0.01)
+    with FrameRecorder(path, fps) as recorder:
+        recorder.write(env.render())
+        for _ in range(ticks):
+            actions = policy(obs)
+            obs, _, terminated, _, infos = env.step(actions)
+            recorder.write(env.render())
+            if any(terminated[i] and 'win' not in infos[i] for i in range(count_agents)):
+                obs = reset(env)
 
 
 if __name__ == '__main__':
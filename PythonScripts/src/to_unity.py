@@ -1,11 +1,12 @@
 from stable_baselines3 import PPO
-from unity_wrapper import UnityCarrierWrapper
+# Запуск из PythonScripts: python -m src.to_unity
+from src.unity_wrapper import UnityCarrierWrapper
 
 # Инициализация обертки
-env = UnityCarrierWrapper("../environment/carrier_robot_gym/carrier_robot_gym.py")
+env = UnityCarrierWrapper("environment/carrier_robot_gym/carrier_robot_gym.py")
 
 # Загрузка модели
-model = PPO.load("../models/CarrierRobot v61 5x5 240m.zip")
+model = PPO.load("models/CarrierRobot v61 5x5 240m.zip")
 
 # Запуск предсказаний
 obs, _ = env.reset()
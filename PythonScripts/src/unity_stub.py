@@ -0,0 +1,134 @@
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+
+
+class ActionTuple:
+    """Действия для set_actions, как mlagents_envs.base_env.ActionTuple."""
+
+    def __init__(self, continuous: Optional[np.ndarray] = None, discrete: Optional[np.ndarray] = None):
+        self.continuous = continuous
+        self.discrete = discrete
+
+    def add_discrete(self, discrete: np.ndarray) -> None:
+        self.discrete = discrete
+
+
+class ObservationSpec(NamedTuple):
+    shape: tuple
+
+
+class BehaviorSpec(NamedTuple):
+    observation_specs: list
+    action_spec: tuple
+
+
+class DecisionSteps(NamedTuple):
+    obs: list
+    reward: np.ndarray
+    agent_id: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.agent_id)
+
+
+class TerminalSteps(NamedTuple):
+    obs: list
+    reward: np.ndarray
+    interrupted: np.ndarray
+    agent_id: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.agent_id)
+
+
+class StubUnityEnvironment:
+    """
+    Заглушка UnityEnvironment без Unity: сцена из agents роботов, у каждого свой склад CarrierRobotVecEnv.
+    Говорит на том же API шагов (behavior_specs, reset, get_steps, set_actions, step, close),
+    наблюдения - три массива float32 (поле, позиция, цель), как у UnityCarrierWrapper.
+    latency - задержка step в секундах, имитирующая время кадра Unity,
+    respawn - завершившие эпизод агенты возвращаются с новым agent_id, как пересозданные в сцене Unity.
+    Запуск замера пропускной способности: python -m src.unity_stub из PythonScripts.
+    """
+    behavior_name = 'CarrierRobot?team=0'
+
+    def __init__(self, file_name: Optional[str] = None, worker_id: int = 0, seed: int = 0, side_channels=None,
+                 no_graphics: bool = True, agents: int = 8, width: int = 5, height: int = 5,
+                 max_episode_steps: Optional[int] = 100, latency: float = 0.0, respawn: bool = False):
+        self.worker_id = worker_id
+        self.latency = latency
+        self.respawn = respawn
+        self._sim = CarrierRobotVecEnv(agents, width=width, height=height, seed=seed + worker_id,
+                                       max_episode_steps=max_episode_steps)
+        self._agent_ids = np.arange(agents) + worker_id * agents
+        self._next_id = (worker_id + 1) * agents
+        self.behavior_specs = {self.behavior_name: BehaviorSpec(
+            [ObservationSpec((height, width)), ObservationSpec((2,)), ObservationSpec((2,))], ((5,),))}
+        self._actions = np.zeros(agents, dtype=np.int64)
+        self._steps: Optional[tuple[DecisionSteps, TerminalSteps]] = None
+
+    @staticmethod
+    def _to_unity(obs: dict) -> list:
+        return [obs['field'].astype(np.float32), obs['pos'].astype(np.float32), obs['target'].astype(np.float32)]
+
+    def reset(self) -> None:
+        obs = self._sim.reset()
+        decision = DecisionSteps(self._to_unity(obs), np.zeros(len(self._agent_ids), np.float32), self._agent_ids)
+        self._steps = decision, self._empty_terminal()
+        self._actions[:] = 0
+
+    def _empty_terminal(self) -> TerminalSteps:
+        spec = self.behavior_specs[self.behavior_name]
+        return TerminalSteps([np.zeros((0, *s.shape), np.float32) for s in spec.observation_specs],
+                             np.zeros(0, np.float32), np.zeros(0, bool), np.zeros(0, np.int64))
+
+    def get_steps(self, behavior_name: str) -> tuple[DecisionSteps, TerminalSteps]:
+        return self._steps
+
+    def set_actions(self, behavior_name: str, action: ActionTuple) -> None:
+        self._actions[:] = np.asarray(action.discrete).reshape(-1)
+
+    def step(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        obs, rewards, dones, infos = self._sim.step(self._actions)
+
+        # Завершившие эпизод агенты есть и в terminal (последнее наблюдение), и в decision (новый эпизод)
+        done = np.nonzero(dones)[0]
+        terminal_obs = [np.stack([infos[i]['terminal_observation'][key] for i in done]).astype(np.float32)
+                        if len(done) else empty for key, empty in zip(('field', 'pos', 'target'),
+                                                                      self._empty_terminal().obs)]
+        terminal = TerminalSteps(terminal_obs, rewards[done],
+                                 np.array([infos[i]['TimeLimit.truncated'] for i in done], dtype=bool),
+                                 self._agent_ids[done])
+        if self.respawn and len(done):
+            self._agent_ids = self._agent_ids.copy()
+            self._agent_ids[done] = self._next_id + np.arange(len(done))
+            self._next_id += len(done)
+        decision = DecisionSteps(self._to_unity(obs), np.where(dones, 0, rewards).astype(np.float32),
+                                 self._agent_ids)
+        self._steps = decision, terminal
+
+    def close(self) -> None:
+        self._sim.close()
+
+
+if __name__ == '__main__':
+    from src.unity_wrapper import UnityVecEnv
+
+    # Пропускная способность моста на заглушке: агенты на сцену x число экземпляров
+    for workers in (1, 4):
+        for agents in (1, 16):
+            env = UnityVecEnv(num_workers=workers, env_factory=lambda worker_id, agents=agents: StubUnityEnvironment(
+                worker_id=worker_id, agents=agents, latency=0.005))
+            env.reset()
+            start = time.perf_counter()
+            for _ in range(100):
+                env.step(np.random.randint(0, 5, env.num_envs))
+            elapsed = time.perf_counter() - start
+            print(f'workers={workers} agents={agents}: {100 * env.num_envs / elapsed:.0f} agent steps/s')
+            env.close()
@@ -1,8 +1,18 @@
-from mlagents_envs.environment import UnityEnvironment
-from mlagents_envs.base_env import ActionTuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Sequence
+
+try:
+    from mlagents_envs.environment import UnityEnvironment
+    from mlagents_envs.base_env import ActionTuple
+except ImportError:
+    # Без ML-Agents доступна только заглушка с тем же API (unity_stub.py)
+    from .unity_stub import ActionTuple
+    UnityEnvironment = None
 import numpy as np
 from gymnasium import spaces
 import gymnasium as gym
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvIndices, VecEnvStepReturn
 
 
 class UnityCarrierWrapper(gym.Env):
@@ -115,4 +125,178 @@ class UnityCarrierWrapper(gym.Env):
         """Режим рендеринга (опционально)"""
         if mode == 'rgb_array':
             return self.current_obs['field']
-        return None
\ No newline at end of file
+        return None
+
+
+class UnityVecEnv(VecEnv):
+    """
+    Векторная среда поверх нескольких экземпляров Unity: каждый агент каждой сцены - свой слот VecEnv.
+    Действия всех агентов сцены уходят одним ActionTuple, экземпляры Unity (отдельные процессы
+    с разными worker_id) шагают параллельно: вызовы gRPC отпускают GIL, поэтому хватает пула потоков.
+    Агенты, не запросившие решения на этом шаге, получают нулевую награду и прежнее наблюдение.
+    Наблюдения сцены - три массива (поле, позиция, цель) или один вектор: поле построчно и 4 координаты.
+    """
+
+    def __init__(self, file_name: Optional[str] = None, num_workers: int = 1, base_worker_id: int = 0,
+                 seed: int = 42, no_graphics: bool = True, field_shape: Optional[tuple[int, int]] = None,
+                 env_factory: Optional[Callable[[int], Any]] = None):
+        if env_factory is None:
+            if UnityEnvironment is None:
+                raise ImportError('Unity bridge requires mlagents_envs: pip install mlagents-envs')
+
+            def env_factory(worker_id: int):
+                return UnityEnvironment(file_name=file_name, worker_id=worker_id, seed=seed + worker_id,
+                                        side_channels=[], no_graphics=no_graphics)
+
+        self._pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.unity_envs = list(self._pool.map(env_factory, range(base_worker_id, base_worker_id + num_workers)))
+        self.behavior_name = list(self.unity_envs[0].behavior_specs.keys())[0]
+        spec = self.unity_envs[0].behavior_specs[self.behavior_name]
+
+        obs_shapes = [tuple(obs_spec.shape) for obs_spec in spec.observation_specs]
+        if len(obs_shapes) == 1:
+            size = obs_shapes[0][0] - 4
+            side = int(np.sqrt(size))
+            self.field_shape = tuple(field_shape) if field_shape is not None else (side, size // side)
+        else:
+            self.field_shape = obs_shapes[0]
+        self._split_vector = len(obs_shapes) == 1
+        high = max(self.field_shape) - 1
+
+        # Слоты агентов каждой сцены: agent_id -> номер слота, слоты сцены идут подряд
+        self._steps = list(self._pool.map(self._reset_worker, self.unity_envs))
+        self._slots: list[dict[int, int]] = []
+        self._worker_slots: list[np.ndarray] = []
+        offset = 0
+        for decision, _ in self._steps:
+            ids = decision.agent_id.tolist()
+            self._slots.append({agent_id: offset + k for k, agent_id in enumerate(ids)})
+            self._worker_slots.append(np.arange(offset, offset + len(ids)))
+            offset += len(ids)
+
+        observation_space = spaces.Dict({
+            'field': spaces.Box(low=0, high=2, shape=self.field_shape, dtype=np.int8),
+            'pos': spaces.Box(low=0, high=high, shape=(2,), dtype=np.int64),
+            'target': spaces.Box(low=0, high=high, shape=(2,), dtype=np.int64),
+        })
+        self.render_mode = None
+        super().__init__(offset, observation_space, spaces.Discrete(5))
+
+        self.field = np.zeros((offset, *self.field_shape), dtype=np.int8)
+        self.pos = np.zeros((offset, 2), dtype=np.int64)
+        self.target = np.zeros((offset, 2), dtype=np.int64)
+        self._futures = []
+        # Сцены уже сброшены выше: первый reset() берет эти шаги, а не сбрасывает Unity второй раз
+        self._fresh = True
+
+    def _reset_worker(self, unity_env):
+        unity_env.reset()
+        return unity_env.get_steps(self.behavior_name)
+
+    def _step_worker(self, unity_env):
+        unity_env.step()
+        return unity_env.get_steps(self.behavior_name)
+
+    def _split(self, obs_list: list) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Наблюдения пачки агентов Unity -> поле (n, H, W), позиция и цель (n, 2)."""
+        if self._split_vector:
+            vector = obs_list[0]
+            field = vector[:, :-4].reshape(-1, *self.field_shape)
+            return field, vector[:, -4:-2], vector[:, -2:]
+        return obs_list[0].reshape(-1, *self.field_shape), obs_list[1].reshape(-1, 2), obs_list[2].reshape(-1, 2)
+
+    def _agent_slots(self, worker: int, agent_ids: np.ndarray) -> np.ndarray:
+        slots = self._slots[worker]
+        result = np.empty(len(agent_ids), dtype=np.int64)
+        for k, agent_id in enumerate(agent_ids.tolist()):
+            if agent_id not in slots:
+                # Новый агент занимает слот агента, который завершил эпизод и больше не появлялся
+                active = set(slots.values())
+                free = [slot for slot in self._worker_slots[worker].tolist() if slot not in active]
+                if not free:
+                    raise RuntimeError('Unity scene has more agents than at startup')
+                slots[agent_id] = free[0]
+            result[k] = slots[agent_id]
+        return result
+
+    def _write_obs(self, slots: np.ndarray, obs_list: list) -> None:
+        field, pos, target = self._split(obs_list)
+        self.field[slots] = field
+        self.pos[slots] = pos
+        self.target[slots] = target
+
+    def _get_obs(self) -> dict[str, np.ndarray]:
+        return {'field': self.field.copy(), 'pos': self.pos.copy(), 'target': self.target.copy()}
+
+    def reset(self):
+        if not self._fresh:
+            self._steps = list(self._pool.map(self._reset_worker, self.unity_envs))
+        self._fresh = False
+        for worker, (decision, _) in enumerate(self._steps):
+            self._write_obs(self._agent_slots(worker, decision.agent_id), decision.obs)
+        self._reset_seeds()
+        self._reset_options()
+        return self._get_obs()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._fresh = False
+        actions = np.asarray(actions).reshape(self.num_envs)
+        for worker, (unity_env, (decision, _)) in enumerate(zip(self.unity_envs, self._steps)):
+            if len(decision):
+                slots = self._agent_slots(worker, decision.agent_id)
+                unity_env.set_actions(self.behavior_name,
+                                      ActionTuple(discrete=actions[slots].reshape(-1, 1).astype(np.int32)))
+        self._futures = [self._pool.submit(self._step_worker, unity_env) for unity_env in self.unity_envs]
+
+    def step_wait(self) -> VecEnvStepReturn:
+        self._steps = [future.result() for future in self._futures]
+        self._futures = []
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos: list[dict[str, Any]] = [{} for _ in range(self.num_envs)]
+
+        for worker, (decision, terminal) in enumerate(self._steps):
+            if len(terminal):
+                slots = self._agent_slots(worker, terminal.agent_id)
+                rewards[slots] = terminal.reward
+                dones[slots] = True
+                field, pos, target = self._split(terminal.obs)
+                for k, slot in enumerate(slots.tolist()):
+                    infos[slot]['terminal_observation'] = {
+                        'field': field[k].astype(np.int8), 'pos': pos[k].astype(np.int64),
+                        'target': target[k].astype(np.int64),
+                    }
+                    infos[slot]['TimeLimit.truncated'] = bool(terminal.interrupted[k])
+                # Агент без нового решения остается в слоте с последним наблюдением
+                self._write_obs(slots, terminal.obs)
+                for agent_id in np.setdiff1d(terminal.agent_id, decision.agent_id).tolist():
+                    del self._slots[worker][agent_id]
+            if len(decision):
+                slots = self._agent_slots(worker, decision.agent_id)
+                # Награда агента, только что начавшего новый эпизод, относится к новому эпизоду
+                rewards[slots] += np.where(dones[slots], 0, decision.reward)
+                self._write_obs(slots, decision.obs)
+
+        return self._get_obs(), rewards, dones, infos
+
+    def close(self) -> None:
+        for future in self._futures:
+            future.result()
+        list(self._pool.map(lambda unity_env: unity_env.close(), self.unity_envs))
+        self._pool.shutdown()
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> list[Any]:
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> list[Any]:
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class: type[gym.Wrapper], indices: VecEnvIndices = None) -> list[bool]:
+        return [False for _ in self._get_indices(indices)]
+
+    def get_images(self) -> Sequence[Optional[np.ndarray]]:
+        return list(self.field.copy())
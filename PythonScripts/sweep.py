@@ -0,0 +1,220 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Optional
+
+import numpy as np
+
+# Параметры испытания, которые не передаются алгоритму
+TRIAL_KEYS = ('algo', 'size', 'seed', 'n_envs', 'timesteps', 'max_episode_steps')
+DEFAULTS = {'algo': 'PPO', 'size': 5, 'seed': 0, 'n_envs': 16, 'timesteps': 1_000_000, 'max_episode_steps': 100}
+# Испытания сравниваются правилом медианы только внутри группы с одинаковыми значениями этих параметров:
+# доля побед на 10x10 несравнима с 5x5, а контрольная точка k при другом числе шагов - другой момент обучения
+STOP_GROUP = ('algo', 'size', 'timesteps', 'max_episode_steps')
+
+EXAMPLE_SPACE = {
+    'algo': ['PPO', 'A2C'],
+    'size': [5, 10],
+    'seed': [0, 1, 2],
+    'learning_rate': {'log_uniform': [1e-5, 1e-3]},
+    'gamma': [0.95, 0.99],
+    'n_steps': [128, 256],
+    'timesteps': 2_000_000,
+}
+
+
+def _is_choice(value: Any) -> bool:
+    return isinstance(value, list) or (isinstance(value, dict) and len(value) == 1
+                                       and next(iter(value)) in ('uniform', 'log_uniform', 'int_uniform'))
+
+
+def grid(space: dict) -> list[dict]:
+    """Все сочетания списков значений. Распределения в переборе по сетке не допускаются."""
+    keys = [key for key, value in space.items() if _is_choice(value)]
+    for key in keys:
+        if not isinstance(space[key], list):
+            raise ValueError(f'Grid search needs an explicit list for {key}')
+    fixed = {key: value for key, value in space.items() if key not in keys}
+    return [{**DEFAULTS, **fixed, **dict(zip(keys, values))}
+            for values in itertools.product(*(space[key] for key in keys))]
+
+
+def sample(space: dict, count: int, seed: int = 0) -> list[dict]:
+    """Случайный поиск: списки - равновероятный выбор, {'uniform'|'log_uniform'|'int_uniform': [a, b]}."""
+    rng = np.random.default_rng(seed)
+    trials = []
+    for _ in range(count):
+        trial = dict(DEFAULTS)
+        for key, value in space.items():
+            if isinstance(value, list):
+                trial[key] = value[rng.integers(len(value))]
+            elif _is_choice(value):
+                kind, (low, high) = next(iter(value.items()))
+                if kind == 'uniform':
+                    trial[key] = float(rng.uniform(low, high))
+                elif kind == 'log_uniform':
+                    trial[key] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+                else:
+                    trial[key] = int(rng.integers(low, high + 1))
+            else:
+                trial[key] = value
+        trials.append(trial)
+    return trials
+
+
+def _median_stop(progress: Any, group: tuple, trial_id: int, checkpoint: int, success: float,
+                 min_trials: int) -> bool:
+    """
+    Правило медианы: испытание останавливается, если на этой контрольной точке его доля побед ниже
+    медианы долей побед на той же точке у остальных испытаний его группы (см. STOP_GROUP), дошедших до нее.
+    """
+    progress[group, checkpoint, trial_id] = success
+    others = [value for (other_group, other_checkpoint, other_id), value in progress.items()
+              if other_group == group and other_checkpoint == checkpoint and other_id != trial_id]
+    return len(others) >= min_trials and success < statistics.median(others)
+
+
+def run_trial(trial_id: int, trial: dict, out_dir: str, threads: int, progress: Any = None, evals: int = 5,
+              eval_episodes: int = 500, min_trials: int = 3, stop_group: tuple = STOP_GROUP) -> dict:
+    """Обучение одного испытания в процессе пула. Модель и meta.json сохраняются в out_dir/trial_<id>."""
+    import torch
+    from stable_baselines3 import A2C, PPO
+    from stable_baselines3.common.callbacks import BaseCallback
+
+    from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+    from evaluate import evaluate, make_episodes
+    from telemetry import TelemetryCallback
+
+    torch.set_num_threads(threads)
+    directory = os.path.join(out_dir, f'trial_{trial_id:04d}')
+    os.makedirs(directory, exist_ok=True)
+    size = trial['size']
+    algo_kwargs = {key: value for key, value in trial.items() if key not in TRIAL_KEYS}
+    env = CarrierRobotVecEnv(trial['n_envs'], width=size, height=size, seed=trial['seed'],
+                             max_episode_steps=trial['max_episode_steps'])
+    algo = {'PPO': PPO, 'A2C': A2C}[trial['algo']]
+    model = algo('MultiInputPolicy', env, seed=trial['seed'], device='cpu', **algo_kwargs)
+    # Один набор эпизодов для всех испытаний этого размера
+    episodes = make_episodes(eval_episodes, size, size, seed=12345)
+
+    class EvalCallback(BaseCallback):
+        def __init__(self):
+            super().__init__()
+            self.every = max(1, trial['timesteps'] // evals)
+            self.next_eval = self.every
+            self.history: list[dict] = []
+            self.stopped = False
+
+        def _on_step(self) -> bool:
+            if self.num_timesteps < self.next_eval:
+                return True
+            self.next_eval += self.every
+            result = evaluate(model, episodes, num_envs=min(256, eval_episodes), max_steps=trial['max_episode_steps'])
+            result['timesteps'] = self.num_timesteps
+            self.history.append(result)
+            group = tuple(trial.get(key) for key in stop_group)
+            if progress is not None and _median_stop(progress, group, trial_id, len(self.history),
+                                                     result['success_rate'], min_trials):
+                self.stopped = True
+                return False
+            return True
+
+    evaluation = EvalCallback()
+    start = time.perf_counter()
+    model.learn(trial['timesteps'], callback=[evaluation, TelemetryCallback(os.path.join(directory, 'telemetry.csv'))])
+    elapsed = time.perf_counter() - start
+    final = evaluation.history[-1] if evaluation.history else \
+        evaluate(model, episodes, num_envs=min(256, eval_episodes), max_steps=trial['max_episode_steps'])
+    model.save(os.path.join(directory, 'model.zip'))
+
+    result = {
+        'trial': trial_id,
+        **trial,
+        'timesteps_done': model.num_timesteps,
+        'early_stopped': evaluation.stopped,
+        'success_rate': final['success_rate'],
+        'mean_steps': final['mean_steps'],
+        'train_seconds': round(elapsed, 1),
+        'steps_per_sec': model.num_timesteps / elapsed if elapsed else 0.0,
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'result': result, 'params': trial, 'evaluations': evaluation.history,
+                   'torch_threads': threads}, f, indent=2)
+    return result
+
+
+def run_sweep(trials: list[dict], out_dir: str, workers: Optional[int] = None, threads_per_trial: int = 1,
+              early_stop: bool = True, **trial_kwargs) -> list[dict]:
+    """
+    Испытания раздаются пулу процессов: по умолчанию ядра делятся между процессами так,
+    что каждому достается threads_per_trial потоков torch.
+    """
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_trial)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'trials.json'), 'w') as f:
+        json.dump(trials, f, indent=2)
+
+    # spawn: форк процесса с уже запущенными потоками torch может зависнуть
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with context.Manager() as manager, ProcessPoolExecutor(workers, mp_context=context) as pool:
+        progress = manager.dict() if early_stop else None
+        futures = {pool.submit(run_trial, i, trial, out_dir, threads_per_trial, progress, **trial_kwargs): i
+                   for i, trial in enumerate(trials)}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # noqa: BLE001 - упавшее испытание не останавливает перебор
+                result = {'trial': futures[future], **trials[futures[future]], 'error': repr(e)}
+            results.append(result)
+            print(json.dumps(result), flush=True)
+            _write_table(results, os.path.join(out_dir, 'results.csv'))
+    return sorted(results, key=lambda result: -result.get('success_rate', -1))
+
+
+def _write_table(results: list[dict], path: str) -> None:
+    columns = list(dict.fromkeys(key for result in results for key in result))
+    rows = sorted(results, key=lambda result: -result.get('success_rate', -1))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Перебор гиперпараметров, размеров и seed на пуле процессов')
+    parser.add_argument('space', nargs='?', help='JSON с пространством поиска (по умолчанию пример EXAMPLE_SPACE)')
+    parser.add_argument('--out', default='sweeps/sweep')
+    parser.add_argument('--random', type=int, metavar='N', help='Случайный поиск из N испытаний вместо сетки')
+    parser.add_argument('--seed', type=int, default=0, help='Seed случайного поиска')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads-per-trial', type=int, default=1)
+    parser.add_argument('--evals', type=int, default=5, help='Сколько раз оценивать испытание за обучение')
+    parser.add_argument('--eval-episodes', type=int, default=500)
+    parser.add_argument('--no-early-stop', action='store_true')
+    parser.add_argument('--stop-group', nargs='+', default=list(STOP_GROUP),
+                        help='Параметры, внутри одинаковых значений которых испытания сравниваются правилом медианы')
+    args = parser.parse_args(argv)
+
+    space = EXAMPLE_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    trials = sample(space, args.random, args.seed) if args.random else grid(space)
+    results = run_sweep(trials, args.out, args.workers, args.threads_per_trial, not args.no_early_stop,
+                        evals=args.evals, eval_episodes=args.eval_episodes, stop_group=tuple(args.stop_group))
+
+    columns = ('trial', 'algo', 'size', 'seed', 'success_rate', 'timesteps_done', 'early_stopped')
+    print(' '.join(f'{column:>14s}' for column in columns))
+    for result in results:
+        print(' '.join(f'{str(result.get(column, "")):>14s}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import argparse
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+from environment.carrier_robot_gym.profiling import PROFILER
+from environment.carrier_robot_gym.shared_vec_env import SharedMemoryVecEnv
+
+FIELDS = ('timesteps', 'wall_time', 'steps_per_sec', 'episodes', 'mean_return', 'mean_length', 'mean_step_reward',
+          'win_rate', 'collision_rate', 'off_grid_rate', 'timeout_rate')
+
+
+def run_log_path(name: str, extension: str = 'csv', directory: str = 'logs') -> str:
+    """Свой файл лога для каждого запуска: logs/<name>-<дата>-<время>-<pid>.<extension>."""
+    return os.path.join(directory, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.{extension}')
+
+
+class _CsvWriter(threading.Thread):
+    """Фоновая дозапись строк в CSV, чтобы обучение не ждало диска."""
+
+    def __init__(self, path: str):
+        super().__init__(daemon=True)
+        self.path = path
+        self.rows: queue.Queue = queue.Queue()
+
+    def run(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            if new_file:
+                writer.writeheader()
+            while (row := self.rows.get()) is not None:
+                writer.writerow(row)
+                f.flush()
+
+
+class TelemetryCallback(BaseCallback):
+    """
+    Статистика обучения по всем средам: награды и длины эпизодов копятся векторно в массивах NumPy,
+    Python-цикл идет только по завершившимся эпизодам. Каждые flush_every секунд строка со средними
+    за интервал уходит в фоновый поток, который дописывает ее в CSV (по умолчанию новый файл на запуск,
+    чтобы прогоны не смешивались в одном ряду).
+    Исходы эпизодов как в evaluate.py: победа, выход за поле (награда меньше -10), столкновение, лимит шагов.
+    """
+
+    def __init__(self, path: Optional[str] = None, flush_every: float = 10.0, verbose: int = 0):
+        super().__init__(verbose)
+        self.path = path or run_log_path('telemetry')
+        self.flush_every = flush_every
+        self._writer: Optional[_CsvWriter] = None
+
+    def _on_training_start(self) -> None:
+        count = self.training_env.num_envs
+        self.episode_return = np.zeros(count)
+        self.episode_length = np.zeros(count, dtype=np.int64)
+        self._writer = _CsvWriter(self.path)
+        self._writer.start()
+        self._start = self._last_flush = time.perf_counter()
+        self._last_timesteps = self.num_timesteps
+        self._reset_interval()
+
+    def _reset_interval(self) -> None:
+        self.reward_sum = 0.0
+        self.steps = 0
+        self.episodes = 0
+        self.return_sum = 0.0
+        self.length_sum = 0
+        # Победы, столкновения, выходы за поле, лимит шагов
+        self.outcomes = np.zeros(4, dtype=np.int64)
+
+    def _on_step(self) -> bool:
+        rewards = self.locals['rewards']
+        dones = self.locals['dones']
+        self.episode_return += rewards
+        self.episode_length += 1
+        self.reward_sum += float(rewards.sum())
+        self.steps += len(rewards)
+
+        done = np.flatnonzero(dones)
+        if len(done):
+            self.episodes += len(done)
+            self.return_sum += float(self.episode_return[done].sum())
+            self.length_sum += int(self.episode_length[done].sum())
+            infos = self.locals['infos']
+            for i in done:
+                info = infos[i]
+                if info.get('win'):
+                    self.outcomes[0] += 1
+                elif info.get('TimeLimit.truncated'):
+                    self.outcomes[3] += 1
+                elif rewards[i] < -10:
+                    self.outcomes[2] += 1
+                else:
+                    self.outcomes[1] += 1
+            self.episode_return[done] = 0
+            self.episode_length[done] = 0
+
+        if time.perf_counter() - self._last_flush >= self.flush_every:
+            self._flush()
+        return True
+
+    def _flush(self) -> None:
+        now = time.perf_counter()
+        episodes = max(self.episodes, 1)
+        row = {
+            'timesteps': self.num_timesteps,
+            'wall_time': round(now - self._start, 3),
+            'steps_per_sec': (self.num_timesteps - self._last_timesteps) / max(now - self._last_flush, 1e-9),
+            'episodes': self.episodes,
+            'mean_return': self.return_sum / episodes if self.episodes else '',
+            'mean_length': self.length_sum / episodes if self.episodes else '',
+            'mean_step_reward': self.reward_sum / max(self.steps, 1),
+            'win_rate': self.outcomes[0] / episodes,
+            'collision_rate': self.outcomes[1] / episodes,
+            'off_grid_rate': self.outcomes[2] / episodes,
+            'timeout_rate': self.outcomes[3] / episodes,
+        }
+        self._writer.rows.put(row)
+        if self.verbose:
+            print(', '.join(f'{key}={value:.3g}' if isinstance(value, float) else f'{key}={value}'
+                            for key, value in row.items()))
+        self._last_flush = now
+        self._last_timesteps = self.num_timesteps
+        self._reset_interval()
+
+    def _on_training_end(self) -> None:
+        if self.steps:
+            self._flush()
+        self._writer.rows.put(None)
+        self._writer.join()
+
+
+class ProfilingCallback(BaseCallback):
+    """
+    Включает PROFILER на время обучения и добавляет в него время фаз цикла обучения:
+    train.rollout - сбор роллаута (шаги сред и прямые проходы политики), train.update - обновление сети
+    между роллаутами. Каждые dump_every секунд снимок дописывается в path (строки JSON, по умолчанию
+    новый файл на запуск). У SharedMemoryVecEnv PROFILER включается и в воркерах, их снимки собираются
+    через каналы управления и добавляются с префиксом workers. (время суммируется по воркерам).
+    """
+
+    def __init__(self, path: Optional[str] = None, dump_every: float = 60.0, verbose: int = 0):
+        super().__init__(verbose)
+        self.path = path or run_log_path('profile', 'jsonl')
+        self.dump_every = dump_every
+        self._rollout_start: Optional[float] = None
+        self._update_start: Optional[float] = None
+
+    def _on_training_start(self) -> None:
+        self._was_enabled = PROFILER.enabled
+        PROFILER.enable()
+        PROFILER.reset()
+        env = self.training_env
+        while isinstance(env, VecEnvWrapper):
+            env = env.venv
+        self._workers = env if isinstance(env, SharedMemoryVecEnv) else None
+        if self._workers is not None:
+            self._workers.profile(True)
+        self._last_dump = time.perf_counter()
+
+    def _on_rollout_start(self) -> None:
+        now = time.perf_counter()
+        if self._update_start is not None:
+            PROFILER.add_time('train.update', now - self._update_start)
+            self._update_start = None
+        self._rollout_start = now
+        if now - self._last_dump >= self.dump_every:
+            self._dump()
+
+    def _on_step(self) -> bool:
+        return True
+
+    def _on_rollout_end(self) -> None:
+        now = time.perf_counter()
+        PROFILER.add_time('train.rollout', now - self._rollout_start)
+        self._update_start = now
+
+    def _dump(self) -> None:
+        PROFILER.count('train.timesteps', self.num_timesteps - getattr(self, '_dumped_timesteps', 0))
+        self._dumped_timesteps = self.num_timesteps
+        if self._workers is not None and not self._workers.closed:
+            for snapshot in self._workers.profile(True):
+                PROFILER.merge(snapshot, 'workers.')
+        snapshot = PROFILER.dump(self.path)
+        self._last_dump = time.perf_counter()
+        if self.verbose:
+            print(format_profile(snapshot))
+
+    def _on_training_end(self) -> None:
+        if self._update_start is not None:
+            PROFILER.add_time('train.update', time.perf_counter() - self._update_start)
+            self._update_start = None
+        self._dump()
+        if not self._was_enabled:
+            PROFILER.disable()
+            if self._workers is not None and not self._workers.closed:
+                self._workers.profile(False)
+
+
+def load_profile(path: str) -> dict:
+    """Снимки профиля из файла, сложенные в один: суммы времени, вызовов и счетчиков, максимумы."""
+    timers: dict[str, list] = {}
+    counters: dict[str, int] = {}
+    interval = 0.0
+    with open(path) as f:
+        for line in f:
+            snapshot = json.loads(line)
+            interval += snapshot['interval']
+            for name, timer in snapshot['timers'].items():
+                total = timers.setdefault(name, [0, 0.0, 0.0])
+                total[0] += timer['calls']
+                total[1] += timer['total_ms']
+                total[2] = max(total[2], timer['max_us'])
+            for name, value in snapshot['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+    return {
+        'interval': interval,
+        'timers': {name: {'calls': calls, 'total_ms': total, 'mean_us': total / calls * 1000, 'max_us': longest}
+                   for name, (calls, total, longest) in timers.items()},
+        'counters': counters,
+    }
+
+
+def format_profile(profile: dict) -> str:
+    """Таблица участков по убыванию суммарного времени с долей от длительности интервала."""
+    interval_ms = max(profile['interval'] * 1000, 1e-9)
+    lines = [f'{"section":28s} {"calls":>10s} {"total s":>10s} {"share":>7s} {"mean us":>10s} {"max us":>10s}']
+    for name, timer in sorted(profile['timers'].items(), key=lambda item: -item[1]['total_ms']):
+        lines.append(f'{name:28s} {timer["calls"]:10d} {timer["total_ms"] / 1000:10.2f} '
+                     f'{timer["total_ms"] / interval_ms:7.1%} {timer["mean_us"]:10.1f} {timer["max_us"]:10.1f}')
+    for name, value in sorted(profile['counters'].items()):
+        lines.append(f'{name:28s} {value:10d}')
+    return '\n'.join(lines)
+
+
+def load_run(path: str) -> dict[str, np.ndarray]:
+    """Лог телеметрии как столбцы NumPy (пустые значения - NaN)."""
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return {key: np.array([float(row[key]) if row[key] != '' else np.nan for row in rows]) for key in FIELDS}
+
+
+def summarize(paths: list[str], last: int = 5) -> list[dict]:
+    """Итог каждого прогона: средние последних last строк лога."""
+    summary = []
+    for path in paths:
+        run = load_run(path)
+        result = {'run': os.path.basename(path), 'timesteps': int(run['timesteps'][-1]) if len(run['timesteps']) else 0}
+        for key in FIELDS[2:]:
+            values = run[key][-last:]
+            result[key] = float(np.nanmean(values)) if np.isfinite(values).any() else None
+        summary.append(result)
+    return summary
+
+
+def plot_runs(paths: list[str], metrics: tuple = ('mean_return', 'win_rate', 'steps_per_sec'),
+              out: Optional[str] = None) -> None:
+    from matplotlib import pyplot as plt
+
+    figure, axes = plt.subplots(len(metrics), 1, figsize=(12, 3 * len(metrics)), sharex=True, squeeze=False)
+    for path in paths:
+        run = load_run(path)
+        for ax, metric in zip(axes[:, 0], metrics):
+            ax.plot(run['timesteps'], run[metric], label=os.path.basename(path))
+    for ax, metric in zip(axes[:, 0], metrics):
+        ax.set_title(metric)
+        ax.grid(True)
+    axes[0, 0].legend()
+    axes[-1, 0].set_xlabel('timesteps')
+    figure.tight_layout()
+    if out:
+        figure.savefig(out)
+    else:
+        plt.show()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Графики и сравнение логов телеметрии обучения')
+    commands = parser.add_subparsers(dest='command', required=True)
+    plot = commands.add_parser('plot', help='Графики метрик по шагам обучения')
+    plot.add_argument('logs', nargs='+')
+    plot.add_argument('--metrics', nargs='+', default=['mean_return', 'win_rate', 'steps_per_sec'],
+                      choices=FIELDS[2:])
+    plot.add_argument('--out', help='Сохранить в файл вместо окна')
+    compare = commands.add_parser('compare', help='Таблица средних последних строк каждого лога')
+    compare.add_argument('logs', nargs='+')
+    compare.add_argument('--last', type=int, default=5)
+    profile = commands.add_parser('profile', help='Сводка профиля горячего пути (ProfilingCallback, PROFILER.dump)')
+    profile.add_argument('log')
+    args = parser.parse_args(argv)
+
+    if args.command == 'profile':
+        print(format_profile(load_profile(args.log)))
+        return
+
+    if args.command == 'plot':
+        plot_runs(args.logs, tuple(args.metrics), args.out)
+        return
+    summary = summarize(args.logs, args.last)
+    columns = list(summary[0])
+    print(' '.join(f'{column:>16s}' for column in columns))
+    for result in summary:
+        print(' '.join(f'{value:>16.4g}' if isinstance(value, float) else f'{str(value):>16s}'
+                       for value in result.values()))
+
+
+if __name__ == '__main__':
+    main()
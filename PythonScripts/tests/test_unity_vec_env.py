@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from environment.carrier_robot_gym.vec_env import CarrierRobotVecEnv
+from src.unity_stub import StubUnityEnvironment
+from src.unity_wrapper import UnityVecEnv
+
+WORKERS, AGENTS, SIZE, EPISODE_STEPS = 2, 4, 5, 20
+
+
+def _reference_envs() -> list[CarrierRobotVecEnv]:
+    """Те же склады, что у заглушек: у сцены worker_id своя CarrierRobotVecEnv с seed = worker_id."""
+    return [CarrierRobotVecEnv(AGENTS, width=SIZE, height=SIZE, seed=worker_id, max_episode_steps=EPISODE_STEPS)
+            for worker_id in range(WORKERS)]
+
+
+def _unity_env(respawn: bool) -> UnityVecEnv:
+    return UnityVecEnv(num_workers=WORKERS, env_factory=lambda worker_id: StubUnityEnvironment(
+        worker_id=worker_id, agents=AGENTS, width=SIZE, height=SIZE, max_episode_steps=EPISODE_STEPS,
+        respawn=respawn))
+
+
+def _assert_obs_equal(obs: dict, expected: dict) -> None:
+    for key in ('field', 'pos', 'target'):
+        np.testing.assert_array_equal(obs[key], expected[key], err_msg=key)
+
+
+@pytest.mark.parametrize('respawn', [False, True], ids=['same_ids', 'respawn'])
+def test_unity_vec_env_matches_carrier_robot_vec_env(respawn: bool):
+    env = _unity_env(respawn)
+    references = _reference_envs()
+    try:
+        obs = env.reset()
+        expected = [reference.reset() for reference in references]
+        _assert_obs_equal(obs, {key: np.concatenate([e[key] for e in expected]) for key in expected[0]})
+
+        rng = np.random.default_rng(0)
+        finished = 0
+        for _ in range(300):
+            actions = rng.integers(0, 5, env.num_envs)
+            obs, rewards, dones, infos = env.step(actions)
+            steps = [reference.step(actions[w * AGENTS:(w + 1) * AGENTS]) for w, reference in enumerate(references)]
+
+            _assert_obs_equal(obs, {key: np.concatenate([step[0][key] for step in steps]) for key in steps[0][0]})
+            np.testing.assert_array_equal(rewards, np.concatenate([step[1] for step in steps]))
+            np.testing.assert_array_equal(dones, np.concatenate([step[2] for step in steps]))
+            expected_infos = [info for step in steps for info in step[3]]
+            for slot in np.flatnonzero(dones):
+                assert infos[slot]['TimeLimit.truncated'] == expected_infos[slot]['TimeLimit.truncated']
+                _assert_obs_equal(infos[slot]['terminal_observation'], expected_infos[slot]['terminal_observation'])
+            finished += int(dones.sum())
+        assert finished > 0
+        if respawn:
+            # Слоты сохранились, хотя все агенты закончившихся эпизодов пришли с новыми agent_id
+            assert all(len(slots) == AGENTS for slots in env._slots)
+            assert max(max(slots) for slots in env._slots) >= WORKERS * AGENTS
+    finally:
+        env.close()
+        for reference in references:
+            reference.close()
+
+
+def test_first_reset_does_not_reset_unity_again():
+    env = _unity_env(respawn=False)
+    try:
+        resets = []
+        for unity_env in env.unity_envs:
+            original = unity_env.reset
+            unity_env.reset = lambda original=original: (resets.append(1), original())[1]
+        env.reset()
+        assert not resets
+        env.step(np.zeros(env.num_envs, dtype=np.int64))
+        env.reset()
+        assert len(resets) == WORKERS
+    finally:
+        env.close()